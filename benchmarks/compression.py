@@ -0,0 +1,99 @@
+"""How much quality each embedding size and precision setting costs.
+
+    python -m benchmarks.compression                     # synthetic clustered library
+    python -m benchmarks.compression -n 5000 --dim 3072 --pca 512 256 64
+    python -m benchmarks.compression --db bookshelf.db --model text-embedding-3-large
+
+Every setting (float16, int8, PCA to each size, prefix truncation to each
+size, and the PCA sizes again in int8) is compared with the float32 vectors:
+
+- bytes per stored vector
+- recall@k of the exact k nearest neighbours computed on the compact form
+- length of a tour solved on the compact form, measured in the full space,
+  relative to the tour solved on the full vectors (1.00 is no loss)
+
+Truncation mimics the API's dimensions parameter, which keeps a renormalised
+prefix. That only works well for models trained for it (text-embedding-3),
+so on synthetic vectors it is a worst case.
+"""
+import argparse
+import sqlite3
+import time
+import numpy as np
+
+from benchmarks.synthetic import clustered
+from utils.distance import distance_matrix
+from utils.quantize import QuantizedVectors, as_float32
+from utils.reduce import fit_pca
+from utils.sparse_tsp import knn_graph, path_distances, solve_sparse
+from utils.store import load_embeddings
+
+
+def truncate(X, dim):
+    prefix = X[:, :dim]
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms > 0, norms, 1)
+
+
+def pca(X, dim):
+    mean, components, explained = fit_pca(X, dim)
+    return (X - mean) @ components.T
+
+
+def settings(X, sizes):
+    yield 'float32', X
+    yield 'float16', X.astype(np.float16)
+    yield 'int8', QuantizedVectors.quantize(X)
+    for dim in sizes:
+        reduced = pca(X, dim)
+        yield f'pca{dim}', reduced
+        yield f'pca{dim} int8', QuantizedVectors.quantize(reduced)
+    for dim in sizes:
+        yield f'truncate{dim}', truncate(X, dim)
+
+
+def tour_length(X_full, X, k, time_limit):
+    """Full-space length of the sparse tour solved on X"""
+    neighbours, _ = knn_graph(X, k)
+    permutation, _ = solve_sparse(as_float32(X), k, time_limit, neighbours=neighbours)
+    p = np.asarray(permutation)
+    return float(path_distances(X_full, p[:-1], p[1:]).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='Use the vectors stored in this bookshelf.db instead of synthetic ones')
+    parser.add_argument('--model', default='text-embedding-3-large', help='Model of the stored vectors (with --db)')
+    parser.add_argument('-n', type=int, default=3000, help='Synthetic books')
+    parser.add_argument('--dim', type=int, default=1024, help='Synthetic embedding dimension')
+    parser.add_argument('--pca', type=int, nargs='+', default=[256, 128, 64], help='Reduced sizes to try')
+    parser.add_argument('-k', type=int, default=10, help='Neighbours for recall and the tour search')
+    parser.add_argument('--time-limit', type=float, default=5, help='Seconds per tour solve')
+    args = parser.parse_args()
+
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        _, _, X = load_embeddings(conn, args.model)
+        conn.close()
+        X = as_float32(X)
+    else:
+        X, _ = clustered(args.n, args.dim)
+    sizes = [dim for dim in args.pca if dim < X.shape[1]]
+    print(f"{len(X)} vectors of {X.shape[1]} dimensions")
+
+    truth, _ = knn_graph(X, args.k)
+    base_length = tour_length(X, X, args.k, args.time_limit)
+    print(f"{'setting':>14} {'bytes':>7} {'matrix s':>9} {'recall@' + str(args.k):>10} {'tour':>6}")
+    for name, Xc in settings(X, sizes):
+        per_vector = Xc.nbytes / len(X)
+        start = time.perf_counter()
+        distance_matrix(Xc)
+        matrix_seconds = time.perf_counter() - start
+        found, _ = knn_graph(Xc, args.k)
+        recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(found, truth)])
+        ratio = tour_length(X, Xc, args.k, args.time_limit) / base_length
+        print(f"{name:>14} {per_vector:>7.0f} {matrix_seconds:>9.3f} {recall:>10.3f} {ratio:>6.3f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Time rendering a tour figure against the number of books.
+
+    python -m benchmarks.render --sizes 1000 10000 100000 --formats png svg html
+
+Coordinates are random 2D points visited in a random order, so only the
+drawing and writing of the figure is measured.
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from utils.render import FORMATS, MAX_LABELS, render_tour
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--labels', type=int, default=MAX_LABELS)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'n':>7} {'format':>7} {'seconds':>9} {'size MB':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            coords = rng.normal(size=(n, 2))
+            titles = [f'Book {i}' for i in range(n)]
+            permutation = rng.permutation(n)
+            for fmt in args.formats:
+                path = os.path.join(directory, f'tour.{fmt}')
+                start = time.perf_counter()
+                render_tour(coords, titles, permutation, path, fmt, args.dpi, args.labels)
+                elapsed = time.perf_counter() - start
+                print(f"{n:>7} {fmt:>7} {elapsed:>9.2f} {os.path.getsize(path) / 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
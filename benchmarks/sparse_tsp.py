@@ -0,0 +1,48 @@
+"""Compare the dense and sparse (kNN graph) TSP paths on synthetic libraries.
+
+    python -m benchmarks.sparse_tsp --sizes 500 1000 2000 --dim 256
+
+Both paths get the same time limit. Tour lengths are open-path lengths
+from book 0, so they are directly comparable.
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.synthetic import clustered
+from utils.sparse_tsp import solve_sparse
+from utils.tsp import no_return_dm, solve_tour
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    _, length = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return length, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--neighbours', type=int, default=10)
+    parser.add_argument('--time-limit', type=float, default=30)
+    args = parser.parse_args()
+
+    print(f"{'n':>7} {'mode':>7} {'length':>12} {'seconds':>9} {'peak MB':>9}")
+    for n in args.sizes:
+        X, _ = clustered(n, args.dim)
+        runs = {
+            'dense': lambda: solve_tour(no_return_dm(X), time_limit=args.time_limit, patience=0),
+            'sparse': lambda: solve_sparse(X, args.neighbours, time_limit=args.time_limit),
+        }
+        for mode, fn in runs.items():
+            length, elapsed, peak = measure(fn)
+            print(f"{n:>7} {mode:>7} {length:>12.2f} {elapsed:>9.2f} {peak / 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Measure CLI startup with python -X importtime and check light commands skip the ML stack.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --commands view scroll --repeat 5
+
+Each command is started as `cli.py <command> --help`, which loads the CLI
+and parses the command without running it. The script exits with status 1
+if any of them imports one of HEAVY, so it can run as a CI check.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIGHT_COMMANDS = ('view', 'scroll', 'search', 'edit', 'add', 'import', 'export')
+
+# top-level packages that only the embed / tsp / similar / serve commands should load
+HEAVY = ('sklearn', 'scipy', 'matplotlib', 'pandas', 'python_tsp', 'adjustText', 'openai', 'seaborn',
+         'fastapi', 'uvicorn')
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def import_profile(command):
+    """(total seconds, {module imported directly by cli.py: cumulative seconds}, every package loaded)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT, 'cli.py'), command, '--help'],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"cli.py {command} --help failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    packages = set()
+    total = 0
+    for self_us, cumulative_us, indent, name in LINE.findall(result.stderr):
+        total += int(self_us)
+        packages.add(name.split('.')[0])
+        # nested imports are already counted in the cumulative time of the top level one (one space of indent)
+        if len(indent) == 1:
+            modules[name] = modules.get(name, 0) + int(cumulative_us) / 1e6
+    return total / 1e6, modules, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', nargs='+', default=list(LIGHT_COMMANDS))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per command, the fastest is reported')
+    parser.add_argument('--top', type=int, default=5, help='Slowest top-level imports to list per command')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'command':>8} {'import s':>9}  heavy modules")
+    for command in args.commands:
+        runs = [import_profile(command) for _ in range(args.repeat)]
+        total, modules, packages = min(runs, key=lambda run: run[0])
+        heavy = sorted(packages.intersection(HEAVY))
+        failed |= bool(heavy)
+        print(f"{command:>8} {total:>9.3f}  {', '.join(heavy) or '-'}")
+        slowest = sorted(modules.items(), key=lambda item: -item[1])[:args.top]
+        print(' ' * 20 + ', '.join(f'{name} {seconds:.3f}' for name, seconds in slowest))
+
+    if failed:
+        print("Light commands import the ML stack, move those imports into the functions that need them")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Time the hot paths of bookshelf on synthetic libraries and compare runs.
+
+    python -m benchmarks.suite run --sizes 100 1000 10000 100000 -o results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.2
+
+run builds a synthetic library per size (see benchmarks.synthetic) and
+times every stage on it, writing one JSON document with the environment
+and a list of {stage, n, seconds} results. Stages that would not fit in
+memory or time at a size (the dense matrix, t-SNE) are recorded as skipped.
+compare matches stages by (stage, n) and exits 1 when any got slower by
+more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.synthetic import make_library
+from cli import BookManager
+from utils.projection import fit_projection
+from utils.render import render_tour
+from utils.sparse_tsp import solve_sparse
+from utils.tsp import get_titles_and_embeddings, no_return_dm, solve_tour
+
+# largest n for the O(n^2) memory stages
+DENSE_MAX = 10000
+# largest n for t-SNE, which is minutes beyond this
+TSNE_MAX = 10000
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+
+def timed(fn, repeat=1):
+    """(fastest seconds, last result) over repeat calls"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def warm_up(directory):
+    """Run the lazily importing stages once so import time is not counted against the first size"""
+    X = np.random.default_rng(0).normal(size=(20, 8)).astype(np.float32)
+    coords, _ = fit_projection(X, 'pca')
+    fit_projection(X, 'pca-tsne')
+    solve_tour(no_return_dm(X), time_limit=1, patience=0)
+    for fmt in ('png', 'svg'):
+        render_tour(coords, [str(i) for i in range(len(X))], list(range(len(X))),
+                    os.path.join(directory, f'warm.{fmt}'), fmt)
+
+
+def run_size(n, args, directory):
+    path = os.path.join(directory, f'library_{n}.db')
+    model = make_library(path, n, args.dim, args.mode, seed=args.seed)
+    results = []
+
+    def record(stage, fn, repeat=1, skip=None):
+        if skip:
+            results.append({'stage': stage, 'n': n, 'seconds': None, 'skipped': skip})
+            print(f"{n:>7} {stage:>26} {'skipped':>9}  {skip}", flush=True)
+            return None
+        seconds, result = timed(fn, repeat)
+        results.append({'stage': stage, 'n': n, 'seconds': seconds})
+        print(f"{n:>7} {stage:>26} {seconds:>9.3f}", flush=True)
+        return result
+
+    manager = BookManager(path)
+    record('get_books', manager.get_books, args.repeat)
+    record('get_books_sorted', lambda: manager.get_books(sort_by_status=True), args.repeat)
+    manager.conn.close()
+    X, titles = record('get_titles_and_embeddings', lambda: get_titles_and_embeddings(path, model), args.repeat)
+
+    too_big = f'n > {args.dense_max}' if n > args.dense_max else None
+    D = record('no_return_dm', lambda: no_return_dm(X), skip=too_big)
+    record('tsp_dense', lambda: solve_tour(D, time_limit=args.time_limit, patience=0), skip=too_big)
+    permutation, _ = record('tsp_sparse', lambda: solve_sparse(X, args.neighbours, time_limit=args.time_limit))
+
+    coords, _ = record('projection_pca', lambda: fit_projection(X, 'pca'))
+    record('projection_pca_tsne', lambda: fit_projection(X, 'pca-tsne'),
+           skip=f'n > {args.tsne_max}' if n > args.tsne_max else None)
+    for fmt in ('png', 'svg'):
+        record(f'render_{fmt}', lambda: render_tour(coords, titles, permutation,
+                                                      os.path.join(directory, f'tour.{fmt}'), fmt))
+    return results
+
+
+def run(args):
+    print(f"{'n':>7} {'stage':>26} {'seconds':>9}")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        warm_up(directory)
+        for n in args.sizes:
+            results.extend(run_size(n, args, directory))
+
+    document = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'func'},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {args.output}")
+    return document
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {(r['stage'], r['n']): r['seconds'] for r in json.load(f)['results']}
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'n':>7} {'stage':>26} {'before':>9} {'after':>9} {'ratio':>7}")
+    for r in current:
+        before, after = baseline.get((r['stage'], r['n'])), r['seconds']
+        if before is None or after is None:
+            continue
+        ratio = after / max(before, 1e-9)
+        # tiny timings are mostly noise, only flag those above min_seconds
+        slower = ratio > 1 + args.threshold and after >= args.min_seconds
+        regressions += slower
+        flag = '  REGRESSION' if slower else ('  faster' if ratio < 1 / (1 + args.threshold) else '')
+        print(f"{r['n']:>7} {r['stage']:>26} {before:>9.3f} {after:>9.3f} {ratio:>7.2f}{flag}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    run_parser.add_argument('--dim', type=int, default=256)
+    run_parser.add_argument('--mode', choices=('clustered', 'random'), default='clustered')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs of the quick database stages, fastest kept')
+    run_parser.add_argument('--time-limit', type=float, default=10, help='Seconds given to each TSP solve')
+    run_parser.add_argument('--neighbours', type=int, default=10)
+    run_parser.add_argument('--dense-max', type=int, default=DENSE_MAX)
+    run_parser.add_argument('--tsne-max', type=int, default=TSNE_MAX)
+    run_parser.add_argument('--output', '-o', help='Write the results to this JSON file')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown ratio flagged, 0.2 is 20%%')
+    compare_parser.add_argument('--min-seconds', type=float, default=0.01, help='Ignore stages faster than this')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Synthetic bookshelf.db libraries for benchmarking.
+
+    python -m benchmarks.synthetic /tmp/bench.db -n 10000 --dim 256
+
+Books get generated titles, authors and topic-flavoured descriptions, and
+an embedding per book stored under the model name synthetic-<dim>. With
+clustered embeddings (the default) books on the same topic sit near each
+other, like real embeddings do; --random draws every vector independently.
+"""
+import argparse
+import os
+import numpy as np
+
+from utils.embed import book_text, content_hash
+from utils.schema import connect
+from utils.store import ensure_embeddings_table, save_embeddings
+
+TOPICS = {
+    'space': 'planet orbit starship colony nebula astronaut gravity alien signal voyage',
+    'history': 'empire war dynasty revolution treaty archive monarchy siege chronicle century',
+    'mystery': 'detective murder clue alibi suspect inspector secret witness motive confession',
+    'science': 'quantum physics experiment theory particle evolution genome climate energy lab',
+    'romance': 'love letter wedding summer heart longing promise reunion village dance',
+    'fantasy': 'dragon magic kingdom sword prophecy wizard quest throne forest curse',
+    'cooking': 'recipe kitchen bread spice garden harvest feast flavour market table',
+    'philosophy': 'mind ethics freedom reason virtue truth meaning language self justice',
+}
+FILLER = ('the a of and in to with from for on an its their into over under after before as by '
+          'story journey world life years people family night city through across between').split()
+FIRST = 'Ada Ben Clara Dev Eli Fay Gus Hana Ivan Jun Kai Lena Milo Nia Omar Pia Quinn Rosa Sam Tess'.split()
+LAST = 'Adams Baker Chen Diaz Evans Fischer Garcia Hughes Ito Jones Kim Lopez Moreau Novak Okafor Patel'.split()
+
+# rows written per executemany
+CHUNK = 5000
+
+
+def model_name(dim):
+    return f'synthetic-{dim}'
+
+
+def clustered(n, dim, clusters=20, seed=0, spread=0.3):
+    """n float32 vectors around clusters random centres, and the cluster of each"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, n)
+    return (centres[labels] + spread * rng.normal(size=(n, dim))).astype(np.float32), labels
+
+
+def random_vectors(n, dim, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dim)).astype(np.float32), rng.integers(0, clusters, n)
+
+
+def make_books(labels, seed=0):
+    """Book dicts whose description words come mostly from the topic of their label"""
+    rng = np.random.default_rng(seed)
+    topics = [words.split() for words in TOPICS.values()]
+    books = []
+    for i, label in enumerate(labels):
+        topic = topics[label % len(topics)]
+        words = [topic[k % len(topic)] if coin < 0.35 else FILLER[k % len(FILLER)]
+                 for coin, k in zip(rng.random(rng.integers(40, 120)), rng.integers(0, 1000, 120))]
+        words[0] = words[0].capitalize()
+        title = ' '.join(w.capitalize() for w in rng.choice(topic, rng.integers(1, 4), replace=False))
+        books.append({
+            'title': f'{title} {i}',
+            'author': f'{FIRST[rng.integers(len(FIRST))]} {LAST[rng.integers(len(LAST))]}',
+            'isbn': f'979{i:010d}',
+            'publisher': 'Synthetic Press',
+            'publication_year': str(1900 + int(rng.integers(0, 125))),
+            'edition': '',
+            'format': 'Paperback',
+            'language': 'en',
+            'page_count': int(rng.integers(80, 900)),
+            'description': ' '.join(words) + '.',
+            'read_status': ('unread', 'in_progress', 'finished')[int(rng.integers(0, 3))],
+        })
+    return books
+
+
+def make_library(path, n, dim=256, mode='clustered', clusters=20, seed=0):
+    """Write a fresh library of n books with embeddings to path, returning the embedding model name"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    X, labels = (clustered if mode == 'clustered' else random_vectors)(n, dim, clusters, seed)
+    books = make_books(labels, seed)
+    model = model_name(dim)
+
+    conn = connect(path)
+    ensure_embeddings_table(conn)
+    columns = list(books[0])
+    for start in range(0, n, CHUNK):
+        chunk = books[start:start + CHUNK]
+        conn.executemany(f'''
+            INSERT INTO books (id, {', '.join(columns)})
+            VALUES (?, {', '.join('?' * len(columns))})
+        ''', [(start + i + 1, *(book[column] for column in columns)) for i, book in enumerate(chunk)])
+        ids = list(range(start + 1, start + len(chunk) + 1))
+        hashes = [content_hash(book_text(book)) for book in chunk]
+        save_embeddings(conn, ids, X[start:start + len(chunk)], model, hashes=hashes)
+        conn.commit()
+    conn.close()
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('-n', type=int, default=1000, help='Number of books')
+    parser.add_argument('--dim', type=int, default=256, help='Embedding dimension')
+    parser.add_argument('--random', action='store_true', help='Independent random embeddings instead of clusters')
+    parser.add_argument('--clusters', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    model = make_library(args.path, args.n, args.dim, 'random' if args.random else 'clustered', args.clusters, args.seed)
+    print(f"Wrote {args.n} books to {args.path}, embeddings stored as {model}")
+
+
+if __name__ == '__main__':
+    main()
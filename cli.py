@@ -1,11 +1,30 @@
 import click
-import requests
 import sqlite3
 import os
+import time
 from typing import List, Dict
 from datetime import datetime
 from utils.embed import create_embeddings
-from utils.tsp import visual_tsp, fullspace_tsp
+from utils.backends import BACKENDS, get_backend
+from utils.cache import EmbeddingCache
+from utils.client import DEFAULT_HOST, DEFAULT_PORT, BookshelfClient, ServerError
+from utils.google_books import GoogleBooksClient, parse_editions
+from utils.importer import BATCH_SIZE, import_books, read_entries
+from utils.export import BATCH_SIZE as EXPORT_BATCH_SIZE, FORMATS as EXPORT_FORMATS, export_books
+from utils.ann import open_index, similar_books
+from utils.tsp import visual_tsp, fullspace_tsp, SOLVERS
+from utils.projection import METHODS as PROJECTIONS
+from utils.render import FORMATS, MAX_LABELS
+from utils.schema import connect, fts_query, migrate
+from utils.store import active_model
+from utils import timing
+from utils.timing import span
+
+# terminal styles around matched words in search results
+SEARCH_HIGHLIGHT = ('\x1b[1;33m', '\x1b[0m')
+
+# books fetched either side of the cursor in scroll
+SCROLL_WINDOW = 25
 
 def get_terminal_size():
     try:
@@ -46,31 +65,17 @@ def wrap_text(text: str, width: int, subsequent_indent: str = '') -> str:
 
 class BookManager:
     def __init__(self, db_path="bookshelf.db"):
-        self.conn = sqlite3.connect(db_path)
-        self.create_tables()
+        with span('db.connect'):
+            self.conn = connect(db_path)
+        self._google = None
 
+    @span('db.migrate')
     def create_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY,
-                title TEXT NOT NULL,
-                author TEXT,
-                isbn TEXT,
-                publisher TEXT,
-                publication_year TEXT,
-                edition TEXT,
-                format TEXT,
-                language TEXT,
-                page_count INTEGER,
-                description TEXT,
-                read_status TEXT DEFAULT 'unread',
-                date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        self.conn.commit()
+        """Bring the schema up to date, see utils.schema.MIGRATIONS"""
+        migrate(self.conn)
 
 
+    @span('db.edit_book_field')
     def edit_book_field(self, book_id: int, field: str, value: str):
         """Edit a specific field of a book"""
         cursor = self.conn.cursor()
@@ -82,32 +87,33 @@ class BookManager:
             click.secho(f"Error updating field: {e}", fg='red')
             return False
 
-    def get_edition_details(self, isbn: str) -> List[Dict]:
-        """Search for all editions of a book using ISBN"""
+    @property
+    def google(self) -> GoogleBooksClient:
+        if self._google is None:
+            self._google = GoogleBooksClient()
+        return self._google
+
+    @span('google.edition_details')
+    def get_edition_details(self, isbn: str, title: str = None, author: str = None) -> List[Dict]:
+        """Search for all editions of a book using ISBN, and title and author when known"""
         editions = []
-        
-        # Search by ISBN
-        url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}&maxResults=40"
+
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if 'items' in data:
-                    editions.extend(self._parse_editions(data['items']))
-
-            # If we found a book, search for other editions using title and author
-            if editions:
-                first_book = editions[0]
-                title = first_book['title']
-                author = first_book['author']
-                
-                # Search by title and author
-                url = f"https://www.googleapis.com/books/v1/volumes?q=intitle:{title}+inauthor:{author}&maxResults=40"
-                response = requests.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'items' in data:
-                        editions.extend(self._parse_editions(data['items']))
+            if title and author:
+                # both searches are independent, run them side by side
+                by_isbn, by_title = self.google.volumes_many([f"isbn:{isbn}", f"intitle:{title} inauthor:{author}"])
+                editions.extend(self._parse_editions(by_isbn))
+                if editions:
+                    editions.extend(self._parse_editions(by_title))
+            else:
+                # Search by ISBN
+                editions.extend(self._parse_editions(self.google.volumes(f"isbn:{isbn}")))
+
+                # If we found a book, search for other editions using title and author
+                if editions:
+                    first_book = editions[0]
+                    query = f"intitle:{first_book['title']} inauthor:{first_book['author']}"
+                    editions.extend(self._parse_editions(self.google.volumes(query)))
 
             # Remove duplicates based on ISBN
             seen_isbns = set()
@@ -125,85 +131,26 @@ class BookManager:
 
     def _parse_editions(self, items: List[Dict]) -> List[Dict]:
         """Parse edition information from Google Books API response"""
-        editions = []
-        for item in items:
-            volume_info = item.get('volumeInfo', {})
-            
-            # Get ISBN (prefer ISBN-13, fallback to ISBN-10)
-            isbn = ''
-            for identifier in volume_info.get('industryIdentifiers', []):
-                if identifier.get('type') == 'ISBN_13':
-                    isbn = identifier.get('identifier')
-                    break
-                elif identifier.get('type') == 'ISBN_10':
-                    isbn = identifier.get('identifier')
-
-            # Skip if no ISBN (likely not a real edition)
-            if not isbn:
-                continue
-
-            # Extract format from physical attributes
-            format_ = 'Unknown'
-            if 'printType' in volume_info:
-                if volume_info['printType'] == 'BOOK':
-                    if volume_info.get('isEbook', False):
-                        format_ = 'eBook'
-                    else:
-                        format_ = self._guess_format(volume_info)
-
-            edition = {
-                'title': volume_info.get('title', 'Unknown').upper(),
-                'author': (volume_info.get('authors', ['Unknown'])[0]).upper(),
-                'isbn': isbn,
-                'publisher': volume_info.get('publisher', 'Unknown'),
-                'publication_year': volume_info.get('publishedDate', '')[:4],
-                'language': volume_info.get('language', 'unknown'),
-                'page_count': volume_info.get('pageCount', 0),
-                'format': format_,
-                'description': volume_info.get('description', ''),
-                'preview_link': volume_info.get('previewLink', ''),
-                'thumbnail': volume_info.get('imageLinks', {}).get('thumbnail', '')
-            }
-            
-            editions.append(edition)
-        
-        return editions
-
-    def _guess_format(self, volume_info: Dict) -> str:
-        """Guess book format based on available information"""
-        if 'dimensions' in volume_info:
-            dims = volume_info['dimensions']
-            # Common mass market paperback dimensions
-            if any('17.5' in str(dim) or '6.8' in str(dim) for dim in dims.values()):
-                return 'Mass Market Paperback'
-            # Common trade paperback dimensions
-            elif any('23' in str(dim) or '9' in str(dim) for dim in dims.values()):
-                return 'Trade Paperback'
-            # Common hardcover dimensions
-            elif any('24' in str(dim) or '9.5' in str(dim) for dim in dims.values()):
-                return 'Hardcover'
-        return 'Paperback'  # Default assumption
+        return parse_editions(items)
 
+    @span('google.search')
     def search_google_books(self, query: str) -> List[Dict]:
         """Initial search for books"""
-        url = f"https://www.googleapis.com/books/v1/volumes?q={query}&maxResults=15"
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                return [{
-                    'title': item.get('volumeInfo', {}).get('title', 'Unknown').upper(),
-                    'author': (item.get('volumeInfo', {}).get('authors', ['Unknown'])[0]).upper(),
-                    'isbn': next((id['identifier'] for id in item.get('volumeInfo', {}).get('industryIdentifiers', [])
-                                if id.get('type') in ['ISBN_13', 'ISBN_10']), ''),
-                    'year': item.get('volumeInfo', {}).get('publishedDate', '')[:4]
-                } for item in data.get('items', [])]
-            return []
+            items = self.google.volumes(query, max_results=15)
+            return [{
+                'title': item.get('volumeInfo', {}).get('title', 'Unknown').upper(),
+                'author': (item.get('volumeInfo', {}).get('authors', ['Unknown'])[0]).upper(),
+                'isbn': next((id['identifier'] for id in item.get('volumeInfo', {}).get('industryIdentifiers', [])
+                            if id.get('type') in ['ISBN_13', 'ISBN_10']), ''),
+                'year': item.get('volumeInfo', {}).get('publishedDate', '')[:4]
+            } for item in items]
         except Exception as e:
             click.secho(f"Error searching Google Books: {e}", fg='red')
             return []
 
     
+    @span('db.add_book')
     def add_book(self, book):
         cursor = self.conn.cursor()
         cursor.execute('''
@@ -227,6 +174,7 @@ class BookManager:
         self.conn.commit()
         return cursor.lastrowid
 
+    @span('db.delete_book')
     def delete_book(self, book_id):
         cursor = self.conn.cursor()
 
@@ -246,9 +194,29 @@ class BookManager:
             return False
 
 
+    @span('db.get_book_ids')
+    def get_book_ids(self) -> List[int]:
+        """Book ids in the same title order as get_books"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id FROM books ORDER BY title')
+        return [row[0] for row in cursor.fetchall()]
+
+    @span('db.get_books_by_ids')
+    def get_books_by_ids(self, book_ids: List[int]) -> Dict:
+        """Map id -> row for the given ids, with the same columns as get_books"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT id, title, author, isbn, publisher, publication_year,
+                edition, format, language, page_count, description, read_status
+            FROM books
+            WHERE id IN ({', '.join('?' * len(book_ids))})
+        ''', list(book_ids))
+        return {row[0]: row for row in cursor.fetchall()}
+
+    @span('db.get_books')
     def get_books(self, sort_by_status: bool = False) -> List:
         cursor = self.conn.cursor()
-        order_clause = 'CASE read_status WHEN "finished" THEN 1 WHEN "in_progress" THEN 2 ELSE 3 END, ' if sort_by_status else ''
+        order_clause = 'status_rank, ' if sort_by_status else ''
         cursor.execute(f'''
             SELECT id, title, author, isbn, publisher, publication_year,
                 edition, format, language, page_count, description, read_status
@@ -257,25 +225,180 @@ class BookManager:
         ''')
         return cursor.fetchall()
 
+    def _page_key(self, sort_by_status: bool) -> List[str]:
+        """Sort key of view pages, ending in title and id so every row has a unique position"""
+        return (['status_rank'] if sort_by_status else []) + ['title', 'id']
+
+    def page_key(self, book, sort_by_status: bool = False) -> tuple:
+        """Sort key of a row returned by get_books_page"""
+        return ((book[-1],) if sort_by_status else ()) + (book[1], book[0])
+
+    @span('db.count_books')
+    def count_books(self) -> int:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM books')
+        return cursor.fetchone()[0]
+
+    @span('db.get_books_page')
+    def get_books_page(self, sort_by_status: bool = False, start=None, after=None, before=None, limit: int = 20) -> List:
+        """One page of books using keyset pagination, without descriptions.
+
+        Rows have the get_books columns minus description, plus status_rank.
+        The page begins at key start, or just after key after, or ends just
+        before key before when paging back (keys come from page_key).
+        """
+        key = self._page_key(sort_by_status)
+        columns, placeholders = ', '.join(key), ', '.join('?' * len(key))
+        if before is not None:
+            where, params, order = f'WHERE ({columns}) < ({placeholders})', list(before), 'DESC'
+        elif after is not None:
+            where, params, order = f'WHERE ({columns}) > ({placeholders})', list(after), 'ASC'
+        elif start is not None:
+            where, params, order = f'WHERE ({columns}) >= ({placeholders})', list(start), 'ASC'
+        else:
+            where, params, order = '', [], 'ASC'
+        ordering = ', '.join(f'{part} {order}' for part in key)
+
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT id, title, author, isbn, publisher, publication_year,
+                edition, format, language, page_count, read_status, status_rank
+            FROM books
+            {where}
+            ORDER BY {ordering}
+            LIMIT ?
+        ''', params + [limit])
+        rows = cursor.fetchall()
+        return rows[::-1] if before is not None else rows
+
+    @span('db.get_page_start')
+    def get_page_start(self, page: int, sort_by_status: bool = False, limit: int = 20):
+        """Key of the first book on page (counting from 1), or None past the end"""
+        columns = ', '.join(self._page_key(sort_by_status))
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT {columns} FROM books ORDER BY {columns} LIMIT 1 OFFSET ?', ((page - 1) * limit,))
+        return cursor.fetchone()
+
+    @span('db.get_descriptions')
+    def get_descriptions(self, book_ids: List[int]) -> Dict:
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT id, description FROM books WHERE id IN ({", ".join("?" * len(book_ids))})',
+                       list(book_ids))
+        return dict(cursor.fetchall())
+
+    @span('db.find_books')
+    def find_books(self, query: str) -> List:
+        """Books whose id equals query, else those whose title contains it, exact title matches first"""
+        cursor = self.conn.cursor()
+        if query.isdigit():
+            cursor.execute('SELECT id, title, author FROM books WHERE id = ?', (int(query),))
+            rows = cursor.fetchall()
+            # a number that is no id may still be a title, like 1984
+            if rows:
+                return rows
+        cursor.execute('''
+            SELECT id, title, author FROM books WHERE title LIKE ?
+            ORDER BY UPPER(title) = UPPER(?) DESC, title
+        ''', (f'%{query}%', query))
+        return cursor.fetchall()
+
+    @span('db.search_books')
+    def search_books(self, query: str, limit: int = 20, highlight=('[', ']')) -> List:
+        """Full-text search, best BM25 match first, as (id, title, author, read_status, snippet) rows.
+
+        Title and author matches weigh more than publisher and description.
+        The snippet is the best matching stretch of any field, with matched
+        words wrapped in the two highlight markers.
+        """
+        match = fts_query(query)
+        if match is None:
+            return []
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT b.id, b.title, b.author, b.read_status,
+                snippet(books_fts, -1, ?, ?, '…', 12)
+            FROM books_fts
+            JOIN books b ON b.id = books_fts.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY bm25(books_fts, 10.0, 5.0, 1.0, 1.0)
+            LIMIT ?
+        ''', (*highlight, match, limit))
+        return cursor.fetchall()
+
+    @span('db.update_read_status')
     def update_read_status(self, book_id: int, status: str):
         cursor = self.conn.cursor()
         cursor.execute('UPDATE books SET read_status = ? WHERE id = ?', (status, book_id))
         self.conn.commit()
 
+def embedding_model(conn, backend: str) -> str:
+    """Model of the vectors embed last wrote for backend, which may be shortened or PCA-reduced"""
+    return active_model(conn, backend, get_backend(backend).model)
+
+def running_server():
+    """Client for books serve if it is running on this library and --no-server was not given"""
+    if click.get_current_context().find_root().params.get('no_server'):
+        return None
+    return BookshelfClient.find('bookshelf.db')
+
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
+def redraw(frame: str):
+    """Repaint the terminal with frame using ANSI escapes, without spawning a process"""
+    # home the cursor, clear each line as it is overwritten, then clear below the frame
+    lines = frame.split('\n')
+    click.echo('\x1b[H' + '\x1b[K\n'.join(lines) + '\x1b[K\x1b[J', nl=False)
+
 @click.group(context_settings=dict(help_option_names=['-h', '--help']))
 @click.version_option(version='1.0.0')
-def cli():
+@click.option('--profile', is_flag=True, help='Print a breakdown of wall time and peak memory per stage when the command ends')
+@click.option('--profile-memory', is_flag=True, help='Also measure Python allocations per stage with tracemalloc (slows numeric stages down)')
+@click.option('--profile-output', type=click.Path(dir_okay=False), default=None, help='Also write a cProfile dump to this file (read it with python -m pstats or snakeviz)')
+@click.option('--no-server', is_flag=True, help='Run locally even if books serve is running on this library')
+@click.pass_context
+def cli(ctx, profile, profile_memory, profile_output, no_server):
     " BOOKSHELF"
-    pass
+    trace_path = os.environ.get(timing.TRACE_ENV)
+    profile = profile or profile_memory or bool(profile_output)
+    if not (profile or trace_path):
+        return
+    timing.start(memory=profile_memory, trace_path=trace_path)
+    profiler = None
+    if profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_output)
+        recorder = timing.stop()
+        if profile:
+            click.echo(recorder.report(), err=True)
+        if profiler is not None:
+            click.echo(f"cProfile stats written to {profile_output}", err=True)
+        if trace_path:
+            click.echo(f"Trace events written to {trace_path}", err=True)
+
+    # close callbacks run last in first out, so the command span ends before the report
+    ctx.call_on_close(finish)
+    command = timing.span(ctx.invoked_subcommand or 'cli').__enter__()
+    ctx.call_on_close(lambda: command.__exit__(None, None, None))
+    if profiler is not None:
+        profiler.enable()
 
 @cli.command()
 def scroll():
     """Scroll through books with full context and status updates"""
     manager = BookManager()
-    books = manager.get_books()
+    # only the ids are loaded up front, rows are fetched a window at a time
+    book_ids = manager.get_book_ids()
+    if not book_ids:
+        click.secho("Library is empty! Add some books first.", fg='yellow')
+        return
+    rows = {}
+    cards = {}
     current_idx = 0
 
 
@@ -287,27 +410,37 @@ def scroll():
         }.get(status, 'white')
 
     def get_adjacent_indices(current):
-        total = len(books)
+        total = len(book_ids)
         prev_idx = (current - 1) % total
         next_idx = (current + 1) % total
         return prev_idx, next_idx
 
-    def display_book_info(book, style='normal'):
-        """Display book info with given style (normal or dim)"""
+    def get_row(idx):
+        """Row for position idx, fetching the window around it on a miss"""
+        book_id = book_ids[idx]
+        if book_id not in rows:
+            window = [book_ids[i % len(book_ids)] for i in range(idx - SCROLL_WINDOW, idx + SCROLL_WINDOW + 1)]
+            # forget rows that have scrolled far out of view
+            if len(rows) > 4 * SCROLL_WINDOW:
+                rows.clear()
+            rows.update(manager.get_books_by_ids([i for i in window if i not in rows]))
+        return rows[book_id]
+
+    def format_book_info(book, style, term_width):
+        """Lines of book info with given style (normal or dim)"""
         color = 'white' if style == 'normal' else 'bright_black'
         indent = "   "  # Base indentation
-        term_width = get_terminal_size().columns - len(indent)  # Account for base indent
+        term_width -= len(indent)  # Account for base indent
+        lines = []
 
         # Unpack all book details
         id_, title, author, isbn, publisher, year, edition, format_, language, pages, description, status = book
 
         # Format and wrap title
-        title = wrap_text(title, term_width)
-        click.secho(f"{title}", fg=color, bold=(style == 'normal'))
-        
+        lines.append(click.style(wrap_text(title, term_width), fg=color, bold=(style == 'normal')))
+
         # Format and wrap author
-        author = wrap_text(f" - {author}", term_width)
-        click.secho(f"{author}", fg=color)
+        lines.append(click.style(wrap_text(f" - {author}", term_width), fg=color))
 
         # Display edition info
         edition_info = []
@@ -322,67 +455,85 @@ def scroll():
 
         if edition_info:
             edition_str = " • ".join(filter(None, edition_info))
-            edition_wrapped = wrap_text(edition_str, term_width)
-            click.secho(f"{edition_wrapped}", fg=color)
+            lines.append(click.style(wrap_text(edition_str, term_width), fg=color))
 
         # Display additional details
         if pages:
-            click.secho(f"{indent}Pages: {pages}", fg=color)
+            lines.append(click.style(f"{indent}Pages: {pages}", fg=color))
         if language:
-            click.secho(f"{indent}Language: {language.upper()}", fg=color)
-        
+            lines.append(click.style(f"{indent}Language: {language.upper()}", fg=color))
+
         # Add description display with wrapping
         if description and description != 'NA' and style == 'normal':
             desc_text = description[:300] + "..." if len(description) > 300 else description
             wrapped_desc = wrap_text(f"Description: {desc_text}", term_width - len(indent), indent)
-            click.secho(f"{indent}{wrapped_desc}", fg=color)
+            lines.append(click.style(f"{indent}{wrapped_desc}", fg=color))
 
         # Display status and ISBN
-        click.secho(f"{indent}Status: {status}", fg=get_status_color(status) if style == 'normal' else color)
-        click.secho(f"{indent}ISBN: {isbn}", fg=color)
+        lines.append(click.style(f"{indent}Status: {status}", fg=get_status_color(status) if style == 'normal' else color))
+        lines.append(click.style(f"{indent}ISBN: {isbn}", fg=color))
+        return '\n'.join(lines)
+
+    def book_card(idx, style, term_width):
+        """Formatted book info, cached per book, style and terminal width"""
+        key = (book_ids[idx], style, term_width)
+        if key not in cards:
+            cards[key] = format_book_info(get_row(idx), style, term_width)
+        return cards[key]
+
+    def forget(book_id):
+        rows.pop(book_id, None)
+        for key in [key for key in cards if key[0] == book_id]:
+            del cards[key]
 
     def display_books():
-        clear_screen()
         term_width = get_terminal_size().columns
         prev_idx, next_idx = get_adjacent_indices(current_idx)
 
-        display_book_info(books[prev_idx], 'dim')
-        click.secho(f"Book {current_idx + 1} of {len(books)}", fg='blue')
-        click.echo("─" * term_width)
-        display_book_info(books[current_idx], 'normal')
-        click.echo("─" * term_width)
-        display_book_info(books[next_idx], 'dim')
-
-        click.echo("Controls:")
         controls = "↑/↓ or j/k: Navigate • 1: Unread • 2: In Progress • 3: Finished • D: Delete Book • Q: Quit"
         if len(controls) > term_width:
             controls = "↑/↓: Nav • 1:Unread • 2:Progress • 3:Done • Q:Quit • D:Delete"
-        click.secho(controls, fg='bright_black')
+        frame = [
+            book_card(prev_idx, 'dim', term_width),
+            click.style(f"Book {current_idx + 1} of {len(book_ids)}", fg='blue'),
+            "─" * term_width,
+            book_card(current_idx, 'normal', term_width),
+            "─" * term_width,
+            book_card(next_idx, 'dim', term_width),
+            "Controls:",
+            click.style(controls, fg='bright_black'),
+        ]
+        redraw('\n'.join(frame))
 
     while True:
         display_books()
         c = click.getchar()
 
         if c == '\x1b[A' or c == 'k':  # Up arrow or k
-            current_idx = (current_idx - 1) % len(books)
+            current_idx = (current_idx - 1) % len(book_ids)
         elif c == '\x1b[B' or c == 'j':  # Down arrow or j
-            current_idx = (current_idx + 1) % len(books)
+            current_idx = (current_idx + 1) % len(book_ids)
         elif c in ['1', '2', '3']:
             status_map = {'1': 'unread', '2': 'in_progress', '3': 'finished'}
-            manager.update_read_status(books[current_idx][0], status_map[c])
-            books = manager.get_books()  # Refresh book list
+            book_id = book_ids[current_idx]
+            manager.update_read_status(book_id, status_map[c])
+            # patch the row in place rather than reloading the library
+            row = get_row(current_idx)
+            forget(book_id)
+            rows[book_id] = row[:-1] + (status_map[c],)
         elif c.lower() == 'q':
             break
         elif c.lower() == 'd':
-            if manager.delete_book(books[current_idx][0]):
-                books = manager.get_books()  # Refresh book list
-                if not books:  # If last book was deleted
+            if manager.delete_book(book_ids[current_idx]):
+                forget(book_ids.pop(current_idx))
+                if not book_ids:  # If last book was deleted
                     break
-                current_idx = min(current_idx, len(books) - 1)
+                current_idx = min(current_idx, len(book_ids) - 1)
 
 @cli.command()
 @click.option('--sort-status', '-s', is_flag=True, help='Sort by read status')
-def view(sort_status):
+@click.option('--page-size', '-n', type=click.IntRange(1), default=20, show_default=True, help='Books shown per page')
+def view(sort_status, page_size):
     """View and manage your library"""
     manager = BookManager()
     status_colors = {
@@ -390,18 +541,28 @@ def view(sort_status):
         'in_progress': 'yellow',
         'finished': 'green',
     }
+    # the current page is remembered by the sort key of its first book
+    page, page_start = 1, None
 
     while True:
         clear_screen()
         click.secho("THE BOOKSHELF", fg='green', bold=True)
         click.echo("─" * 50)
 
-        books = manager.get_books(sort_by_status=sort_status)
+        total_pages = max(1, -(-manager.count_books() // page_size))
+        books = manager.get_books_page(sort_status, start=page_start, limit=page_size)
+        if not books and page > 1:
+            # the last book on the final page was deleted
+            books = manager.get_books_page(sort_status, before=page_start, limit=page_size)
+            page = total_pages
         if not books:
             click.secho("Library is empty! Add some books first.", fg='yellow')
             break
+        page_start = manager.page_key(books[0], sort_status)
+        descriptions = manager.get_descriptions([book[0] for book in books])
 
-        for idx, (book_id, title, author, isbn, publisher, year, edition, format_, language, pages, description, status) in enumerate(books, 1):
+        for idx, (book_id, title, author, isbn, publisher, year, edition, format_, language, pages, status, _) in enumerate(books, 1):
+            description = descriptions.get(book_id)
             term_width = get_terminal_size().columns
             indent = "   "
 
@@ -446,6 +607,7 @@ def view(sort_status):
             click.echo()
 
         click.echo("─" * 50)
+        click.secho(f"Page {page} of {total_pages}", fg='blue')
         click.secho("\nActions:", fg='blue', bold=True)
         click.echo("1. Mark as Finished")
         click.echo("2. Mark as In Progress")
@@ -453,16 +615,37 @@ def view(sort_status):
         click.echo("4. Toggle Status Sort")
         click.echo("5. Delete Book")
         click.echo("6. Exit")
+        click.echo("7. Next Page")
+        click.echo("8. Previous Page")
+        click.echo("9. Go to Page")
 
         action = click.prompt(
             "\nChoose action",
-            type=click.IntRange(1, 6),
-            default=6
+            type=click.IntRange(1, 9),
+            default=7 if page < total_pages else 6
         )
 
         if action == 6:
             break
 
+        if action == 7:
+            if page < total_pages:
+                following = manager.get_books_page(sort_status, after=manager.page_key(books[-1], sort_status), limit=1)
+                if following:
+                    page, page_start = page + 1, manager.page_key(following[0], sort_status)
+            continue
+
+        if action == 8:
+            if page > 1:
+                previous = manager.get_books_page(sort_status, before=page_start, limit=page_size)
+                page, page_start = page - 1, manager.page_key(previous[0], sort_status)
+            continue
+
+        if action == 9:
+            page = click.prompt("Go to page", type=click.IntRange(1, total_pages), default=page)
+            page_start = manager.get_page_start(page, sort_status, page_size)
+            continue
+
         if action == 5:
             book_num = click.prompt(
                 "Enter book number",
@@ -473,6 +656,7 @@ def view(sort_status):
 
         elif action == 4:
             sort_status = not sort_status
+            page, page_start = 1, None
             continue
 
         if action in (1, 2, 3):
@@ -486,6 +670,36 @@ def view(sort_status):
             click.secho("Status updated!", fg='green')
             click.pause(info='Press any key to continue...')
 
+@cli.command()
+@click.argument('query')
+@click.option('--limit', '-n', type=click.IntRange(1), default=20, show_default=True, help='Most results to show')
+def search(query, limit):
+    """Full-text search over title, author, publisher and description"""
+    status_colors = {
+        'unread': 'red',
+        'in_progress': 'yellow',
+        'finished': 'green',
+    }
+    client = running_server()
+    if client is not None:
+        results = [(row['id'], row['title'], row['author'], row['read_status'], row['snippet'])
+                   for row in client.search(query, limit, SEARCH_HIGHLIGHT)]
+    else:
+        results = BookManager().search_books(query, limit, SEARCH_HIGHLIGHT)
+    if not results:
+        click.secho("No books match that search", fg='yellow')
+        return
+
+    term_width = get_terminal_size().columns
+    indent = "   "
+    for book_id, title, author, status, snippet in results:
+        click.secho(f"[{book_id}] ", fg='blue', nl=False)
+        click.secho(title, fg='bright_white', bold=True, nl=False)
+        click.secho(f" by {author}", fg='white', nl=False)
+        click.secho(f" ({status.replace('_', ' ')})", fg=status_colors.get(status, 'white'))
+        if snippet and snippet != 'NA':
+            click.echo(f"{indent}{wrap_text(snippet, term_width - len(indent), indent)}")
+
 def edit_book(manager, book_id=None):
     cursor = manager.conn.cursor()
     while True:
@@ -494,27 +708,35 @@ def edit_book(manager, book_id=None):
             click.secho("📝 Edit Book Details", fg='green', bold=True)
             click.echo("─" * 50)
 
-            cursor.execute("SELECT * FROM books")
-            books = cursor.fetchall()
-            if not books:
+            if manager.count_books() == 0:
                 click.secho("Library is empty!", fg='yellow')
                 return
 
+            query = click.prompt("Search for a book to edit (blank to exit)", default='', show_default=False)
+            if not query.strip():
+                return
+            books = manager.search_books(query)
+            if not books:
+                click.secho("No books match that search", fg='yellow')
+                click.pause(info='Press any key to continue...')
+                continue
+
             for idx, book in enumerate(books, 1):
                 click.secho(f"{idx}. ", nl=False)
                 click.secho(f"{book[1]}", fg='bright_white', bold=True)
                 click.secho(f" by {book[2]}", fg='white')
 
             book_num = click.prompt(
-                "\nSelect book to edit (0 to exit)",
+                "\nSelect book to edit (0 to search again)",
                 type=click.IntRange(0, len(books)),
-                default=0
+                default=1
             )
 
             if book_num == 0:
-                return
+                continue
 
-            selected_book = books[book_num-1]
+            cursor.execute('SELECT * FROM books WHERE id = ?', (books[book_num-1][0],))
+            selected_book = cursor.fetchone()
         else:
             cursor.execute('SELECT * FROM books WHERE id = ?', (book_id,))
             selected_book = cursor.fetchone()
@@ -605,28 +827,121 @@ def edit():
     edit_book(manager)
 
 @cli.command()
-def embed():
-    """Create embeddings for all books in the library"""
-    create_embeddings()
-    click.secho("✅ Successfully created embeddings for all books", fg='green')
+@click.option('--dtype', type=click.Choice(['float32', 'float16', 'int8']), default='float32', help='Precision used to store the vectors, int8 keeps a scale per vector')
+@click.option('--force', '-f', is_flag=True, help='Re-embed every book, even if unchanged')
+@click.option('--backend', '-b', type=click.Choice(list(BACKENDS)), default='openai', show_default=True, help='Embedding backend, local runs offline')
+@click.option('--concurrency', default=4, show_default=True, help='Maximum number of requests in flight (openai)')
+@click.option('--rpm', default=500, show_default=True, help='Maximum requests per minute (openai)')
+@click.option('--no-cache', is_flag=True, help='Do not use the shared embedding cache')
+@click.option('--dimensions', '-d', type=click.IntRange(1), default=None, help='Vector length produced by the backend (openai shortens on the API side)')
+@click.option('--pca', type=click.IntRange(1), default=None, help='Also reduce the vectors to this many dimensions with a PCA fitted on the library')
+@click.option('--refit', is_flag=True, help='Refit the PCA basis instead of reusing the stored one')
+def embed(dtype, force, backend, concurrency, rpm, no_cache, dimensions, pca, refit):
+    """Create embeddings for new or changed books in the library"""
+    if backend == 'openai':
+        backend = get_backend(backend, concurrency=concurrency, rpm=rpm, dimensions=dimensions)
+    else:
+        backend = get_backend(backend, **({'dim': dimensions} if dimensions else {}))
+    cache = None if no_cache else EmbeddingCache()
+    try:
+        counts = create_embeddings(dtype=dtype, force=force, backend=backend, cache=cache, pca_dim=pca, refit=refit)
+    except ValueError as e:
+        click.secho(f"❌ {e}", fg='red')
+        return
+    if counts['failed']:
+        click.secho(f"❌ {counts['failed']} books could not be embedded, run embed again to retry them", fg='red')
+    else:
+        click.secho("✅ Embeddings are up to date", fg='green')
+    click.echo(f"Embedded: {counts['embedded']} • Skipped: {counts['skipped']} • Removed (stale): {counts['removed']}")
+    if counts['repacked']:
+        click.echo(f"Re-packed as {dtype}: {counts['repacked']}")
+    click.secho(f"Vectors in use: {counts['model']} ({', '.join(counts['dtypes'])})", fg='bright_black')
+    if counts['explained'] is not None:
+        click.secho(f"PCA keeps {counts['explained']:.1%} of the variance", fg='bright_black')
+    if cache is not None:
+        click.secho(f"Cache hits: {cache.hits} • Cache misses: {cache.misses}", fg='bright_black')
+        cache.close()
+
+@cli.group()
+def cache():
+    """Manage the embedding cache shared between libraries"""
+    pass
+
+@cache.command()
+def stats():
+    """Show what the embedding cache holds"""
+    embedding_cache = EmbeddingCache()
+    info = embedding_cache.stats()
+    embedding_cache.close()
+    click.secho(f"Cache: {info['path']}", fg='blue')
+    click.echo(f"Entries: {info['entries']} • Size: {info['bytes'] / 1e6:.1f} MB of {info['max_bytes'] / 1e6:.0f} MB")
+    for model in info['models']:
+        click.echo(f"   {model['model']}: {model['entries']} vectors, {model['bytes'] / 1e6:.1f} MB")
+
+@cache.command()
+@click.option('--max-mb', type=float, default=None, help='Shrink the cache to this size (default: the cache size cap)')
+def prune(max_mb):
+    """Evict least recently used embeddings"""
+    embedding_cache = EmbeddingCache()
+    removed = embedding_cache.prune(None if max_mb is None else int(max_mb * 1e6))
+    embedding_cache.close()
+    click.secho(f"Evicted {removed} cached embeddings", fg='green')
 
 # two options here, visual which returns an image, or fullspace which returns a list of books
 @cli.command()
 @click.option('--visual', '-v', is_flag=True, help='Create a visual TSP by first reducing the dimensionality of the embeddings')
-def tsp(visual):
+@click.option('--backend', '-b', type=click.Choice(list(BACKENDS)), default='openai', show_default=True, help='Which embeddings to use')
+@click.option('--solver', type=click.Choice(SOLVERS), default='auto', show_default=True, help='TSP strategy, auto is exact for small libraries and local search otherwise')
+@click.option('--time-limit', '-t', type=float, default=60, show_default=True, help='Maximum seconds to spend improving the tour')
+@click.option('--full', is_flag=True, help='Solve from scratch instead of updating the last saved tour')
+@click.option('--workers', '-w', type=click.IntRange(1), default=1, show_default=True, help='Parallel restarts, implies --full (not with --sparse or --solver anneal)')
+@click.option('--seed', type=int, default=0, show_default=True, help='Base random seed, worker k uses seed + k (anneal is not seeded)')
+@click.option('--sparse', is_flag=True, help='Search a k-nearest-neighbour graph instead of a full distance matrix (large libraries)')
+@click.option('--neighbours', '-k', type=click.IntRange(1), default=10, show_default=True, help='Candidate neighbours per book in sparse mode')
+@click.option('--projection', '-p', type=click.Choice(PROJECTIONS), default='pca-tsne', show_default=True, help='2D projection used by --visual')
+@click.option('--refit', is_flag=True, help='Recompute the 2D projection for every book')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='png', show_default=True, help='Image format for --visual, svg and html show every title on hover')
+@click.option('--dpi', type=click.IntRange(1), default=200, show_default=True, help='Resolution of png output')
+@click.option('--labels', type=click.IntRange(0), default=MAX_LABELS, show_default=True, help='Most titles drawn on the figure, one per crowded region')
+def tsp(visual, backend, solver, time_limit, full, workers, seed, sparse, neighbours, projection, refit, fmt, dpi, labels):
     """Solve the Travelling Salesman Problem for your library"""
+    if workers > 1 and solver == 'anneal':
+        raise click.UsageError("--solver anneal cannot be seeded, so it runs with a single worker")
+    if workers > 1 and sparse:
+        click.secho("--workers has no effect with --sparse, solving with one worker", fg='yellow')
+    client = running_server()
+    if client is not None:
+        try:
+            response = client.tour(backend=backend, visual=visual, solver=solver, time_limit=time_limit, full=full,
+                                   workers=workers, seed=seed, sparse=sparse, neighbours=neighbours,
+                                   projection=projection, refit=refit, fmt=fmt, dpi=dpi, max_labels=labels)
+        except ServerError as e:
+            click.secho(f"❌ Error solving TSP for the library: {e}", fg='red')
+            return
+        click.secho(f"Successfully solved the TSP for the library on the bookshelf server ({response['model']})", fg='green')
+        click.secho(f"{'An image of the optimal book tour' if visual else 'A list of books in the optimal tour'} has been saved to: {response['path']}", fg='blue')
+        click.echo("----- OPTIMAL BOOKSHELF -------")
+        for line in response['tour']:
+            click.echo(line)
+        return
+
+    conn = connect('bookshelf.db')
+    model = embedding_model(conn, backend)
+    conn.close()
+    options = dict(model=model, solver=solver, time_limit=time_limit, full=full, workers=workers, seed=seed,
+                   sparse=sparse, neighbours=neighbours,
+                   report=lambda worker_seed, length: click.echo(f"Worker seed {worker_seed}: tour length {length:.4f}"))
     try:
         if visual:
-            tour,path = visual_tsp()
+            tour,path = visual_tsp(**options, projection=projection, refit=refit, fmt=fmt, dpi=dpi, max_labels=labels)
             type_path = 'An image of the optimal book tour'
             click.secho(f"Successfully solved the TSP for the library in the reduced 2D space", fg='green')
         else:
-            tour,path = fullspace_tsp()
+            tour,path = fullspace_tsp(**options)
             type_path = 'A list of books in the optimal tour'
             click.secho(f"Successfully solved the TSP for the library in the full vector spaced", fg='green')
-    except:
-        click.secho("❌ Error solving TSP for the library", fg='red')
-        click.secho("Did you remember to create embeddings for all books?", fg='red')
+    except ValueError as e:
+        click.secho(f"❌ Error solving TSP for the library: {e}", fg='red')
         return
     
     click.secho(f"{type_path} has been saved to: {path}", fg='blue')
@@ -636,6 +951,133 @@ def tsp(visual):
         click.echo(line)
     
 
+@cli.command()
+@click.argument('book')
+@click.option('-k', type=click.IntRange(1), default=10, show_default=True, help='Number of books to show')
+@click.option('--backend', '-b', type=click.Choice(list(BACKENDS)), default='openai', show_default=True, help='Which embeddings to use')
+@click.option('--probes', type=click.IntRange(1), default=4, show_default=True, help='Index buckets to scan, more is slower but more accurate')
+@click.option('--exact', is_flag=True, help='Brute-force search over every book instead of the index')
+@click.option('--recall', is_flag=True, help='Compare the index against brute force for this query')
+def similar(book, k, backend, probes, exact, recall):
+    """Find the books closest to BOOK (an id or part of a title)"""
+    client = running_server()
+    if client is not None:
+        try:
+            response = client.similar(book, k, backend, probes, exact, recall)
+        except ServerError as e:
+            click.secho(f"❌ {e}", fg='red')
+            return
+        if response['matches'] > 1:
+            click.secho(f"{response['matches']} books match, using the first", fg='bright_black')
+        click.secho(f"Closest to {response['book']['title']} by {response['book']['author']}:", fg='green', bold=True)
+        for idx, result in enumerate(response['results'], 1):
+            click.echo(f"{idx}. {result['title']} by {result['author']} ", nl=False)
+            click.secho(f"({result['distance']:.3f})", fg='bright_black')
+        click.secho(f"{'Brute force' if exact else 'Index'} query took {response['seconds'] * 1000:.2f} ms (server)", fg='bright_black')
+        if 'recall' in response:
+            click.secho(f"Recall@{k}: {response['recall']:.2f} (brute force took {response['exact_seconds'] * 1000:.2f} ms)", fg='blue')
+        return
+
+    manager = BookManager()
+    matches = manager.find_books(book)
+    if not matches:
+        click.secho("❌ No book matches that id or title", fg='red')
+        return
+    book_id, title, author = matches[0]
+    if len(matches) > 1:
+        click.secho(f"{len(matches)} books match, using the first", fg='bright_black')
+
+    model = embedding_model(manager.conn, backend)
+    index = open_index(manager.conn, 'bookshelf.db', model)
+    if index is None or book_id not in index.ids:
+        click.secho(f"❌ No {model} embedding for this book, run embed first", fg='red')
+        return
+    start = time.perf_counter()
+    results = similar_books(index, book_id, k, probes, exact)
+    elapsed = time.perf_counter() - start
+
+    titles = {row[0]: row[1:] for row in manager.conn.execute(
+        f'SELECT id, title, author FROM books WHERE id IN ({", ".join("?" * len(results))})',
+        [result_id for result_id, _ in results])}
+    click.secho(f"Closest to {title} by {author}:", fg='green', bold=True)
+    for idx, (result_id, distance) in enumerate(results, 1):
+        result_title, result_author = titles[result_id]
+        click.echo(f"{idx}. {result_title} by {result_author} ", nl=False)
+        click.secho(f"({distance:.3f})", fg='bright_black')
+    click.secho(f"{'Brute force' if exact else 'Index'} query took {elapsed * 1000:.2f} ms", fg='bright_black')
+
+    if recall and not exact:
+        start = time.perf_counter()
+        truth = similar_books(index, book_id, k, exact=True)
+        exact_elapsed = time.perf_counter() - start
+        found = len({i for i, _ in results} & {i for i, _ in truth})
+        click.secho(f"Recall@{k}: {found / max(len(truth), 1):.2f} (brute force took {exact_elapsed * 1000:.2f} ms)", fg='blue')
+
+@cli.command(name='import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', '-w', type=click.IntRange(1), default=8, show_default=True, help='Concurrent Google Books lookups')
+@click.option('--batch-size', type=click.IntRange(1), default=BATCH_SIZE, show_default=True, help='Books inserted per transaction (and per checkpoint)')
+@click.option('--restart', is_flag=True, help='Ignore any checkpoint and start from the first row')
+def import_(path, workers, batch_size, restart):
+    """Bulk add books from an ISBN list or a CSV (e.g. Goodreads) export"""
+    manager = BookManager()
+    entries = len(read_entries(path))
+    # one pooled connection per lookup thread, a smaller pool would reconnect on every lookup
+    client = GoogleBooksClient(workers=workers)
+    try:
+        with click.progressbar(length=entries, label='Importing books') as bar:
+            report = import_books(manager.conn, path, client, workers, batch_size, restart, bar.update)
+    finally:
+        client.close()
+
+    if report['resumed_from']:
+        click.secho(f"Resumed from row {report['resumed_from'] + 1} of {report['total']}", fg='blue')
+    click.secho(f"Added {report['added']} books, skipped {report['duplicates']} already in the library", fg='green')
+    if report['failed']:
+        click.secho(f"❌ {len(report['failed'])} rows could not be resolved, see {report['failures_path']}", fg='red')
+        for row, text, reason in report['failed'][:10]:
+            click.secho(f"   row {row}: {text} ({reason})", fg='bright_black')
+
+@cli.command()
+@click.option('--format', '-f', 'fmt', type=click.Choice(EXPORT_FORMATS), default='jsonl', show_default=True, help='Output format')
+@click.option('--output', '-o', default=None, help="Output file, '-' for stdout (default: a dated file in the current directory)")
+@click.option('--since', type=click.DateTime(), default=None, help='Only books added on or after this date')
+@click.option('--embeddings', '-e', is_flag=True, help='Include embeddings, as a column (parquet) or a .npy file next to the output')
+@click.option('--backend', '-b', type=click.Choice(list(BACKENDS)), default='openai', show_default=True, help='Which embeddings to include')
+@click.option('--batch-size', type=click.IntRange(1), default=EXPORT_BATCH_SIZE, show_default=True, help='Rows read from the database at a time')
+def export(fmt, output, since, embeddings, backend, batch_size):
+    """Export the library to JSONL, CSV or Parquet"""
+    manager = BookManager()
+    path = output or f"{time.strftime('%Y-%m-%d %H:%M:%S')}_books.{fmt}"
+    model = embedding_model(manager.conn, backend) if embeddings else None
+    try:
+        written, sidecar = export_books(manager.conn, path, fmt, since and since.strftime('%Y-%m-%d %H:%M:%S'),
+                                        model, batch_size)
+    except (ImportError, ValueError) as e:
+        click.secho(f"❌ {e}", fg='red', err=True)
+        return
+
+    if path != '-':
+        click.secho(f"Exported {written} books to {path}", fg='green')
+        if sidecar:
+            click.secho(f"Embeddings ({model}) saved to {sidecar}, one row per exported book", fg='blue')
+
+@cli.command()
+@click.option('--host', default=DEFAULT_HOST, show_default=True, help='Interface to listen on')
+@click.option('--port', '-p', type=int, default=DEFAULT_PORT, show_default=True, help='Port to listen on')
+@click.option('--workers', '-w', type=click.IntRange(1), default=2, show_default=True, help='Processes solving tours')
+@click.option('--poll', type=float, default=2.0, show_default=True, help='Seconds between checks for changes to the library')
+def serve(host, port, workers, poll):
+    """Serve the library over a local HTTP API, keeping it loaded in memory.
+
+    While it runs, search, similar and tsp on this library are sent to it
+    (see --no-server). Set BOOKSHELF_SERVER to the server's URL when it is
+    not on the default address.
+    """
+    from utils.server import serve as run_server
+    click.secho(f"Serving {os.path.abspath('bookshelf.db')} on http://{host}:{port}", fg='green')
+    run_server(BookManager, 'bookshelf.db', host, port, workers, poll)
+
 @cli.command()
 def add():
     """Add new books to your library with automatic edition detection"""
@@ -678,7 +1120,7 @@ def add():
         # Get all editions for the selected book
         selected_book = results[choice - 1]
         with click.progressbar(length=1, label='Finding all editions') as bar:
-            editions = manager.get_edition_details(selected_book['isbn'])
+            editions = manager.get_edition_details(selected_book['isbn'], selected_book['title'], selected_book['author'])
             bar.update(1)
 
         while True:
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# the repository root holds cli.py and utils/, make them importable however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_library
+
+
+@pytest.fixture
+def library(tmp_path):
+    """Path of a fresh synthetic library of 60 books with synthetic-32 embeddings"""
+    path = str(tmp_path / 'bookshelf.db')
+    make_library(path, 60, dim=32)
+    return path
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request with server.respond(method, path, body) -> (status, JSON-able body)"""
+    # keep-alive, so tests can see whether clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.connections.add(self.client_address)
+        status, payload = self.server.respond(method, self.path, body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Start a local HTTP server answering with respond(method, path, body), returning its base URL.
+
+    The servers started are in start.servers, each with the set of client addresses it saw in connections.
+    """
+    servers = []
+
+    def start(respond):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        server.respond = respond
+        server.connections = set()
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    start.servers = servers
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.ann import IVFIndex, similar_books
+
+
+@pytest.fixture
+def index():
+    X = np.random.default_rng(0).normal(size=(500, 16)).astype(np.float32)
+    return IVFIndex.build(np.arange(1, 501), X), X
+
+
+def test_load_maps_saved_norms(index, tmp_path):
+    built, X = index
+    path = str(tmp_path / 'index')
+    built.save(path)
+    loaded = IVFIndex.load(path)
+    assert isinstance(loaded.norms, np.memmap) and isinstance(loaded.vectors, np.memmap)
+    np.testing.assert_allclose(loaded.norms, np.einsum('ij,ij->i', loaded.vectors, loaded.vectors), rtol=1e-6)
+    assert similar_books(loaded, 7, k=5) == similar_books(built, 7, k=5)
+
+
+def test_load_without_saved_norms(index, tmp_path):
+    built, _ = index
+    path = str(tmp_path / 'index')
+    built.save(path)
+    os.remove(os.path.join(path, 'norms.npy'))
+    loaded = IVFIndex.load(path)
+    assert similar_books(loaded, 7, k=5) == similar_books(built, 7, k=5)
+
+
+def test_exact_search_matches_brute_force(index):
+    built, X = index
+    distances = np.linalg.norm(X - X[6], axis=1)
+    expected = [int(i) + 1 for i in np.argsort(distances)[1:6]]
+    assert [book_id for book_id, _ in similar_books(built, 7, k=5, exact=True)] == expected
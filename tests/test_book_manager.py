@@ -0,0 +1,62 @@
+import pytest
+
+from cli import BookManager
+
+
+@pytest.fixture
+def manager(library):
+    manager = BookManager(library)
+    yield manager
+    manager.conn.close()
+
+
+def test_find_books_by_id_or_title(manager):
+    assert [row[0] for row in manager.find_books('7')] == [7]
+    title = manager.find_books('7')[0][1]
+    assert 7 in [row[0] for row in manager.find_books(title)]
+
+
+def test_find_books_numeric_title(manager):
+    book_id = manager.add_book({'title': '1984', 'author': 'George Orwell', 'isbn': '9780451524935'})
+    assert manager.find_books('1984')[0][:2] == (book_id, '1984')
+    assert manager.find_books('99999') == []
+
+
+def query_plans(manager, call):
+    """EXPLAIN QUERY PLAN details of every statement call() runs on the manager's connection"""
+    statements = []
+    manager.conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        manager.conn.set_trace_callback(None)
+    return [[row[-1] for row in manager.conn.execute(f'EXPLAIN QUERY PLAN {sql}')] for sql in statements]
+
+
+def assert_indexed(plans, search=False):
+    """No table scan and no sort, and with search only index range lookups"""
+    assert plans
+    for plan in plans:
+        # reading the whole list in index order shows as SCAN books USING INDEX, a plain SCAN books reads the table
+        assert not any(detail == 'SCAN books' for detail in plan), plan
+        assert not any('USE TEMP B-TREE' in detail for detail in plan), plan
+        if search:
+            assert all(detail.startswith('SEARCH books USING') for detail in plan), plan
+
+
+@pytest.mark.parametrize('sort_by_status', [False, True])
+def test_list_queries_use_indexes(manager, sort_by_status):
+    assert_indexed(query_plans(manager, lambda: manager.get_books(sort_by_status)))
+    first = manager.get_books_page(sort_by_status, limit=5)
+    key = manager.page_key(first[-1], sort_by_status)
+    assert_indexed(query_plans(manager, lambda: manager.get_books_page(sort_by_status, limit=5)))
+    for kwargs in ({'start': key}, {'after': key}, {'before': key}):
+        assert_indexed(query_plans(manager, lambda: manager.get_books_page(sort_by_status, limit=5, **kwargs)),
+                       search=True)
+
+
+def test_isbn_lookup_uses_index(manager):
+    plan = [row[-1] for row in manager.conn.execute('EXPLAIN QUERY PLAN SELECT id FROM books WHERE isbn = ?',
+                                                    ('9790000000007',))]
+    assert any('INDEX books_isbn (isbn=?)' in detail for detail in plan), plan
+    assert_indexed([plan], search=True)
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from cli import cli
+from utils.client import SERVER_ENV
+from utils.store import save_embeddings
+
+
+@pytest.fixture
+def in_library(library, monkeypatch):
+    """Run commands next to the synthetic library, without a server"""
+    monkeypatch.chdir(os.path.dirname(library))
+    monkeypatch.setenv(SERVER_ENV, 'off')
+    return library
+
+
+def test_tsp_without_embeddings(in_library):
+    result = CliRunner().invoke(cli, ['tsp', '-b', 'local'])
+    assert result.exit_code == 0
+    assert 'No local-hashing-256 embeddings found, run embed first' in result.output
+
+
+def test_tsp_with_mixed_dimensions(in_library):
+    conn = sqlite3.connect(in_library)
+    save_embeddings(conn, [1], np.ones((1, 256)), 'local-hashing-256')
+    save_embeddings(conn, [2], np.ones((1, 128)), 'local-hashing-256')
+    conn.commit()
+    conn.close()
+    result = CliRunner().invoke(cli, ['tsp', '-b', 'local'])
+    assert result.exit_code == 0
+    assert 'mixed dimensions [128, 256], re-run embed with --force' in result.output
+    assert 'run embed first' not in result.output
+
+
+def test_tsp_rejects_parallel_anneal(in_library):
+    result = CliRunner().invoke(cli, ['tsp', '-b', 'local', '-w', '2', '--solver', 'anneal'])
+    assert result.exit_code == 2
+    assert 'cannot be seeded' in result.output
+
+
+def test_import_keeps_a_connection_per_worker(in_library, stub_server, tmp_path, monkeypatch):
+    def respond(method, path, body):
+        time.sleep(0.02)
+        isbn = parse_qs(urlparse(path).query)['q'][0].split(':')[-1]
+        return 200, {'items': [{'volumeInfo': {'title': f'Book {isbn}', 'authors': ['A. Writer'],
+                                               'industryIdentifiers': [{'type': 'ISBN_13', 'identifier': isbn}]}}]}
+
+    monkeypatch.setenv('BOOKSHELF_GOOGLE_BOOKS_URL', stub_server(respond))
+    monkeypatch.setenv('BOOKSHELF_HTTP_CACHE', str(tmp_path / 'http.db'))
+    isbns = tmp_path / 'isbns.txt'
+    isbns.write_text('\n'.join(f'978{i:010d}' for i in range(1, 97)))
+    result = CliRunner().invoke(cli, ['import', str(isbns), '-w', '8', '--batch-size', '32'])
+    assert result.exit_code == 0, result.output
+    assert 'Added 96 books' in result.output
+    # eight lookup threads share eight pooled connections instead of reconnecting
+    assert len(stub_server.servers[-1].connections) <= 8
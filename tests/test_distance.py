@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from utils.distance import PairDistances, distance_matrix, iter_distance_blocks
+from utils.quantize import QuantizedVectors
+from utils.tsp import no_return_dm
+
+
+def reference_dm(X):
+    """The double loop no_return_dm used before the blocked engine"""
+    distance_matrix = np.zeros((len(X), len(X)))
+    for i in range(len(X)):
+        for j in range(i, len(X)):
+            distance_matrix[i][j] = np.linalg.norm(X[i] - X[j])
+            distance_matrix[j][i] = distance_matrix[i][j]
+
+    distance_matrix[:, 0] = 0
+    return distance_matrix
+
+
+@pytest.fixture
+def X():
+    return np.random.default_rng(0).normal(size=(57, 24)).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_size', [None, 1, 7, 57, 100])
+def test_no_return_dm_matches_reference(X, block_size):
+    D = no_return_dm(X, block_size=block_size)
+    assert D.dtype == np.float32
+    np.testing.assert_allclose(D, reference_dm(X), rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('block_size', [None, 8])
+def test_no_return_column(X, block_size):
+    D = no_return_dm(X, block_size=block_size)
+    assert not D[:, 0].any()
+    assert D[0, 1:].all()
+    full = distance_matrix(X, block_size=block_size)
+    np.testing.assert_allclose(D[:, 1:], full[:, 1:], rtol=1e-6)
+    np.testing.assert_array_equal(full, full.T)
+    assert not np.diag(full).any()
+
+
+def test_cosine(X):
+    D = distance_matrix(X, metric='cosine', block_size=5)
+    unit = X / np.linalg.norm(X, axis=1, keepdims=True)
+    np.testing.assert_allclose(D, np.clip(1 - unit @ unit.T, 0, 2), atol=1e-5)
+
+
+def test_shared_offset_keeps_precision():
+    # a large common offset cancels badly in ||x||^2 + ||y||^2 - 2 x.y unless the rows are centred
+    X = np.random.default_rng(1).normal(size=(200, 64)).astype(np.float32) * 0.01 + 100
+    expected = reference_dm(X.astype(np.float64))
+    assert np.abs(no_return_dm(X, block_size=16) - expected).max() < 1e-3 * expected.mean()
+
+
+def test_compact_inputs(X):
+    Q = QuantizedVectors.quantize(X)
+    expected = reference_dm(Q.dequantize().astype(np.float64))
+    np.testing.assert_allclose(no_return_dm(Q, block_size=10), expected, rtol=1e-4, atol=1e-4)
+    half = X.astype(np.float16)
+    np.testing.assert_allclose(no_return_dm(half), reference_dm(half.astype(np.float64)), rtol=1e-4, atol=1e-4)
+
+
+def test_blocks_against_other_rows(X):
+    Y = X[:9] + 1
+    blocks = list(iter_distance_blocks(X, Y, block_size=10))
+    assert [(start, stop) for start, stop, _ in blocks] == [(0, 10), (10, 20), (20, 30), (30, 40), (40, 50), (50, 57)]
+    D = np.vstack([block for _, _, block in blocks])
+    expected = np.linalg.norm(X[:, None, :].astype(np.float64) - Y[None, :, :], axis=2)
+    np.testing.assert_allclose(D, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_unknown_metric(X):
+    with pytest.raises(ValueError):
+        distance_matrix(X, metric='manhattan')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_pair_distances_match_matrix(X, compact):
+    data = QuantizedVectors.quantize(X) if compact else X
+    D = no_return_dm(data)
+    lazy = PairDistances(data, zero_column=0)
+    p = np.random.default_rng(2).permutation(len(X))
+    np.testing.assert_allclose(lazy[p, np.roll(p, -1)], D[p, np.roll(p, -1)], rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(lazy[5, p], D[5, p], rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(lazy[p, 5], D[p, 5], rtol=1e-5, atol=1e-5)
+    assert lazy[3, 0] == 0 and lazy[3, 4] == pytest.approx(D[3, 4], rel=1e-5)
+    assert not lazy[p, 0].any()
@@ -0,0 +1,68 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from utils.backends import LocalBackend
+from utils.embed import create_embeddings
+from utils.reduce import reduced_model
+from utils.store import load_embeddings, stored_dtypes
+
+
+class CountingBackend(LocalBackend):
+    """The local backend, counting the texts it is asked to embed"""
+    def __init__(self):
+        super().__init__(dim=64)
+        self.texts = 0
+
+    def embed(self, texts):
+        self.texts += len(texts)
+        return super().embed(texts)
+
+
+@pytest.fixture
+def backend():
+    return CountingBackend()
+
+
+def embed(library, backend, **options):
+    return create_embeddings(library, backend=backend, **options)
+
+
+def dtypes(library, model):
+    conn = sqlite3.connect(library)
+    try:
+        return stored_dtypes(conn, model)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('dtype', ['int8', 'float16'])
+def test_dtype_change_repacks_without_the_backend(library, backend, dtype):
+    first = embed(library, backend)
+    assert first['embedded'] == 60 and first['dtypes'] == ['float32'] and backend.texts == 60
+
+    counts = embed(library, backend, dtype=dtype)
+    assert backend.texts == 60
+    assert counts['embedded'] == 0 and counts['skipped'] == 60 and counts['repacked'] == 60
+    assert counts['dtypes'] == [dtype] and dtypes(library, backend.model) == [dtype]
+
+    conn = sqlite3.connect(library)
+    _, _, X = load_embeddings(conn, backend.model)
+    conn.close()
+    # the local backend's vectors are unit length, re-packing only rounds them
+    assert X.shape == (60, 64) and np.allclose(np.linalg.norm(X, axis=1), 1, atol=0.02)
+
+    again = embed(library, backend, dtype=dtype)
+    assert again['repacked'] == 0 and backend.texts == 60
+
+
+def test_dtype_change_repacks_reduced_copies(library, backend):
+    first = embed(library, backend, pca_dim=16)
+    target = reduced_model(backend.model, 16)
+    assert first['model'] == target and first['dtypes'] == ['float32']
+
+    counts = embed(library, backend, pca_dim=16, dtype='int8')
+    assert backend.texts == 60
+    assert counts['repacked'] == 60 and counts['dtypes'] == ['int8']
+    assert dtypes(library, target) == ['int8'] and dtypes(library, backend.model) == ['float32']
@@ -0,0 +1,134 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from utils.backends import OpenAIBackend
+from utils.embed import create_embeddings, estimate_tokens
+
+MODEL = OpenAIBackend.model
+
+
+class EmbeddingServer:
+    """Stand-in for the embeddings endpoint, failing every fail_every-th request and any containing fail_text"""
+    def __init__(self, db, fail_every=None, fail_text=None, status=500):
+        self.db = db
+        self.fail_every = fail_every
+        self.fail_text = fail_text
+        self.status = status
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def committed(self):
+        conn = sqlite3.connect(self.db)
+        count = conn.execute('SELECT COUNT(*) FROM embeddings WHERE model = ?', (MODEL,)).fetchone()[0]
+        conn.close()
+        return count
+
+    def respond(self, method, path, body):
+        assert (method, path) == ('POST', '/v1/embeddings')
+        texts = body['input']
+        with self.lock:
+            failing = bool(self.fail_every and (len(self.requests) + 1) % self.fail_every == 0)
+            failing = failing or any(self.fail_text and self.fail_text in text for text in texts)
+            self.requests.append({'time': time.monotonic(), 'texts': texts, 'ok': not failing,
+                                  'committed': self.committed()})
+        if failing:
+            return self.status, {'error': {'message': 'stand-in failure', 'type': 'server_error'}}
+        data = [{'object': 'embedding', 'index': i, 'embedding': vector(text)} for i, text in enumerate(texts)]
+        return 200, {'object': 'list', 'data': data, 'model': body['model'],
+                     'usage': {'prompt_tokens': 1, 'total_tokens': 1}}
+
+    def ok(self):
+        return [request for request in self.requests if request['ok']]
+
+
+def vector(text):
+    digest = hashlib.sha256(text.encode()).digest()
+    return [b / 255 for b in digest[:8]]
+
+
+@pytest.fixture
+def endpoint(stub_server, library, monkeypatch):
+    def start(**options):
+        server = EmbeddingServer(library, **options)
+        monkeypatch.setenv('OPENAI_BASE_URL', stub_server(server.respond) + '/v1')
+        monkeypatch.setenv('OPENAI_API_KEY', 'test')
+        return server
+    return start
+
+
+def embed(library, max_tokens=1000, **options):
+    backend = OpenAIBackend(**{'concurrency': 1, 'rpm': 0, 'backoff': 0.05, **options})
+    return create_embeddings(library, backend=backend, max_tokens=max_tokens, update_index=False)
+
+
+def stored(library):
+    conn = sqlite3.connect(library)
+    rows = conn.execute('SELECT book_id FROM embeddings WHERE model = ?', (MODEL,)).fetchall()
+    conn.close()
+    return {row[0] for row in rows}
+
+
+def test_batches_stay_under_token_budget(endpoint, library):
+    server = endpoint()
+    result = embed(library, max_tokens=1000, concurrency=3)
+    assert result['embedded'] == 60 and result['failed'] == 0
+    assert len(server.requests) > 1
+    assert all(sum(estimate_tokens(text) for text in request['texts']) <= 1000 for request in server.requests)
+    assert sum(len(request['texts']) for request in server.requests) == 60
+    assert len(stored(library)) == 60
+
+
+def test_commits_after_each_batch(endpoint, library):
+    server = endpoint()
+    embed(library)
+    done = 0
+    for request in server.requests:
+        # with one request in flight, everything returned before it is already committed
+        assert request['committed'] == done
+        done += len(request['texts'])
+
+
+def test_retries_with_backoff(endpoint, library):
+    server = endpoint(fail_every=3)
+    result = embed(library, max_retries=3, backoff=0.05)
+    assert result['embedded'] == 60 and result['failed'] == 0
+    assert len(stored(library)) == 60
+    failures = [i for i, request in enumerate(server.requests) if not request['ok']]
+    assert failures
+    for i in failures:
+        retry = server.requests[i + 1]
+        assert retry['texts'] == server.requests[i]['texts']
+        assert retry['time'] - server.requests[i]['time'] >= 0.05
+
+
+def test_failed_batches_are_counted_and_resumed(endpoint, library):
+    conn = sqlite3.connect(library)
+    title = conn.execute('SELECT title FROM books WHERE id = 7').fetchone()[0]
+    conn.close()
+    server = endpoint(fail_text=f"'title': '{title}'")
+    first = embed(library, max_retries=1, backoff=0.01)
+    failing = [request for request in server.requests if not request['ok']]
+    assert failing
+    # the batch is tried once more, then given up on
+    failed_texts = {text for request in failing for text in request['texts']}
+    assert first['failed'] == len(failed_texts)
+    assert first['embedded'] == 60 - first['failed']
+    assert len(stored(library)) == 60 - first['failed']
+
+    server.fail_text = None
+    server.requests.clear()
+    second = embed(library)
+    assert second['embedded'] == first['failed'] and second['skipped'] == 60 - first['failed']
+    assert {text for request in server.requests for text in request['texts']} == failed_texts
+    assert len(stored(library)) == 60
+
+
+def test_client_errors_are_not_retried(endpoint, library):
+    server = endpoint(fail_every=1, status=400)
+    result = embed(library, max_retries=3)
+    assert result['failed'] == 60 and result['embedded'] == 0
+    assert len(server.requests) == len({tuple(request['texts']) for request in server.requests})
@@ -0,0 +1,126 @@
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from utils.google_books import GoogleBooksClient, ResponseCache, parse_editions
+
+
+def volume(title, isbn):
+    return {'volumeInfo': {'title': title, 'authors': ['Frank Herbert'], 'printType': 'BOOK',
+                           'industryIdentifiers': [{'type': 'ISBN_13', 'identifier': isbn}]}}
+
+
+class VolumesServer:
+    """Stand-in for the volumes endpoint, answering each query with one volume titled after it"""
+    def __init__(self, delay=0, failures=0, status=503):
+        self.delay = delay
+        self.failures = failures
+        self.status = status
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def respond(self, method, path, body):
+        query = parse_qs(urlparse(path).query)['q'][0]
+        with self.lock:
+            self.queries.append(query)
+            failing = self.failures > 0
+            self.failures -= failing
+        time.sleep(self.delay)
+        if failing:
+            return self.status, {'error': 'unavailable'}
+        return 200, {'items': [volume(query, '9780441013593')]}
+
+
+@pytest.fixture
+def google(stub_server, tmp_path, monkeypatch):
+    """start(**options) runs a stand-in server and returns (server, make_client) for clients pointed at it"""
+    clients = []
+
+    def start(**options):
+        server = VolumesServer(**options)
+        monkeypatch.setenv('BOOKSHELF_GOOGLE_BOOKS_URL', stub_server(server.respond) + '/books/v1/volumes')
+
+        def make_client(ttl=3600, offline=False, **kwargs):
+            client = GoogleBooksClient(cache=ResponseCache(str(tmp_path / 'http.db'), ttl=ttl), offline=offline,
+                                       **kwargs)
+            clients.append(client)
+            return client
+        return server, make_client
+    yield start
+    for client in clients:
+        client.close()
+
+
+def titles(items):
+    return [edition['title'] for edition in parse_editions(items)]
+
+
+def test_repeat_query_comes_from_cache(google):
+    server, make_client = google()
+    client = make_client()
+    assert titles(client.volumes('dune')) == ['DUNE']
+    start = time.perf_counter()
+    assert titles(client.volumes('dune')) == ['DUNE']
+    assert time.perf_counter() - start < 0.05
+    assert server.queries == ['dune']
+    # the cache outlives the client
+    assert titles(make_client().volumes('dune')) == ['DUNE']
+    assert server.queries == ['dune']
+
+
+def test_queries_run_concurrently(google):
+    server, make_client = google(delay=0.4)
+    client = make_client()
+    start = time.perf_counter()
+    results = client.volumes_many(['isbn:9780441013593', 'intitle:dune inauthor:herbert'])
+    assert time.perf_counter() - start < 0.75
+    assert [titles(items) for items in results] == [['ISBN:9780441013593'], ['INTITLE:DUNE INAUTHOR:HERBERT']]
+    assert sorted(server.queries) == ['intitle:dune inauthor:herbert', 'isbn:9780441013593']
+
+
+def test_unavailable_is_retried(google):
+    server, make_client = google(failures=2)
+    assert titles(make_client(retries=3).volumes('dune')) == ['DUNE']
+    assert server.queries == ['dune'] * 3
+
+
+def test_expired_answer_served_when_server_fails(google):
+    server, make_client = google()
+    client = make_client(ttl=0, retries=0)
+    assert titles(client.volumes('dune')) == ['DUNE']
+    server.failures = 10
+    # expired, so the server is asked again, and its failure falls back to the stored answer
+    assert titles(client.volumes('dune')) == ['DUNE']
+    assert server.queries == ['dune', 'dune']
+    with pytest.raises(requests.RequestException):
+        client.volumes('children of dune')
+
+
+def test_offline_answers_from_cache_only(google):
+    server, make_client = google()
+    make_client(ttl=0).volumes('dune')
+    offline = make_client(ttl=0, offline=True)
+    assert titles(offline.volumes('dune')) == ['DUNE']
+    assert offline.volumes('emma') == []
+    assert server.queries == ['dune']
+
+
+def test_offline_from_environment(google, monkeypatch):
+    server, make_client = google()
+    monkeypatch.setenv('BOOKSHELF_OFFLINE', '1')
+    client = GoogleBooksClient(cache=ResponseCache(':memory:'))
+    assert client.offline and client.volumes('dune') == []
+    assert server.queries == []
+
+
+@pytest.mark.parametrize('workers', [4, 8])
+def test_pool_keeps_a_connection_per_worker(google, stub_server, workers):
+    server, make_client = google(delay=0.05)
+    client = make_client(workers=workers)
+    for round in range(3):
+        client.volumes_many([f'isbn:{round}{i}' for i in range(workers)])
+    # every lookup thread keeps its connection open, none are dropped and re-made between rounds
+    assert len(stub_server.servers[-1].connections) == workers
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+
+import pytest
+
+from benchmarks.synthetic import model_name
+from utils.projection import project_library
+from utils.store import load_embeddings, load_tour, save_tour
+from utils.tsp import visual_tsp
+
+MODEL = model_name(32)
+
+
+@pytest.fixture
+def conn(library):
+    conn = sqlite3.connect(library)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('method', ['pca', 'pca-tsne'])
+def test_reports_refits(conn, method):
+    book_ids, _, X = load_embeddings(conn, MODEL)
+    coords, refitted = project_library(conn, MODEL, book_ids, X, method)
+    assert refitted and coords.shape == (60, 2)
+    again, refitted = project_library(conn, MODEL, book_ids, X, method)
+    assert not refitted and (again == coords).all()
+    # a few new books are placed, most new books refit
+    _, refitted = project_library(conn, MODEL, book_ids[:50], X[:50], method)
+    assert not refitted
+    conn.execute('DELETE FROM projections WHERE book_id > 20')
+    _, refitted = project_library(conn, MODEL, book_ids, X, method)
+    assert refitted
+    _, refitted = project_library(conn, MODEL, book_ids, X, method, refit=True)
+    assert refitted
+
+
+def test_refit_does_not_warm_start(library, conn, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(library))
+    book_ids, titles, _ = load_embeddings(conn, MODEL)
+    visual_tsp(library, MODEL, time_limit=1, projection='pca')
+    # a warm start would keep the first book of the saved tour
+    save_tour(conn, MODEL, 'visual-pca', book_ids[::-1], 0)
+    conn.commit()
+    tour, _ = visual_tsp(library, MODEL, time_limit=1, projection='pca', refit=True)
+    assert tour[0] == f'1. {titles[0]}'
+    assert load_tour(conn, MODEL, 'visual-pca')[0] == book_ids[0]
+
+
+def test_projections_keep_their_own_tours(library, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(library))
+    tsne, _ = visual_tsp(library, MODEL, time_limit=1, projection='pca-tsne')
+    visual_tsp(library, MODEL, time_limit=1, projection='pca')
+    # nothing changed for t-SNE, so it picks up its own tour rather than the PCA one
+    again, _ = visual_tsp(library, MODEL, time_limit=1, projection='pca-tsne')
+    assert again == tsne
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import utils.quantize
+from utils.quantize import QuantizedVectors, unpack_int8
+
+
+@pytest.fixture
+def X():
+    return np.random.default_rng(0).normal(size=(300, 40)).astype(np.float32)
+
+
+def test_round_trip(X):
+    Q = QuantizedVectors.quantize(X)
+    assert Q.codes.dtype == np.int8 and Q.nbytes == X.size + 4 * len(X)
+    error = np.abs(Q.dequantize() - X)
+    assert (error <= Q.scales[:, None] / 2 + 1e-6).all()
+    assert np.allclose(np.abs(Q.dequantize()).max(axis=1), np.abs(X).max(axis=1))
+    blobs = [Q.pack(i) for i in range(len(Q))]
+    np.testing.assert_array_equal(unpack_int8(blobs[5]), Q[5])
+    again = QuantizedVectors.from_blobs(blobs, X.shape[1])
+    np.testing.assert_array_equal(again.codes, Q.codes)
+    np.testing.assert_array_equal(again.scales, Q.scales)
+
+
+def test_zero_rows():
+    Q = QuantizedVectors.quantize(np.zeros((2, 5)))
+    assert not Q.dequantize().any() and (Q.scales == 1).all()
+
+
+@pytest.mark.parametrize('block_bytes', [1, 4 * 40 * 7, None])
+def test_sq_norms_in_blocks(X, monkeypatch, block_bytes):
+    if block_bytes:
+        monkeypatch.setattr(utils.quantize, 'NORM_BLOCK_BYTES', block_bytes)
+    Q = QuantizedVectors.quantize(X)
+    dequantized = Q.dequantize().astype(np.float64)
+    np.testing.assert_allclose(Q.sq_norms(), np.einsum('ij,ij->i', dequantized, dequantized), rtol=1e-5)
@@ -0,0 +1,46 @@
+import asyncio
+import sqlite3
+
+import numpy as np
+
+from benchmarks.synthetic import model_name
+from utils.server import Library, create_app
+from utils.store import repack_embeddings
+
+
+def test_repack_reloads_the_library(library):
+    model = model_name(32)
+    shelf = Library(library, manager_factory=None)
+    _, _, before = shelf.get_embeddings(model)
+    generation = shelf.generation
+
+    conn = sqlite3.connect(library)
+    assert repack_embeddings(conn, model, 'float16')
+    conn.commit()
+    conn.close()
+
+    # same rows and rowids, only the blobs changed
+    assert shelf.refresh()
+    assert shelf.generation == generation + 1
+    _, _, after = shelf.get_embeddings(model)
+    assert after.dtype == np.float16 and before.dtype != np.float16
+
+
+def test_poller_keeps_going_after_errors(library, monkeypatch):
+    calls = []
+
+    def fail(self):
+        calls.append(1)
+        raise ValueError('bad row')
+
+    monkeypatch.setattr(Library, 'warm', fail)
+    monkeypatch.setattr(Library, 'refresh', lambda self: True)
+    app = create_app(None, library, workers=1, poll_interval=0.01)
+
+    async def run():
+        # startup survives a failed warm, and every tick after a failure polls again
+        async with app.router.lifespan_context(app):
+            await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert len(calls) > 3
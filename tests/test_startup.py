@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.startup import HEAVY, LIGHT_COMMANDS, import_profile
+
+
+@pytest.mark.parametrize('command', LIGHT_COMMANDS)
+def test_light_commands_skip_the_ml_stack(command):
+    _, _, packages = import_profile(command)
+    assert not packages.intersection(HEAVY)
@@ -0,0 +1,54 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from utils.store import load_tour, save_tour
+from utils.distance import distance_matrix
+from utils.tsp import insert_cheapest, parallel_solve, plan_tour, polish, tour_length
+
+
+@pytest.fixture
+def conn(library):
+    conn = sqlite3.connect(library)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def X():
+    return np.random.default_rng(0).normal(size=(40, 8)).astype(np.float32)
+
+
+def test_workers_solve_from_scratch(conn, X):
+    book_ids = list(range(1, 41))
+    # a warm start keeps the first book of the saved tour, a fresh solve starts at row 0
+    save_tour(conn, 'm', 'full', book_ids[::-1], 0)
+    warm, _ = plan_tour(conn, 'm', 'full', book_ids, X, time_limit=1)
+    assert warm[0] == 39
+
+    save_tour(conn, 'm', 'full', book_ids[::-1], 0)
+    permutation, distance = plan_tour(conn, 'm', 'full', book_ids, X, time_limit=1, workers=2, seed=3)
+    assert permutation[0] == 0
+    assert load_tour(conn, 'm', 'full') == [book_ids[i] for i in permutation]
+
+    save_tour(conn, 'm', 'full', book_ids[::-1], 0)
+    again, again_distance = plan_tour(conn, 'm', 'full', book_ids, X, time_limit=1, workers=2, seed=3)
+    assert again == permutation and again_distance == pytest.approx(distance)
+
+
+def test_anneal_is_not_run_in_parallel(X):
+    with pytest.raises(ValueError, match='cannot be seeded'):
+        parallel_solve(np.zeros((40, 40)), 2, solver='anneal')
+
+
+def test_warm_start_matches_dense_matrix(conn, X):
+    book_ids = list(range(1, 41))
+    save_tour(conn, 'm', 'full', book_ids[:35], 0)
+    permutation, distance = plan_tour(conn, 'm', 'full', book_ids, X, time_limit=1)
+
+    D = distance_matrix(X)
+    D[:, 0] = 0
+    expected = [int(i) for i in polish(D, insert_cheapest(D, list(range(35)), range(35, 40)), range(35, 40))]
+    assert permutation == expected
+    assert distance == pytest.approx(tour_length(D, expected), rel=1e-5)
@@ -0,0 +1,209 @@
+import os
+import re
+import shutil
+import numpy as np
+
+from utils.distance import iter_distance_blocks
+from utils.store import load_embeddings
+
+# rebuild the clustering once the index has grown this much since it was built
+REBUILD_GROWTH = 2.0
+
+
+def index_path(bookshelf_loc, model):
+    """Directory holding the ANN index for model, next to the database file"""
+    base = os.path.splitext(os.path.abspath(bookshelf_loc))[0]
+    return f"{base}.ann{os.sep}{re.sub(r'[^A-Za-z0-9_.-]', '_', model)}"
+
+
+def kmeans(X, n_clusters, iters=10, seed=0, sample=20000):
+    """Plain Lloyd's k-means on a sample of X, returning float32 centroids"""
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) > sample:
+        X = X[rng.choice(len(X), sample, replace=False)]
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(X, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        counts = np.bincount(labels, minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def assign(X, centroids):
+    """Index of the nearest centroid for every row of X"""
+    labels = np.empty(len(X), dtype=np.int64)
+    for start, stop, block in iter_distance_blocks(X, centroids):
+        labels[start:stop] = block.argmin(axis=1)
+    return labels
+
+
+def _top_k(distances, k):
+    k = min(k, len(distances))
+    nearest = np.argpartition(distances, k - 1)[:k]
+    return nearest[np.argsort(distances[nearest])]
+
+
+class IVFIndex:
+    """Inverted-file index: vectors bucketed by nearest k-means centroid.
+
+    A query only scans the buckets of its n_probe closest centroids. Vectors
+    are stored sorted by bucket so every bucket is one contiguous slice, and
+    the arrays are memory-mapped when loaded so opening the index is cheap.
+    """
+    def __init__(self, centroids, ids, vectors, offsets, built_size, norms=None):
+        self.centroids = centroids
+        self.ids = ids
+        self.vectors = vectors
+        self.offsets = offsets
+        self.built_size = built_size
+        self.centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+        # saved with the index, computing them would read every vector on open
+        self.norms = norms if norms is not None else np.einsum('ij,ij->i', vectors, vectors)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, X, n_lists=None, seed=0):
+        X = np.asarray(X, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(X))))
+        centroids = kmeans(X, min(n_lists, len(X)), seed=seed)
+        return cls._from_assignment(centroids, np.asarray(ids, dtype=np.int64), X, assign(X, centroids), len(X))
+
+    @classmethod
+    def _from_assignment(cls, centroids, ids, X, labels, built_size):
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, ids[order], np.ascontiguousarray(X[order]), offsets, built_size)
+
+    def labels(self):
+        return np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+
+    def update(self, ids, X, remove=()):
+        """Drop the ids in remove, then add (or replace) ids with vectors X"""
+        ids = np.asarray(ids, dtype=np.int64)
+        drop = np.isin(self.ids, np.concatenate([np.asarray(remove, dtype=np.int64), ids]))
+        keep_ids = self.ids[~drop]
+        keep_vectors = np.asarray(self.vectors)[~drop]
+        keep_labels = self.labels()[~drop]
+
+        X = np.asarray(X, dtype=np.float32).reshape(len(ids), keep_vectors.shape[1])
+        updated = IVFIndex._from_assignment(
+            self.centroids,
+            np.concatenate([keep_ids, ids]),
+            np.concatenate([keep_vectors, X]),
+            np.concatenate([keep_labels, assign(X, self.centroids)]),
+            self.built_size,
+        )
+        self.__dict__.update(updated.__dict__)
+
+    def needs_rebuild(self):
+        return len(self) > REBUILD_GROWTH * max(self.built_size, 1)
+
+    def search(self, query, k=10, n_probe=4):
+        """Approximate k nearest neighbours of query, returning (ids, distances)"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        to_centroids = self.centroid_norms - 2 * (self.centroids @ query)
+        probes = _top_k(to_centroids, n_probe)
+
+        # scan each probed bucket in place, ||v||^2 - 2 v.q ranks like ||v - q||^2
+        rows, scores = [], []
+        for p in probes:
+            start, stop = self.offsets[p], self.offsets[p + 1]
+            rows.append(np.arange(start, stop))
+            scores.append(self.norms[start:stop] - 2 * (self.vectors[start:stop] @ query))
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if not len(rows):
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+
+        nearest = _top_k(scores, k)
+        distances = np.sqrt(np.maximum(scores[nearest] + query @ query, 0))
+        return self.ids[rows[nearest]], distances
+
+    def exact_search(self, query, k=10):
+        """Brute-force k nearest neighbours over every stored vector, for measuring recall"""
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        distances = np.concatenate([block[0] for _, _, block in iter_distance_blocks(query, self.vectors)])
+        nearest = _top_k(distances, k)
+        return self.ids[nearest], distances[nearest]
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ('centroids', 'ids', 'vectors', 'offsets', 'norms'):
+            np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(getattr(self, name)))
+        np.save(os.path.join(tmp, 'built_size.npy'), np.array(self.built_size))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.isdir(path):
+            return None
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in ('centroids', 'ids', 'vectors', 'offsets', 'norms')
+                  if os.path.exists(os.path.join(path, f'{name}.npy'))}
+        built_size = int(np.load(os.path.join(path, 'built_size.npy')))
+        # indexes saved without norms.npy compute them on open
+        return cls(np.asarray(arrays['centroids']), np.asarray(arrays['ids']), arrays['vectors'],
+                   np.asarray(arrays['offsets']), built_size, arrays.get('norms'))
+
+
+def sync_index(conn, bookshelf_loc, model, changed_ids=()):
+    """Bring the on-disk index for model in line with the stored embeddings.
+
+    Vectors for changed_ids and for books the index has never seen are
+    (re)inserted into their nearest bucket and deleted books are dropped.
+    The clustering is only recomputed when there is no index yet or the
+    library has grown past REBUILD_GROWTH times its size at build time.
+    """
+    book_ids, _, X = load_embeddings(conn, model)
+    path = index_path(bookshelf_loc, model)
+    if not book_ids:
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    book_ids = np.asarray(book_ids, dtype=np.int64)
+    index = IVFIndex.load(path)
+    if index is not None and index.vectors.shape[1] != X.shape[1]:
+        index = None
+
+    if index is None:
+        index = IVFIndex.build(book_ids, X)
+    else:
+        stale = np.setdiff1d(index.ids, book_ids)
+        changed = np.intersect1d(np.asarray(changed_ids, dtype=np.int64), book_ids)
+        fresh = np.union1d(np.setdiff1d(book_ids, index.ids), changed)
+        if not len(stale) and not len(fresh):
+            return index
+        index.update(fresh, X[np.searchsorted(book_ids, fresh)], remove=stale)
+        if index.needs_rebuild():
+            index = IVFIndex.build(book_ids, X)
+
+    index.save(path)
+    return index
+
+
+def open_index(conn, bookshelf_loc, model):
+    """Load the index for model, building it first if embed has not written one yet"""
+    index = IVFIndex.load(index_path(bookshelf_loc, model))
+    return index if index is not None else sync_index(conn, bookshelf_loc, model)
+
+
+def similar_books(index, book_id, k=10, n_probe=4, exact=False):
+    """Up to k (book_id, distance) pairs closest to book_id, nearest first and excluding itself"""
+    rows = np.flatnonzero(index.ids == book_id)
+    if not len(rows):
+        raise KeyError(book_id)
+    query = np.asarray(index.vectors[rows[0]])
+    if exact:
+        ids, distances = index.exact_search(query, k + 1)
+    else:
+        ids, distances = index.search(query, k + 1, n_probe)
+    return [(int(i), float(d)) for i, d in zip(ids, distances) if i != book_id][:k]
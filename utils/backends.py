@@ -0,0 +1,156 @@
+import asyncio
+import random
+import time
+import numpy as np
+
+
+def retryable_errors():
+    """openai errors worth retrying, openai is only imported once a request is made"""
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class EmbeddingBackend:
+    """Turns book texts into vectors.
+
+    name is the key used on the command line and model is recorded with every
+    stored vector, so vectors from different backends are never mixed.
+    """
+    name = None
+    model = None
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def embed_batches(self, batches, on_batch):
+        """Embed batches of (key, text) pairs, calling on_batch(batch, vectors) for each.
+
+        Returns the batches that could not be embedded.
+        """
+        for batch in batches:
+            on_batch(batch, self.embed([text for _, text in batch]))
+        return []
+
+
+class RateLimiter:
+    """Spaces out request starts so no more than rpm are sent per minute"""
+    def __init__(self, rpm):
+        self.interval = 60 / rpm if rpm else 0
+        self.next_slot = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """OpenAI embeddings, shortened by the API itself when dimensions is given.
+
+    text-embedding-3 models return a prefix of the full vector renormalised,
+    so shortened vectors keep most of the quality. They are stored under
+    <model>@<dimensions> and never mixed with full-length ones.
+    """
+    name = 'openai'
+    model = 'text-embedding-3-large'
+
+    def __init__(self, concurrency=4, rpm=500, max_retries=5, backoff=1.0, dimensions=None):
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dimensions = dimensions
+        if dimensions:
+            self.model = f'{type(self).model}@{dimensions}'
+
+    def embed(self, texts):
+        out = []
+        failed = self.embed_batches([list(enumerate(texts))], lambda batch, vectors: out.extend(vectors))
+        if failed:
+            raise RuntimeError("Embedding request failed after retries")
+        return out
+
+    def embed_batches(self, batches, on_batch):
+        return asyncio.run(self._embed_batches(batches, on_batch))
+
+    async def _embed_batch(self, client, texts, semaphore, limiter):
+        retryable = retryable_errors()
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await limiter.wait()
+                try:
+                    res = await client.embeddings.create(model=type(self).model, input=texts, encoding_format="float",
+                                                         **({'dimensions': self.dimensions} if self.dimensions else {}))
+                    return [r.embedding for r in sorted(res.data, key=lambda r: r.index)]
+                except retryable:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    async def _embed_batches(self, batches, on_batch):
+        import openai
+        client = openai.AsyncOpenAI(max_retries=0)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.rpm)
+
+        async def run(batch):
+            texts = [text for _, text in batch]
+            return batch, await self._embed_batch(client, texts, semaphore, limiter)
+
+        tasks = {asyncio.ensure_future(run(batch)): batch for batch in batches}
+        for task in asyncio.as_completed(list(tasks)):
+            try:
+                batch, vectors = await task
+            except openai.OpenAIError:
+                continue
+            on_batch(batch, vectors)
+
+        return [batch for task, batch in tasks.items() if task.exception() is not None]
+
+
+class LocalBackend(EmbeddingBackend):
+    """Offline embeddings: hashed word n-gram counts projected down to a dense vector.
+
+    Both steps are fixed given the seed and never fitted to the library, so a
+    book embedded today lands in the same space as one embedded next month
+    and incremental embed runs stay comparable.
+    """
+    name = 'local'
+
+    def __init__(self, dim=256, seed=0):
+        self.dim = dim
+        self.seed = seed
+        self.model = f'local-hashing-{dim}'
+
+    def embed(self, texts):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.random_projection import SparseRandomProjection
+        from scipy.sparse import csr_matrix
+
+        vectorizer = HashingVectorizer(
+            n_features=2 ** 18, ngram_range=(1, 2), stop_words='english',
+            alternate_sign=False, norm=None
+        )
+        counts = vectorizer.transform(texts)
+        counts.data = np.log1p(counts.data)
+
+        projection = SparseRandomProjection(n_components=self.dim, dense_output=True, random_state=self.seed)
+        projection.fit(csr_matrix((1, vectorizer.n_features)))
+        X = np.asarray(projection.transform(counts), dtype=np.float32)
+
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return X / norms
+
+
+BACKENDS = {backend.name: backend for backend in (OpenAIBackend, LocalBackend)}
+
+
+def get_backend(name='openai', **kwargs):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', expected one of {list(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import time
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'bookshelf', 'embeddings.db')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def default_cache_path():
+    return os.environ.get('BOOKSHELF_CACHE', DEFAULT_CACHE_PATH)
+
+
+class EmbeddingCache:
+    """Content-addressed store of embedding vectors shared by every bookshelf.db.
+
+    Vectors are keyed by (model, hash of the input text), so the same book in
+    two libraries is only ever sent to a backend once. When the stored vectors
+    grow past max_bytes the least recently used ones are evicted.
+    """
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS vectors (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)')
+        self.conn.commit()
+
+    def get_many(self, model, hashes):
+        """Return {hash: float32 vector} for the hashes present, counting hits and misses"""
+        found = {}
+        hashes = list(hashes)
+        c = self.conn.cursor()
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            c.execute(f'''
+                SELECT text_hash, vector FROM vectors
+                WHERE model = ? AND text_hash IN ({', '.join('?' * len(chunk))})
+            ''', [model] + chunk)
+            for text_hash, vector in c.fetchall():
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            c.executemany('UPDATE vectors SET last_used = ? WHERE model = ? AND text_hash = ?',
+                          [(now, model, text_hash) for text_hash in found])
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model, hashes, vectors):
+        now = time.time()
+        rows = []
+        for text_hash, vector in zip(hashes, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((model, text_hash, len(vector), vector.tobytes(), now))
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO vectors (model, text_hash, dim, vector, last_used)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+        self.prune()
+
+    def stats(self):
+        c = self.conn.cursor()
+        c.execute('''
+            SELECT model, COUNT(*), COALESCE(SUM(LENGTH(vector)), 0)
+            FROM vectors GROUP BY model ORDER BY model
+        ''')
+        models = [{'model': model, 'entries': entries, 'bytes': size} for model, entries, size in c.fetchall()]
+        return {
+            'path': self.path,
+            'entries': sum(m['entries'] for m in models),
+            'bytes': sum(m['bytes'] for m in models),
+            'max_bytes': self.max_bytes,
+            'models': models,
+        }
+
+    def prune(self, max_bytes=None):
+        """Evict least recently used vectors until the cache fits in max_bytes, returning how many went"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        c = self.conn.cursor()
+        c.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM vectors')
+        excess = c.fetchone()[0] - max_bytes
+        if excess <= 0:
+            return 0
+
+        evict = []
+        c.execute('SELECT model, text_hash, LENGTH(vector) FROM vectors ORDER BY last_used')
+        for model, text_hash, size in c:
+            if excess <= 0:
+                break
+            evict.append((model, text_hash))
+            excess -= size
+
+        c.executemany('DELETE FROM vectors WHERE model = ? AND text_hash = ?', evict)
+        self.conn.commit()
+        return len(evict)
+
+    def close(self):
+        self.conn.close()
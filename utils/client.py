@@ -0,0 +1,71 @@
+import os
+import requests
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# base URL of a running books serve, 'off' to never use one
+SERVER_ENV = 'BOOKSHELF_SERVER'
+
+# how long to wait for /health before running the command locally
+PROBE_TIMEOUT = 0.3
+
+
+class ServerError(Exception):
+    pass
+
+
+def server_url():
+    return os.environ.get(SERVER_ENV, f'http://{DEFAULT_HOST}:{DEFAULT_PORT}').rstrip('/')
+
+
+class BookshelfClient:
+    """Talks to books serve over HTTP, see utils.server for the endpoints"""
+    def __init__(self, url=None, timeout=(3.05, None)):
+        self.url = (url or server_url()).rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @classmethod
+    def find(cls, bookshelf_loc='bookshelf.db'):
+        """A client for the server if one is running on the same database file, else None"""
+        if os.environ.get(SERVER_ENV, '').lower() == 'off':
+            return None
+        client = cls()
+        try:
+            health = client.session.get(f'{client.url}/health', timeout=PROBE_TIMEOUT).json()
+        except (requests.RequestException, ValueError):
+            return None
+        if health.get('db') != os.path.abspath(bookshelf_loc):
+            return None
+        return client
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, f'{self.url}{path}', timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise ServerError(f"Could not reach the bookshelf server at {self.url}: {e}") from e
+        if not response.ok:
+            try:
+                detail = response.json().get('detail')
+            except ValueError:
+                detail = response.text
+            raise ServerError(detail or f"Server error {response.status_code}")
+        return response.json()
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def books(self, sort_status=False, offset=0, limit=100):
+        return self._request('GET', '/books', params={'sort_status': sort_status, 'offset': offset, 'limit': limit})
+
+    def search(self, query, limit=20, highlight=('[', ']')):
+        return self._request('GET', '/search', params={'q': query, 'limit': limit,
+                                                       'open': highlight[0], 'close': highlight[1]})
+
+    def similar(self, book, k=10, backend='openai', probes=4, exact=False, recall=False):
+        return self._request('GET', '/similar', params={'book': book, 'k': k, 'backend': backend, 'probes': probes,
+                                                        'exact': exact, 'recall': recall})
+
+    def tour(self, **options):
+        return self._request('POST', '/tour', json=options)
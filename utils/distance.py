@@ -0,0 +1,227 @@
+import numpy as np
+
+from utils.quantize import QuantizedVectors
+
+METRICS = ('euclidean', 'cosine')
+
+# Upper bound on the size of the intermediate block product, in bytes
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def _block_rows(n, block_size=None):
+    """Number of rows to process at once so a block stays under BLOCK_BYTES"""
+    if block_size:
+        return max(1, int(block_size))
+    return max(1, BLOCK_BYTES // (4 * max(n, 1)))
+
+
+def _is_compact(X):
+    """True for int8 or float16 vectors, which are expanded to float32 a chunk at a time"""
+    return isinstance(X, QuantizedVectors) or X.dtype == np.float16
+
+
+def _compact_or_float32(X):
+    if isinstance(X, QuantizedVectors):
+        return X
+    X = np.asarray(X)
+    return X if _is_compact(X) else np.ascontiguousarray(X, dtype=np.float32)
+
+
+def _float_rows(X, start, stop, shift=None):
+    """X[start:stop] as float32, minus shift when given"""
+    if isinstance(X, QuantizedVectors):
+        rows = X[start:stop]
+    else:
+        rows = np.ascontiguousarray(X[start:stop], dtype=np.float32)
+    return rows if shift is None else rows - shift
+
+
+def _column_mean(X):
+    if not len(X):
+        return np.zeros(X.shape[1], dtype=np.float32)
+    if not _is_compact(X):
+        return X.mean(axis=0, dtype=np.float64).astype(np.float32)
+    total = np.zeros(X.shape[1], dtype=np.float64)
+    rows = _block_rows(X.shape[1])
+    for start in range(0, len(X), rows):
+        total += _float_rows(X, start, start + rows).sum(axis=0, dtype=np.float64)
+    return (total / len(X)).astype(np.float32)
+
+
+def _sq_norms(X, shift=None):
+    if isinstance(X, QuantizedVectors) and shift is None:
+        return X.sq_norms()
+    out = np.empty(len(X), dtype=np.float32)
+    rows = _block_rows(X.shape[1])
+    for start in range(0, len(X), rows):
+        chunk = _float_rows(X, start, start + rows, shift)
+        out[start:start + len(chunk)] = np.einsum('ij,ij->i', chunk, chunk)
+    return out
+
+
+def _products(block, Y, y_scale=None, shift=None):
+    """block @ (Y - shift).T, expanding a compact Y one chunk of rows at a time, with column j divided by y_scale[j]"""
+    if not _is_compact(Y):
+        out = block @ Y.T
+        if y_scale is not None:
+            out /= y_scale[None, :]
+        return out
+    out = np.empty((len(block), len(Y)), dtype=np.float32)
+    rows = _block_rows(Y.shape[1])
+    for start in range(0, len(Y), rows):
+        stop = min(start + rows, len(Y))
+        out[:, start:stop] = block @ _float_rows(Y, start, stop, shift).T
+    if y_scale is not None:
+        out /= y_scale[None, :]
+    return out
+
+
+def iter_distance_blocks(X, Y=None, metric='euclidean', block_size=None):
+    """Yield (start, stop, block) where block holds distances from X[start:stop] to every row of Y.
+
+    Distances are computed with one matrix product per block in float32, so
+    peak memory is bounded by the block size rather than by len(X) ** 2.
+    X and Y may be compact (QuantizedVectors or float16), in which case only
+    the rows in use are expanded to float32 and the whole matrix never is.
+    Euclidean distances are computed on rows centred on the mean of X: they
+    do not change under a shift, and without it ||x||^2 + ||y||^2 - 2 x.y
+    cancels badly for vectors that share a large offset.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+
+    X = _compact_or_float32(X)
+    same = Y is None
+    Y = X if same else _compact_or_float32(Y)
+    x_shift = y_shift = None
+
+    if metric == 'euclidean':
+        # compact rows are shifted as they are expanded, float32 ones once here
+        shift = _column_mean(X)
+        if _is_compact(X):
+            x_shift = shift
+        else:
+            X = X - shift
+        if same:
+            Y, y_shift = X, x_shift
+        elif _is_compact(Y):
+            y_shift = shift
+        else:
+            Y = Y - shift
+
+    if metric == 'cosine':
+        y_norms = np.sqrt(_sq_norms(Y))
+        y_norms[y_norms == 0] = 1
+        if not _is_compact(Y):
+            Y = Y / y_norms[:, None]
+            y_norms = None
+    else:
+        y_sq = _sq_norms(Y, y_shift)
+
+    rows = _block_rows(len(Y), block_size)
+    for start in range(0, len(X), rows):
+        stop = min(start + rows, len(X))
+        block = _float_rows(X, start, stop, x_shift)
+
+        if metric == 'cosine':
+            x_norms = np.linalg.norm(block, axis=1)
+            x_norms[x_norms == 0] = 1
+            out = _products(block, Y, y_norms)
+            out /= x_norms[:, None]
+            np.subtract(1, out, out=out)
+            np.clip(out, 0, 2, out=out)
+        else:
+            x_sq = np.einsum('ij,ij->i', block, block)
+            out = _products(block, Y, shift=y_shift)
+            out *= -2
+            out += x_sq[:, None]
+            out += y_sq[None, :]
+            np.maximum(out, 0, out=out)
+            np.sqrt(out, out=out)
+
+        if same:
+            # cancellation leaves small non-zero values on the diagonal
+            idx = np.arange(start, stop)
+            out[idx - start, idx] = 0
+
+        yield start, stop, out
+
+
+def distance_matrix(X, metric='euclidean', no_return=False, block_size=None, dtype=np.float32):
+    """Full pairwise distance matrix of the rows of X.
+
+    With no_return the first column is zeroed, so going back to the first
+    book is free and a TSP tour over the matrix becomes an open path.
+    """
+    n = len(X)
+    D = np.empty((n, n), dtype=dtype)
+    for start, stop, block in iter_distance_blocks(X, metric=metric, block_size=block_size):
+        D[start:stop] = block
+        # mirror the rows already written and the upper half of the diagonal block so D is exactly symmetric
+        D[start:stop, :start] = D[:start, start:stop].T
+        diagonal = D[start:stop, start:stop]
+        diagonal[...] = np.triu(diagonal) + np.triu(diagonal, 1).T
+
+    if no_return and n:
+        D[:, 0] = 0
+    return D
+
+
+class PairDistances:
+    """Euclidean distances between rows of X, computed when read instead of held in a matrix.
+
+    D[a, b] gives what distance_matrix(X)[a, b] would for integer or
+    integer array indices (broadcast against each other, no slices), so
+    tour code that only reads a few rows at a time can run on it. A read
+    with a scalar index computes that book's whole row once and keeps it,
+    other reads compute just the pairs asked for. Reads with b equal to
+    zero_column are 0, like the no-return column. X may be compact, only
+    the rows in use are expanded.
+    """
+    def __init__(self, X, zero_column=None, cached_rows=64):
+        self.X = _compact_or_float32(X)
+        self.zero_column = zero_column
+        self.cached_rows = cached_rows
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.X)
+
+    def _take(self, index):
+        if isinstance(self.X, QuantizedVectors):
+            return self.X[index]
+        return np.asarray(self.X[index], dtype=np.float32)
+
+    def row(self, a):
+        """Distances from row a to every row, without the zero column"""
+        if a not in self.rows:
+            if len(self.rows) >= self.cached_rows:
+                self.rows.pop(next(iter(self.rows)))
+            x = self._take(a)
+            out = np.empty(len(self.X), dtype=np.float32)
+            rows = _block_rows(self.X.shape[1])
+            for start in range(0, len(self.X), rows):
+                block = _float_rows(self.X, start, start + rows) - x
+                out[start:start + len(block)] = np.sqrt(np.einsum('ij,ij->i', block, block))
+            self.rows[a] = out
+        return self.rows[a]
+
+    def __getitem__(self, key):
+        a, b = (np.asarray(index, dtype=np.int64) for index in key)
+        if a.ndim == 0:
+            out = self.row(int(a))[b]
+        elif b.ndim == 0:
+            out = self.row(int(b))[a]
+        else:
+            a, b = np.broadcast_arrays(a, b)
+            out = np.empty(a.shape, dtype=np.float32)
+            flat_a, flat_b, flat_out = a.ravel(), b.ravel(), out.reshape(-1)
+            rows = _block_rows(self.X.shape[1])
+            for start in range(0, len(flat_a), rows):
+                stop = start + rows
+                diff = self._take(flat_a[start:stop])
+                diff -= self._take(flat_b[start:stop])
+                flat_out[start:stop] = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        if self.zero_column is not None:
+            out = np.where(np.broadcast_to(b, np.shape(out)) == self.zero_column, 0, out).astype(np.float32)
+        return out[()] if np.ndim(out) == 0 else out
@@ -1,41 +1,140 @@
-from openai import OpenAI
+import hashlib
 import sqlite3
-from dotenv import load_dotenv
 
-def create_embeddings(bookshelf_loc='bookshelf.db'):
+from utils.ann import sync_index
+from utils.backends import get_backend
+from utils.reduce import reduce_embeddings
+from utils.store import (ensure_embeddings_table, save_embeddings, get_content_hashes, remove_stale_embeddings,
+                         repack_embeddings, set_active_model, stored_dtypes)
+from utils.timing import span
+
+# fields that describe a book's content, changing any of them triggers a re-embed
+EMBED_FIELDS = [
+    'title', 'author', 'isbn', 'publisher', 'publication_year',
+    'edition', 'format', 'language', 'page_count', 'description',
+]
+
+# per-request limits of the embeddings endpoint
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 100_000
+
+def book_text(book):
+    """Text sent to the embedding model for a book row (dict of EMBED_FIELDS)"""
+    return str({field: book.get(field) for field in EMBED_FIELDS})
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def estimate_tokens(text):
+    # roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def make_batches(items, max_tokens=MAX_BATCH_TOKENS, max_inputs=MAX_BATCH_INPUTS, key=lambda item: item):
+    """Split items into consecutive batches under both the token budget and the input count"""
+    batches, batch, tokens = [], [], 0
+    for item in items:
+        cost = estimate_tokens(key(item))
+        if batch and (tokens + cost > max_tokens or len(batch) >= max_inputs):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+def create_embeddings(bookshelf_loc='bookshelf.db', dtype='float32', force=False, backend=None,
+                      max_tokens=MAX_BATCH_TOKENS, cache=None, update_index=True, pca_dim=None, refit=False):
+    """Embed new or changed books, returning counts of embedded, skipped, failed, re-packed and removed vectors.
+
+    Books found in the shared cache are stored without calling the backend
+    (unless force is set). The rest are sent in token-budgeted batches and each batch is committed
+    as soon as it returns, so an interrupted run resumes where it stopped.
+    Vectors are stored under the backend's model name, and the nearest
+    neighbour index for that model is updated with the ones that changed.
+    Unchanged vectors stored in another dtype are re-packed in place
+    rather than sent to the backend again.
+
+    With pca_dim the vectors are also reduced with a PCA basis stored in
+    the library (see utils.reduce). The full vectors are then kept in
+    float32 to fit from, dtype applies to the reduced copies, and the
+    index is built on those. Either way the model written last becomes the
+    one tsp, similar and export use for this backend.
+    """
+    from dotenv import load_dotenv
     load_dotenv()
+    backend = backend or get_backend()
     conn = sqlite3.connect(bookshelf_loc)
+    ensure_embeddings_table(conn)
     c = conn.cursor()
-    
-    # get headers first
-    c.execute('PRAGMA table_info(books)')
-    headers = [header[1] for header in c.fetchall()]
-    
-    c.execute('SELECT * FROM books')
-    books = c.fetchall()
-    
-    book_list = []
-    for book in books:
-        book = dict(zip(headers, book))
-        book.pop('date_added')
-        book.pop('embedding')
-        book_list.append(str(book))
-    
-    client = OpenAI()
-    res = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=book_list,
-        encoding_format="float"
-    )
-    
-    embeddings = [r.embedding for r in res.data]
-        
-    if 'embedding' not in headers:
-        c.execute('ALTER TABLE books ADD COLUMN embedding TEXT')
-    
-    for i, embedding in enumerate(embeddings):
-        c.execute('UPDATE books SET embedding = ? WHERE rowid = ?', 
-                 (str(embedding), books[i][0]))
-    
-    conn.commit()
+
+    with span('embed.load_books'):
+        c.execute(f'SELECT id, {", ".join(EMBED_FIELDS)} FROM books')
+        books = [dict(zip(['id'] + EMBED_FIELDS, row)) for row in c.fetchall()]
+
+    with span('embed.hash', books=len(books)):
+        stored = {} if force else get_content_hashes(conn, backend.model)
+        # keyed by (book id, content hash) so batches carry everything needed to store them
+        pending = []
+        for book in books:
+            text = book_text(book)
+            digest = content_hash(text)
+            if stored.get(book['id']) != digest:
+                pending.append(((book['id'], digest), text))
+
+    written = []
+    source_dtype = 'float32' if pca_dim else dtype
+
+    def store(keys, vectors):
+        with span('embed.store', books=len(keys)):
+            written.extend(book_id for book_id, _ in keys)
+            save_embeddings(conn, [book_id for book_id, _ in keys], vectors, backend.model, source_dtype,
+                            hashes=[digest for _, digest in keys])
+            conn.commit()
+
+    def on_batch(batch, vectors):
+        keys = [key for key, _ in batch]
+        store(keys, vectors)
+        if cache is not None:
+            cache.put_many(backend.model, [digest for _, digest in keys], vectors)
+
+    embedded = len(pending)
+    if cache is not None and pending and not force:
+        with span('embed.cache_lookup', books=len(pending)):
+            cached = cache.get_many(backend.model, {digest for (_, digest), _ in pending})
+        hits = [key for key, _ in pending if key[1] in cached]
+        if hits:
+            store(hits, [cached[digest] for _, digest in hits])
+        pending = [(key, text) for key, text in pending if key[1] not in cached]
+
+    failed = []
+    if pending:
+        batches = make_batches(pending, max_tokens=max_tokens, key=lambda item: item[1])
+        with span('embed.backend', backend=backend.name, books=len(pending), batches=len(batches)):
+            failed = backend.embed_batches(batches, on_batch)
+    failed = sum(len(batch) for batch in failed)
+
+    with span('embed.repack'):
+        repacked = repack_embeddings(conn, backend.model, source_dtype)
+        conn.commit()
+
+    with span('embed.remove_stale'):
+        removed = remove_stale_embeddings(conn, backend.model)
+        conn.commit()
+
+    model, explained = backend.model, None
+    if pca_dim:
+        with span('embed.reduce', dim=pca_dim):
+            model, written, repacked, explained = reduce_embeddings(conn, backend.model, pca_dim, dtype,
+                                                                    refit or force)
+    set_active_model(conn, backend.name, model)
+    dtypes = stored_dtypes(conn, model)
+
+    if update_index:
+        # re-packed vectors moved by their rounding, so the index takes them as changed
+        with span('embed.sync_index', books=len(written) + len(repacked)):
+            sync_index(conn, bookshelf_loc, model, written + repacked)
+
     conn.close()
+    return {'embedded': embedded - failed, 'skipped': len(books) - embedded, 'failed': failed,
+            'repacked': len(repacked), 'removed': removed, 'model': model, 'dtypes': dtypes, 'explained': explained}
@@ -0,0 +1,151 @@
+import csv
+import json
+import sys
+import numpy as np
+
+from utils.store import ensure_embeddings_table, unpack_vector
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+COLUMNS = ('id', 'title', 'author', 'isbn', 'publisher', 'publication_year', 'edition', 'format',
+           'language', 'page_count', 'description', 'read_status', 'date_added')
+
+INTEGER_COLUMNS = ('id', 'page_count')
+
+BATCH_SIZE = 1000
+
+
+def _where(since):
+    return ('WHERE b.date_added >= ?', [since]) if since else ('', [])
+
+
+def count_books(conn, since=None):
+    where, params = _where(since)
+    return conn.execute(f'SELECT COUNT(*) FROM books b {where}', params).fetchone()[0]
+
+
+def embedding_dim(conn, model):
+    """Dimension of the stored vectors for model, or None if there are none"""
+    ensure_embeddings_table(conn)
+    dims = [dim for (dim,) in conn.execute('SELECT DISTINCT dim FROM embeddings WHERE model = ?', (model,))]
+    if len(dims) > 1:
+        raise ValueError(f"Stored {model} embeddings have mixed dimensions {sorted(dims)}, re-run embed with --force")
+    return dims[0] if dims else None
+
+
+def iter_batches(conn, since=None, model=None, batch_size=BATCH_SIZE):
+    """Yield (rows, vectors) a batch at a time, rows as dicts in id order.
+
+    The cursor is read with fetchmany so only one batch is ever held in
+    memory. vectors is a float32 (len(rows), dim) array when model is given,
+    NaN for books without a stored vector, and None otherwise.
+    """
+    where, params = _where(since)
+    columns = ', '.join(f'b.{column}' for column in COLUMNS)
+    if model:
+        dim = embedding_dim(conn, model)
+        query = f'''
+            SELECT {columns}, e.dtype, e.vector
+            FROM books b LEFT JOIN embeddings e ON e.book_id = b.id AND e.model = ?
+            {where} ORDER BY b.id
+        '''
+        params = [model] + params
+    else:
+        query = f'SELECT {columns} FROM books b {where} ORDER BY b.id'
+
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        rows = [dict(zip(COLUMNS, row)) for row in batch]
+        vectors = None
+        if model:
+            vectors = np.full((len(batch), dim or 0), np.nan, dtype=np.float32)
+            for i, row in enumerate(batch):
+                if row[-1] is not None:
+                    vectors[i] = unpack_vector(row[-1], row[-2])
+        yield rows, vectors
+
+
+def export_books(conn, path, fmt='jsonl', since=None, model=None, batch_size=BATCH_SIZE):
+    """Stream the library to path ('-' for stdout), returning (books written, embeddings sidecar path).
+
+    With a model, parquet gets an embedding column of fixed-size float32
+    lists. jsonl and csv get a <path>.npy sidecar instead, with row i
+    holding the vector of the i-th exported book. It is written through a
+    memory map so the whole matrix is never in memory.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    batches = iter_batches(conn, since, model, batch_size)
+    if fmt == 'parquet':
+        return _write_parquet(batches, path, embedding_dim(conn, model) if model else None), None
+
+    sidecar = None
+    if model:
+        if path == '-':
+            raise ValueError("Embeddings are written next to the export file, give an output path")
+        sidecar = f'{path}.npy'
+        matrix = np.lib.format.open_memmap(sidecar, mode='w+', dtype=np.float32,
+                                           shape=(count_books(conn, since), embedding_dim(conn, model) or 0))
+
+    f = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+    written = 0
+    try:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS) if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+        for rows, vectors in batches:
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+            if model:
+                matrix[written:written + len(rows)] = vectors
+            written += len(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    if model:
+        matrix.flush()
+        del matrix
+    return written, sidecar
+
+
+def _write_parquet(batches, path, dim=None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow, pip install pyarrow") from None
+
+    fields = [pa.field(column, pa.int64() if column in INTEGER_COLUMNS else pa.string()) for column in COLUMNS]
+    if dim is not None:
+        fields.append(pa.field('embedding', pa.list_(pa.float32(), dim)))
+    schema = pa.schema(fields)
+
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows, vectors in batches:
+            arrays = [pa.array([_parquet_value(row[column], column) for row in rows], type=field.type)
+                      for column, field in zip(COLUMNS, schema)]
+            if dim is not None:
+                # one flat float32 buffer viewed as fixed-size lists, books without a vector are all NaN
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel(), type=pa.float32()), dim))
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            written += len(rows)
+    return written
+
+
+def _parquet_value(value, column):
+    """Coerce a SQLite value to the column type, page_count is sometimes stored as text"""
+    if value is None or value == '':
+        return None
+    if column in INTEGER_COLUMNS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
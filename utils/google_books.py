@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = 'https://www.googleapis.com/books/v1/volumes'
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'bookshelf', 'google_books.db')
+DEFAULT_TTL = 7 * 24 * 3600
+
+# (connect, read) seconds
+TIMEOUT = (3.05, 10)
+
+
+def default_cache_path():
+    return os.environ.get('BOOKSHELF_HTTP_CACHE', DEFAULT_CACHE_PATH)
+
+
+def parse_editions(items):
+    """Parse edition information from Google Books API response"""
+    editions = []
+    for item in items:
+        volume_info = item.get('volumeInfo', {})
+
+        # Get ISBN (prefer ISBN-13, fallback to ISBN-10)
+        isbn = ''
+        for identifier in volume_info.get('industryIdentifiers', []):
+            if identifier.get('type') == 'ISBN_13':
+                isbn = identifier.get('identifier')
+                break
+            elif identifier.get('type') == 'ISBN_10':
+                isbn = identifier.get('identifier')
+
+        # Skip if no ISBN (likely not a real edition)
+        if not isbn:
+            continue
+
+        # Extract format from physical attributes
+        format_ = 'Unknown'
+        if 'printType' in volume_info:
+            if volume_info['printType'] == 'BOOK':
+                if volume_info.get('isEbook', False):
+                    format_ = 'eBook'
+                else:
+                    format_ = guess_format(volume_info)
+
+        edition = {
+            'title': volume_info.get('title', 'Unknown').upper(),
+            'author': (volume_info.get('authors', ['Unknown'])[0]).upper(),
+            'isbn': isbn,
+            'publisher': volume_info.get('publisher', 'Unknown'),
+            'publication_year': volume_info.get('publishedDate', '')[:4],
+            'language': volume_info.get('language', 'unknown'),
+            'page_count': volume_info.get('pageCount', 0),
+            'format': format_,
+            'description': volume_info.get('description', ''),
+            'preview_link': volume_info.get('previewLink', ''),
+            'thumbnail': volume_info.get('imageLinks', {}).get('thumbnail', '')
+        }
+
+        editions.append(edition)
+
+    return editions
+
+
+def guess_format(volume_info):
+    """Guess book format based on available information"""
+    if 'dimensions' in volume_info:
+        dims = volume_info['dimensions']
+        # Common mass market paperback dimensions
+        if any('17.5' in str(dim) or '6.8' in str(dim) for dim in dims.values()):
+            return 'Mass Market Paperback'
+        # Common trade paperback dimensions
+        elif any('23' in str(dim) or '9' in str(dim) for dim in dims.values()):
+            return 'Trade Paperback'
+        # Common hardcover dimensions
+        elif any('24' in str(dim) or '9.5' in str(dim) for dim in dims.values()):
+            return 'Hardcover'
+    return 'Paperback'  # Default assumption
+
+
+class ResponseCache:
+    """SQLite store of JSON responses keyed by request, with a time to live.
+
+    Expired entries are kept, so they can still be served when the network
+    is unavailable or the client runs offline.
+    """
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # shared by the client's worker threads, writes are serialised by the lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            self.conn.commit()
+
+    def get(self, key, stale=False):
+        """Cached body for key, or None when missing or (unless stale) older than the TTL"""
+        with self.lock:
+            row = self.conn.execute('SELECT body, fetched_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or (not stale and time.time() - row[1] > self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, body):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, body, fetched_at) VALUES (?, ?, ?)',
+                              (key, json.dumps(body), time.time()))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class GoogleBooksClient:
+    """Google Books volumes API over one pooled session, with retries, timeouts and a response cache.
+
+    Set BOOKSHELF_GOOGLE_BOOKS_URL to point it at another server, and
+    offline=True (or BOOKSHELF_OFFLINE=1) to answer only from the cache.
+    """
+    def __init__(self, base_url=None, cache=None, ttl=DEFAULT_TTL, retries=3, timeout=TIMEOUT, offline=None,
+                 workers=4):
+        self.base_url = base_url or os.environ.get('BOOKSHELF_GOOGLE_BOOKS_URL', API_URL)
+        self.cache = cache if cache is not None else ResponseCache(ttl=ttl)
+        self.timeout = timeout
+        self.offline = os.environ.get('BOOKSHELF_OFFLINE') == '1' if offline is None else offline
+        self.workers = workers
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers, max_retries=retry))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=workers, max_retries=retry))
+
+    def volumes(self, query, max_results=40):
+        """Raw volume items for a search query, from the cache when fresh"""
+        params = {'q': query, 'maxResults': max_results}
+        key = f"{self.base_url}?{json.dumps(params, sort_keys=True)}"
+        cached = self.cache.get(key, stale=self.offline)
+        if cached is not None or self.offline:
+            return (cached or {}).get('items', [])
+
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            # fall back to an expired answer rather than nothing
+            stale = self.cache.get(key, stale=True)
+            if stale is None:
+                raise
+            return stale.get('items', [])
+
+        body = response.json()
+        self.cache.put(key, body)
+        return body.get('items', [])
+
+    def volumes_many(self, queries, max_results=40):
+        """volumes for several independent queries at once, in the order given"""
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(queries)) or 1) as pool:
+            return list(pool.map(lambda query: self.volumes(query, max_results), queries))
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.google_books import parse_editions
+
+# Goodreads "Exclusive Shelf" and common status spellings -> read_status
+SHELVES = {
+    'read': 'finished',
+    'finished': 'finished',
+    'currently-reading': 'in_progress',
+    'in_progress': 'in_progress',
+    'reading': 'in_progress',
+    'to-read': 'unread',
+    'unread': 'unread',
+}
+
+BATCH_SIZE = 200
+
+
+def normalize_isbn(text):
+    """Digits (and a final X) of an ISBN, dropping Goodreads' ="..." quoting, or '' if it isn't one"""
+    isbn = re.sub(r'[^0-9Xx]', '', text or '').upper()
+    return isbn if len(isbn) in (10, 13) else ''
+
+
+def isbn13(isbn):
+    """ISBN-13 form of an ISBN-10 or ISBN-13, so both spellings of an edition compare equal"""
+    isbn = normalize_isbn(isbn)
+    if len(isbn) != 10:
+        return isbn
+    core = '978' + isbn[:9]
+    check = (10 - sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(core)) % 10) % 10
+    return core + str(check)
+
+
+def read_entries(path):
+    """Rows to import from an ISBN-per-line file or a CSV (Goodreads-style) export.
+
+    Each entry is a dict with row (1-based line in the file), isbn, title,
+    author and read_status, any of which but row may be empty.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        text = f.read()
+    first = text.splitlines()[0] if text.strip() else ''
+    is_csv = ',' in first or any(name in first.lower() for name in ('isbn', 'title'))
+
+    entries = []
+    if not is_csv:
+        for row, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                isbn = normalize_isbn(line)
+                # anything that isn't an ISBN is looked up as a title
+                entries.append({'row': row, 'isbn': isbn, 'input': line.strip(),
+                                'title': '' if isbn else line.strip(), 'author': '', 'read_status': 'unread'})
+        return entries
+
+    # read from the whole text, Goodreads reviews can span several lines
+    reader = csv.DictReader(io.StringIO(text))
+    for record in reader:
+        row = reader.line_num
+        record = {(key or '').strip().lower(): (value or '').strip() for key, value in record.items()}
+        isbn = normalize_isbn(record.get('isbn13')) or normalize_isbn(record.get('isbn'))
+        shelf = record.get('exclusive shelf') or record.get('read_status') or record.get('status') or ''
+        entries.append({
+            'row': row,
+            'isbn': isbn,
+            'title': record.get('title', ''),
+            'author': record.get('author', ''),
+            'read_status': SHELVES.get(shelf.lower(), 'unread'),
+            'input': isbn or f"{record.get('title', '')} / {record.get('author', '')}",
+        })
+    return entries
+
+
+def resolve(client, entry):
+    """Google Books metadata for an entry, by ISBN and then by title and author"""
+    if entry['isbn']:
+        editions = parse_editions(client.volumes(f"isbn:{entry['isbn']}", max_results=10))
+        wanted = isbn13(entry['isbn'])
+        exact = [edition for edition in editions if isbn13(edition['isbn']) == wanted]
+        if exact or editions:
+            return (exact or editions)[0]
+    if entry['title']:
+        query = f"intitle:{entry['title']}" + (f" inauthor:{entry['author']}" if entry['author'] else '')
+        editions = parse_editions(client.volumes(query, max_results=5))
+        if editions:
+            return editions[0]
+    raise LookupError('no match on Google Books')
+
+
+def checkpoint_path(path):
+    return f'{path}.checkpoint'
+
+
+def failures_path(path):
+    return f'{path}.failed.csv'
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def import_books(conn, path, client, workers=8, batch_size=BATCH_SIZE, restart=False, on_progress=None):
+    """Resolve and insert every book listed in path, returning a report dict.
+
+    Entries are looked up batch_size at a time on a pool of workers and
+    each batch goes in with one executemany and one commit. After every
+    batch a checkpoint next to the file records how far the import got,
+    so an interrupted run picks up where it stopped. Books whose ISBN is
+    already in the library (or earlier in the file) are skipped, and rows
+    that could not be resolved are written to <file>.failed.csv.
+    """
+    entries = read_entries(path)
+    digest = _file_digest(path)
+    state = {'digest': digest, 'next': 0, 'added': 0, 'duplicates': 0, 'failed': []}
+    if not restart and os.path.exists(checkpoint_path(path)):
+        with open(checkpoint_path(path)) as f:
+            saved = json.load(f)
+        if saved.get('digest') == digest:
+            state = saved
+    resumed_from = state['next']
+    if on_progress:
+        on_progress(state['next'])
+
+    c = conn.cursor()
+    c.execute("SELECT isbn FROM books WHERE isbn IS NOT NULL AND isbn != ''")
+    seen = {isbn13(isbn) for (isbn,) in c.fetchall()}
+
+    def lookup(entry):
+        if entry['isbn'] and isbn13(entry['isbn']) in seen:
+            return entry, None, 'duplicate'
+        try:
+            return entry, resolve(client, entry), None
+        except Exception as e:
+            return entry, None, str(e) or type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(state['next'], len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            rows = []
+            for entry, book, error in pool.map(lookup, batch):
+                if error == 'duplicate' or (book and isbn13(book['isbn']) in seen):
+                    state['duplicates'] += 1
+                elif error:
+                    state['failed'].append([entry['row'], entry['input'], error])
+                else:
+                    seen.add(isbn13(book['isbn']))
+                    rows.append((
+                        book['title'], book['author'], book['isbn'], book.get('publisher', ''),
+                        book.get('publication_year', ''), book.get('edition', ''), book.get('format', ''),
+                        book.get('language', 'en'), book.get('page_count', 0), book.get('description') or 'NA',
+                        entry['read_status'],
+                    ))
+
+            c.executemany('''
+                INSERT INTO books (
+                    title, author, isbn, publisher, publication_year,
+                    edition, format, language, page_count, description, read_status
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+            state['added'] += len(rows)
+            state['next'] = start + len(batch)
+            with open(checkpoint_path(path), 'w') as f:
+                json.dump(state, f)
+            if on_progress:
+                on_progress(len(batch))
+
+    if state['failed']:
+        with open(failures_path(path), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'input', 'reason'])
+            writer.writerows(state['failed'])
+    elif os.path.exists(failures_path(path)):
+        os.remove(failures_path(path))
+    if os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+
+    return {
+        'total': len(entries),
+        'added': state['added'],
+        'duplicates': state['duplicates'],
+        'failed': state['failed'],
+        'resumed_from': resumed_from,
+        'failures_path': failures_path(path) if state['failed'] else None,
+    }
@@ -0,0 +1,124 @@
+import numpy as np
+
+from utils.distance import iter_distance_blocks
+from utils.store import get_content_hashes
+from utils.timing import span
+
+METHODS = ('pca', 'tsne', 'pca-tsne')
+
+# refit everyone instead of placing new books once this share of the library is new
+REFIT_FRACTION = 0.5
+
+
+def ensure_projection_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS projections (
+            book_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            method TEXT NOT NULL,
+            x REAL NOT NULL,
+            y REAL NOT NULL,
+            content_hash TEXT,
+            PRIMARY KEY (book_id, model, method)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS projection_bases (
+            model TEXT NOT NULL,
+            method TEXT NOT NULL,
+            mean BLOB NOT NULL,
+            components BLOB NOT NULL,
+            PRIMARY KEY (model, method)
+        )
+    ''')
+    conn.commit()
+
+
+def fit_projection(X, method='pca-tsne', seed=10):
+    """Project X to 2D, returning (coords, basis) where basis is the PCA (mean, components) for pca"""
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+
+    X = np.asarray(X, dtype=np.float32)
+    n = len(X)
+    if method == 'pca' or n < 5:
+        pca = PCA(n_components=min(2, n, X.shape[1]), random_state=seed).fit(X)
+        return _pad(pca.transform(X)), (pca.mean_, pca.components_)
+
+    if method == 'pca-tsne':
+        X = PCA(n_components=min(50, n, X.shape[1]), random_state=seed).fit_transform(X)
+    tsne = TSNE(n_components=2, perplexity=min(15, (n - 1) / 3), init='pca', learning_rate='auto',
+                max_iter=1000, random_state=seed)
+    return tsne.fit_transform(X), None
+
+
+def _pad(coords):
+    """Zero-fill a projection with fewer than two components (libraries of one or two books)"""
+    return np.pad(coords, ((0, 0), (0, 2 - coords.shape[1])))
+
+
+def place_new(X_known, coords_known, X_new, k=5):
+    """2D positions for new rows as the inverse-distance weighted mean of their k nearest known books"""
+    k = min(k, len(X_known))
+    coords = np.empty((len(X_new), 2))
+    for start, stop, block in iter_distance_blocks(X_new, X_known):
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        weights = 1 / (np.take_along_axis(block, nearest, axis=1) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        coords[start:stop] = np.einsum('ij,ijk->ik', weights, coords_known[nearest])
+    return coords
+
+
+def project_library(conn, model, book_ids, X, method='pca-tsne', refit=False):
+    """(coords, refitted) with 2D coordinates for every book in book_ids, reusing those stored for (model, method).
+
+    Stored coordinates are kept as long as the embedding they were computed
+    from is unchanged. Books without valid coordinates are placed next to
+    their nearest neighbours (or through the stored PCA basis for pca),
+    leaving everyone else where they were. The whole library is refitted
+    when there is nothing to build on or most books are new, and refitted
+    says whether it was: the layout then changed entirely.
+    """
+    ensure_projection_tables(conn)
+    X = np.asarray(X, dtype=np.float32)
+    hashes = get_content_hashes(conn, model)
+
+    c = conn.cursor()
+    c.execute('SELECT book_id, x, y, content_hash FROM projections WHERE model = ? AND method = ?', (model, method))
+    stored = {book_id: (x, y) for book_id, x, y, content_hash in c.fetchall()
+              if content_hash == hashes.get(book_id)}
+    c.execute('SELECT mean, components FROM projection_bases WHERE model = ? AND method = ?', (model, method))
+    basis = c.fetchone()
+
+    known = np.array([book_id in stored for book_id in book_ids], dtype=bool)
+    refit = refit or not known.any() or (~known).mean() > REFIT_FRACTION or (method == 'pca' and basis is None)
+    if refit:
+        with span('projection.fit', method=method, books=len(X)):
+            coords, basis = fit_projection(X, method)
+        c.execute('DELETE FROM projections WHERE model = ? AND method = ?', (model, method))
+        if basis is not None:
+            c.execute('''
+                INSERT OR REPLACE INTO projection_bases (model, method, mean, components)
+                VALUES (?, ?, ?, ?)
+            ''', (model, method, *[np.asarray(part, dtype=np.float32).tobytes() for part in basis]))
+        new = np.ones(len(book_ids), dtype=bool)
+    else:
+        coords = np.zeros((len(book_ids), 2))
+        coords[known] = [stored[book_id] for book_id, is_known in zip(book_ids, known) if is_known]
+        new = ~known
+        if new.any():
+            if method == 'pca':
+                mean = np.frombuffer(basis[0], dtype=np.float32)
+                components = np.frombuffer(basis[1], dtype=np.float32).reshape(-1, len(mean))
+                coords[new] = _pad((X[new] - mean) @ components.T)
+            else:
+                with span('projection.place_new', books=int(new.sum())):
+                    coords[new] = place_new(X[known], coords[known], X[new])
+
+    c.executemany('''
+        INSERT OR REPLACE INTO projections (book_id, model, method, x, y, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(book_id, model, method, float(x), float(y), hashes.get(book_id))
+          for book_id, (x, y), is_new in zip(book_ids, coords, new) if is_new])
+    conn.commit()
+    return coords, refit
@@ -0,0 +1,94 @@
+import numpy as np
+
+from utils.store import get_content_hashes, load_embeddings, remove_stale_embeddings, repack_embeddings, save_embeddings
+
+# refit the basis once the library has grown this much since it was fitted
+REFIT_GROWTH = 2.0
+
+
+def reduced_model(model, dim):
+    """Model name the PCA-reduced copies of model's vectors are stored under"""
+    return f'{model}+pca{dim}'
+
+
+def ensure_reductions_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reductions (
+            model TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            mean BLOB NOT NULL,
+            components BLOB NOT NULL,
+            explained REAL,
+            fitted_on INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def fit_pca(X, dim):
+    """(mean, components, explained variance ratio) of the top dim principal directions of X.
+
+    With fewer books than dim the missing components are zero, so the
+    reduced vectors always have dim entries and distances are unaffected.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    mean = X.mean(axis=0)
+    _, s, vt = np.linalg.svd(X - mean, full_matrices=False)
+    components = np.zeros((dim, X.shape[1]), dtype=np.float32)
+    kept = min(dim, len(vt))
+    components[:kept] = vt[:kept]
+    total = float((s ** 2).sum())
+    explained = float((s[:kept] ** 2).sum()) / total if total else 1.0
+    return mean, components, explained
+
+
+def load_basis(conn, model):
+    """(mean, components, explained, fitted_on) stored for a reduced model, or None"""
+    ensure_reductions_table(conn)
+    row = conn.execute('SELECT mean, components, explained, fitted_on FROM reductions WHERE model = ?',
+                       (model,)).fetchone()
+    if row is None:
+        return None
+    mean = np.frombuffer(row[0], dtype=np.float32)
+    return mean, np.frombuffer(row[1], dtype=np.float32).reshape(-1, len(mean)), row[2], row[3]
+
+
+def reduce_embeddings(conn, model, dim, dtype='float32', refit=False):
+    """Store PCA-reduced copies of model's vectors, returning (reduced model, ids written, ids re-packed, explained).
+
+    The basis is fitted on the whole library and stored, so later runs only
+    project new or changed books (found by content hash, like embed) and
+    the reduced space stays put. Unchanged copies stored in another dtype
+    are re-encoded as dtype. It is refitted when asked, when the
+    library has grown REFIT_GROWTH times since the fit, or when the source
+    dimension changed, in which case every book is rewritten.
+    """
+    target = reduced_model(model, dim)
+    book_ids, _, X = load_embeddings(conn, model)
+    if not book_ids:
+        return target, [], [], None
+    if dim >= X.shape[1]:
+        raise ValueError(f"PCA to {dim} dimensions does not reduce {X.shape[1]}-dimensional {model} vectors")
+
+    basis = load_basis(conn, target)
+    if refit or basis is None or basis[0].shape[0] != X.shape[1] or len(book_ids) > REFIT_GROWTH * basis[3]:
+        mean, components, explained = fit_pca(X, dim)
+        conn.execute('''
+            INSERT OR REPLACE INTO reductions (model, source, mean, components, explained, fitted_on)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (target, model, mean.tobytes(), components.tobytes(), explained, len(book_ids)))
+        stored = {}
+    else:
+        mean, components, explained, _ = basis
+        stored = get_content_hashes(conn, target)
+
+    hashes = get_content_hashes(conn, model)
+    rows = [i for i, book_id in enumerate(book_ids) if book_id not in stored or stored[book_id] != hashes.get(book_id)]
+    written = [book_ids[i] for i in rows]
+    if rows:
+        save_embeddings(conn, written, (X[rows] - mean) @ components.T, target, dtype,
+                        hashes=[hashes.get(book_id) for book_id in written])
+    repacked = repack_embeddings(conn, target, dtype)
+    remove_stale_embeddings(conn, target)
+    conn.commit()
+    return target, written, repacked, explained
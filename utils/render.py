@@ -0,0 +1,134 @@
+import html
+import numpy as np
+
+from utils.ann import assign, kmeans
+from utils.timing import span
+
+FORMATS = ('png', 'svg', 'html')
+
+# most titles drawn on a figure, the rest are only shown on hover (svg/html)
+MAX_LABELS = 40
+
+SVG_SIZE = (1100, 800)
+SVG_MARGIN = 40
+
+
+def label_subset(coords, max_labels=MAX_LABELS, seed=0):
+    """Indices of at most max_labels books to label, one per dense region.
+
+    The 2D points are clustered with k-means and the book nearest each
+    centroid stands in for its cluster, so labels spread over the whole
+    map instead of piling up where the shelf is crowded.
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    if len(coords) <= max_labels:
+        return np.arange(len(coords))
+    if max_labels == 0:
+        return np.zeros(0, dtype=np.int64)
+    centroids = kmeans(coords, max_labels, seed=seed)
+    labels = assign(coords, centroids)
+    picked = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        offsets = coords[members] - centroids[cluster]
+        picked.append(members[np.argmin(np.einsum('ij,ij->i', offsets, offsets))])
+    return np.sort(picked)
+
+
+def render_tour(coords, titles, permutation, path, fmt='png', dpi=200, max_labels=MAX_LABELS):
+    """Draw the tour over the 2D coordinates and save it to path in fmt"""
+    coords = np.asarray(coords, dtype=np.float64)
+    with span('render.label_subset'):
+        labelled = label_subset(coords, max_labels)
+    if fmt == 'png':
+        render_png(coords, titles, permutation, labelled, path, dpi)
+    elif fmt in ('svg', 'html'):
+        with span('render.svg'):
+            document = render_svg(coords, titles, permutation, labelled)
+            if fmt == 'html':
+                document = HTML_TEMPLATE.format(title=f'Bookshelf tour ({len(titles)} books)', svg=document)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(document)
+    else:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    return path
+
+
+def render_png(coords, titles, permutation, labelled, path, dpi=200):
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    with span('render.draw'):
+        fig, ax = plt.subplots(figsize=(11, 8))
+        # the whole tour as one polyline instead of a plot call per edge
+        ax.add_collection(LineCollection([coords[permutation]], colors='tab:red', linestyles='dashed',
+                                         linewidths=0.8, alpha=0.75))
+        ax.scatter(coords[:, 0], coords[:, 1], c='k', s=10, lw=0, alpha=0.5)
+        for i in labelled:
+            ax.annotate(titles[i], coords[i], xytext=(0, 4), textcoords='offset points',
+                        fontsize=6, ha='center')
+
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.autoscale_view()
+        fig.tight_layout()
+    with span('render.savefig', dpi=dpi):
+        fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+
+
+def _to_canvas(coords, size=SVG_SIZE, margin=SVG_MARGIN):
+    """Scale coords into an SVG canvas, keeping the aspect ratio and flipping y"""
+    lo, hi = coords.min(axis=0), coords.max(axis=0)
+    extent = np.where(hi - lo > 0, hi - lo, 1)
+    scale = min((size[0] - 2 * margin) / extent[0], (size[1] - 2 * margin) / extent[1])
+    canvas = (coords - lo) * scale + margin
+    canvas[:, 1] = size[1] - canvas[:, 1]
+    return canvas
+
+
+def render_svg(coords, titles, permutation, labelled):
+    """Standalone SVG of the tour, every point carries its title as a hover tooltip"""
+    width, height = SVG_SIZE
+    canvas = _to_canvas(coords)
+    points = ' '.join(f'{x:.1f},{y:.1f}' for x, y in canvas[permutation])
+    position = {book: step + 1 for step, book in enumerate(permutation)}
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}" font-family="sans-serif">',
+        f'<polyline points="{points}" fill="none" stroke="#d62728" stroke-width="1" '
+        'stroke-dasharray="4 3" stroke-opacity="0.75"/>',
+        '<g fill="#000" fill-opacity="0.5">',
+    ]
+    for i, (x, y) in enumerate(canvas):
+        title = html.escape(f'{position.get(i, "-")}. {titles[i]}')
+        parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3"><title>{title}</title></circle>')
+    parts.append('</g>')
+    parts.append('<g font-size="9" text-anchor="middle" pointer-events="none">')
+    for i in labelled:
+        x, y = canvas[i]
+        parts.append(f'<text x="{x:.1f}" y="{y - 5:.1f}">{html.escape(titles[i])}</text>')
+    parts.append('</g>')
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ margin: 0; display: flex; justify-content: center; }}
+svg {{ max-width: 100%; height: auto; }}
+circle:hover {{ fill: #d62728; fill-opacity: 1; r: 5; }}
+</style>
+</head>
+<body>
+{svg}
+</body>
+</html>
+'''
@@ -0,0 +1,137 @@
+import sqlite3
+
+# applied to every connection opened through connect
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 5000',
+)
+
+STATUS_RANK = 'CASE {column} WHEN \'finished\' THEN 1 WHEN \'in_progress\' THEN 2 ELSE 3 END'
+
+# migration n brings the database to PRAGMA user_version n, never edit one that has shipped
+MIGRATIONS = [
+    # 1: the original books table
+    '''
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        author TEXT,
+        isbn TEXT,
+        publisher TEXT,
+        publication_year TEXT,
+        edition TEXT,
+        format TEXT,
+        language TEXT,
+        page_count INTEGER,
+        description TEXT,
+        read_status TEXT DEFAULT 'unread',
+        date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 2: stored status rank kept up to date by triggers, so the status sort can use an index
+    f'''
+    ALTER TABLE books ADD COLUMN status_rank INTEGER NOT NULL DEFAULT 3;
+    UPDATE books SET status_rank = {STATUS_RANK.format(column='read_status')};
+    CREATE TRIGGER books_status_rank_insert AFTER INSERT ON books
+    BEGIN
+        UPDATE books SET status_rank = {STATUS_RANK.format(column='NEW.read_status')} WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER books_status_rank_update AFTER UPDATE OF read_status ON books
+    BEGIN
+        UPDATE books SET status_rank = {STATUS_RANK.format(column='NEW.read_status')} WHERE id = NEW.id;
+    END;
+    ''',
+    # 3: indexes for the list, status sort and ISBN lookups
+    '''
+    CREATE INDEX IF NOT EXISTS books_title ON books (title, id);
+    CREATE INDEX IF NOT EXISTS books_status_rank_title ON books (status_rank, title, id);
+    CREATE INDEX IF NOT EXISTS books_read_status_title ON books (read_status, title);
+    CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+    ''',
+    # 4: full-text index over the searchable fields, an external content table kept in sync by triggers
+    '''
+    CREATE VIRTUAL TABLE books_fts USING fts5(
+        title, author, publisher, description,
+        content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+    CREATE TRIGGER books_fts_insert AFTER INSERT ON books
+    BEGIN
+        INSERT INTO books_fts (rowid, title, author, publisher, description)
+        VALUES (NEW.id, NEW.title, NEW.author, NEW.publisher, NEW.description);
+    END;
+    CREATE TRIGGER books_fts_delete AFTER DELETE ON books
+    BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, publisher, description)
+        VALUES ('delete', OLD.id, OLD.title, OLD.author, OLD.publisher, OLD.description);
+    END;
+    CREATE TRIGGER books_fts_update AFTER UPDATE OF title, author, publisher, description ON books
+    BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, publisher, description)
+        VALUES ('delete', OLD.id, OLD.title, OLD.author, OLD.publisher, OLD.description);
+        INSERT INTO books_fts (rowid, title, author, publisher, description)
+        VALUES (NEW.id, NEW.title, NEW.author, NEW.publisher, NEW.description);
+    END;
+    ''',
+    # 5: a counter bumped on every change to books, so books serve can tell when to reload
+    '''
+    CREATE TABLE library_changes (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT INTO library_changes (id, version) VALUES (1, 0);
+    CREATE TRIGGER books_changes_insert AFTER INSERT ON books
+    BEGIN
+        UPDATE library_changes SET version = version + 1;
+    END;
+    CREATE TRIGGER books_changes_update AFTER UPDATE ON books
+    BEGIN
+        UPDATE library_changes SET version = version + 1;
+    END;
+    CREATE TRIGGER books_changes_delete AFTER DELETE ON books
+    BEGIN
+        UPDATE library_changes SET version = version + 1;
+    END;
+    ''',
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query, every word must match and the last one may be a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words[:-1]) + (' ' if len(words) > 1 else '') + f'"{words[-1]}"*'
+
+
+def migrate(conn):
+    """Apply the migrations newer than the database's user_version, returning the versions applied"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this bookshelf ({SCHEMA_VERSION}), please upgrade")
+
+    applied = []
+    for number, script in enumerate(MIGRATIONS[version:], version + 1):
+        # executescript commits first, the explicit transaction makes each migration all or nothing
+        try:
+            conn.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;')
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(number)
+    return applied
+
+
+def connect(path='bookshelf.db'):
+    """Open the library database with the tuned PRAGMAs and an up to date schema"""
+    conn = sqlite3.connect(path)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    return conn
@@ -0,0 +1,300 @@
+"""Local HTTP API that keeps one library hot in memory (books serve).
+
+The book list, the vectors of each backend's active model and their ANN
+indexes are loaded once and shared by every request. A background task
+polls the database and reloads them when another process changes books
+or embeddings. Tours are CPU-bound, so they run in a process pool and the
+event loop keeps answering other requests meanwhile.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from utils.ann import IVFIndex, similar_books
+from utils.backends import BACKENDS, get_backend
+from utils.client import DEFAULT_HOST, DEFAULT_PORT
+from utils.projection import METHODS as PROJECTIONS
+from utils.quantize import as_float32
+from utils.render import FORMATS, MAX_LABELS
+from utils.schema import connect
+from utils.store import active_model, ensure_active_models_table, ensure_embeddings_table, load_embeddings
+from utils.tsp import SOLVERS, fullspace_tsp, visual_tsp
+
+BOOK_COLUMNS = ('id', 'title', 'author', 'isbn', 'publisher', 'publication_year', 'edition', 'format',
+                'language', 'page_count', 'description', 'read_status')
+
+# seconds between checks for changes made by other processes
+POLL_INTERVAL = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class Library:
+    """In-memory state of one bookshelf.db, rebuilt whenever its fingerprint changes.
+
+    PRAGMA data_version tells cheaply that another connection committed.
+    Only then is the fingerprint read: the library_changes and
+    embedding_changes counters, bumped by triggers on books and embeddings
+    (inserts, updates such as a re-pack to another dtype, and deletes), and
+    the active models. Tours saved by the server itself change none of
+    them, so they do not cause a reload.
+    """
+    def __init__(self, path, manager_factory):
+        self.path = os.path.abspath(path)
+        self.manager_factory = manager_factory
+        # migrations and tables first, so the triggers and everything the fingerprint reads exist
+        conn = connect(self.path)
+        ensure_embeddings_table(conn)
+        ensure_active_models_table(conn)
+        conn.commit()
+        conn.close()
+        self.watch = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.data_version = None
+        self.fingerprint = None
+        self.generation = 0
+        self.loaded_at = None
+        self.clear()
+        self.refresh()
+
+    def clear(self):
+        self.books = {}
+        self.embeddings = {}
+        self.indexes = {}
+
+    def manager(self):
+        """This thread's BookManager, for queries that are not cached (search, lookups)"""
+        if not hasattr(self.local, 'manager'):
+            self.local.manager = self.manager_factory(self.path)
+        return self.local.manager
+
+    def read_fingerprint(self):
+        version = self.watch.execute('SELECT version FROM library_changes').fetchone()[0]
+        embeddings = self.watch.execute('SELECT version FROM embedding_changes').fetchone()[0]
+        models = self.watch.execute('SELECT backend, model FROM active_models ORDER BY backend').fetchall()
+        return version, embeddings, tuple(models)
+
+    def refresh(self):
+        """Drop the cached state if the database changed since it was loaded, returning whether it did"""
+        with self.lock:
+            data_version = self.watch.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self.data_version:
+                return False
+            # read before recording data_version, so a failed read is retried on the next call
+            fingerprint = self.read_fingerprint()
+            self.data_version = data_version
+            if fingerprint == self.fingerprint:
+                return False
+            self.fingerprint = fingerprint
+            self.generation += 1
+            self.loaded_at = time.time()
+            self.clear()
+            return True
+
+    def model(self, backend):
+        with self.lock:
+            return active_model(self.watch, backend, get_backend(backend).model)
+
+    def get_books(self, sort_status=False):
+        with self.lock:
+            if sort_status not in self.books:
+                order = 'status_rank, ' if sort_status else ''
+                rows = self.watch.execute(f'SELECT {", ".join(BOOK_COLUMNS)} FROM books ORDER BY {order}title')
+                self.books[sort_status] = [dict(zip(BOOK_COLUMNS, row)) for row in rows]
+            return self.books[sort_status]
+
+    def get_embeddings(self, model):
+        """(book_ids, titles, vectors) of model, int8 vectors kept compact"""
+        with self.lock:
+            if model not in self.embeddings:
+                self.embeddings[model] = load_embeddings(self.watch, model, compact=True)
+            return self.embeddings[model]
+
+    def get_index(self, model):
+        """IVF index over model's vectors, built in memory from the loaded matrix"""
+        with self.lock:
+            if model not in self.indexes:
+                book_ids, _, X = self.get_embeddings(model)
+                self.indexes[model] = IVFIndex.build(np.asarray(book_ids, dtype=np.int64),
+                                                     as_float32(X)) if book_ids else None
+            return self.indexes[model]
+
+    def warm(self):
+        """Load the book list and the active vectors and index of every backend with embeddings"""
+        self.get_books()
+        for backend in BACKENDS:
+            model = self.model(backend)
+            if self.get_embeddings(model)[0]:
+                self.get_index(model)
+
+
+# per worker process (book_ids, titles, vectors) of the last model used, keyed by (path, model, generation)
+_worker_cache = {}
+
+
+def _run_tour(path, model, generation, visual, options):
+    key = (path, model, generation)
+    if key not in _worker_cache:
+        conn = sqlite3.connect(path)
+        loaded = load_embeddings(conn, model, compact=True)
+        conn.close()
+        _worker_cache.clear()
+        _worker_cache[key] = loaded
+    loaded = _worker_cache[key]
+    if visual:
+        tour, image = visual_tsp(path, model, loaded=loaded, **options)
+    else:
+        tour, image = fullspace_tsp(path, model, loaded=loaded, **options)
+    return tour, os.path.abspath(image)
+
+
+class TourRequest(BaseModel):
+    backend: str = 'openai'
+    visual: bool = False
+    solver: str = 'auto'
+    time_limit: float = 60
+    full: bool = False
+    workers: int = 1
+    seed: int = 0
+    sparse: bool = False
+    neighbours: int = 10
+    projection: str = 'pca-tsne'
+    refit: bool = False
+    fmt: str = 'png'
+    dpi: int = 200
+    max_labels: int = MAX_LABELS
+
+
+def create_app(manager_factory, bookshelf_loc='bookshelf.db', workers=2, poll_interval=POLL_INTERVAL):
+    """The API for one library, manager_factory(path) opens a BookManager on it"""
+    library = Library(bookshelf_loc, manager_factory)
+    state = {}
+
+    async def poll():
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                if await asyncio.to_thread(library.refresh):
+                    await asyncio.to_thread(library.warm)
+            except Exception:
+                # a failed refresh is retried on the next tick, a failed warm loads lazily on first use
+                logger.exception('Reloading %s failed', library.path)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        try:
+            await asyncio.to_thread(library.warm)
+        except Exception:
+            logger.exception('Loading %s failed, it will be loaded on first use', library.path)
+        # spawn, forking a process that runs the event loop's threads is not safe
+        state['pool'] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        state['poller'] = asyncio.create_task(poll())
+        yield
+        state['poller'].cancel()
+        state['pool'].shutdown(cancel_futures=True)
+
+    app = FastAPI(title='bookshelf', lifespan=lifespan)
+
+    def check_backend(backend):
+        if backend not in BACKENDS:
+            raise HTTPException(400, f"Unknown embedding backend '{backend}', expected one of {list(BACKENDS)}")
+
+    @app.get('/health')
+    async def health():
+        return {
+            'status': 'ok',
+            'db': library.path,
+            'generation': library.generation,
+            'loaded_at': library.loaded_at,
+            'books': len(library.books[False]) if False in library.books else None,
+            'models': sorted(library.embeddings),
+        }
+
+    @app.get('/books')
+    async def books(sort_status: bool = False, offset: int = 0, limit: int = 100):
+        rows = await asyncio.to_thread(library.get_books, sort_status)
+        return {'total': len(rows), 'books': rows[offset:offset + limit]}
+
+    @app.get('/search')
+    async def search(q: str, limit: int = 20, open: str = '[', close: str = ']'):
+        rows = await asyncio.to_thread(lambda: library.manager().search_books(q, limit, (open, close)))
+        return [dict(zip(('id', 'title', 'author', 'read_status', 'snippet'), row)) for row in rows]
+
+    @app.get('/similar')
+    async def similar(book: str, k: int = 10, backend: str = 'openai', probes: int = 4,
+                      exact: bool = False, recall: bool = False):
+        check_backend(backend)
+
+        def run():
+            manager = library.manager()
+            matches = manager.find_books(book)
+            if not matches:
+                raise HTTPException(404, "No book matches that id or title")
+            book_id, title, author = matches[0]
+            model = library.model(backend)
+            index = library.get_index(model)
+            if index is None or book_id not in index.ids:
+                raise HTTPException(404, f"No {model} embedding for this book, run embed first")
+
+            start = time.perf_counter()
+            results = similar_books(index, book_id, k, probes, exact)
+            elapsed = time.perf_counter() - start
+            rows = manager.get_books_by_ids([result_id for result_id, _ in results])
+            names = {result_id: row[1:3] for result_id, row in rows.items()}
+            response = {
+                'book': {'id': book_id, 'title': title, 'author': author},
+                'matches': len(matches),
+                'model': model,
+                'seconds': elapsed,
+                'results': [{'id': result_id, 'title': names[result_id][0], 'author': names[result_id][1],
+                             'distance': float(distance)} for result_id, distance in results],
+            }
+            if recall and not exact:
+                start = time.perf_counter()
+                truth = similar_books(index, book_id, k, exact=True)
+                response['exact_seconds'] = time.perf_counter() - start
+                found = len({i for i, _ in results} & {i for i, _ in truth})
+                response['recall'] = found / max(len(truth), 1)
+            return response
+        return await asyncio.to_thread(run)
+
+    @app.post('/tour')
+    async def tour(request: TourRequest):
+        check_backend(request.backend)
+        if request.solver not in SOLVERS or request.projection not in PROJECTIONS or request.fmt not in FORMATS:
+            raise HTTPException(400, "Unknown solver, projection or format")
+        if request.workers > 1 and request.solver == 'anneal':
+            raise HTTPException(400, "The anneal solver cannot be seeded, use it with a single worker")
+        await asyncio.to_thread(library.refresh)
+        model = library.model(request.backend)
+        options = request.model_dump(exclude={'backend', 'visual'})
+        if not request.visual:
+            for key in ('projection', 'refit', 'fmt', 'dpi', 'max_labels'):
+                options.pop(key)
+        loop = asyncio.get_running_loop()
+        try:
+            tour, path = await loop.run_in_executor(state['pool'], _run_tour, library.path, model,
+                                                    library.generation, request.visual, options)
+        except ValueError as e:
+            raise HTTPException(404, str(e))
+        return {'model': model, 'visual': request.visual, 'path': path, 'tour': tour}
+
+    return app
+
+
+def serve(manager_factory, bookshelf_loc='bookshelf.db', host=DEFAULT_HOST, port=DEFAULT_PORT, workers=2,
+          poll_interval=POLL_INTERVAL):
+    import uvicorn
+    uvicorn.run(create_app(manager_factory, bookshelf_loc, workers, poll_interval), host=host, port=port,
+                log_level='info')
@@ -0,0 +1,219 @@
+import time
+from collections import deque
+import numpy as np
+
+from utils.distance import iter_distance_blocks
+from utils.store import load_tour, save_tour
+from utils.timing import span
+
+# unvisited books sampled when a walk runs out of unvisited neighbours
+FALLBACK_SAMPLE = 2048
+
+
+def knn_graph(X, k=10, block_size=256):
+    """The k nearest other rows of X for every row, as (neighbours, distances) of shape (n, k).
+
+    Distances are computed a block of rows at a time and only the k smallest
+    per row are kept, so memory grows with n * k rather than n ** 2.
+    """
+    n = len(X)
+    k = min(k, n - 1)
+    neighbours = np.empty((n, k), dtype=np.int64)
+    distances = np.empty((n, k), dtype=np.float32)
+    for start, stop, block in iter_distance_blocks(X, block_size=block_size):
+        block[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        neighbours[start:stop], distances[start:stop] = _smallest(block, k)
+    return neighbours, distances
+
+
+def _smallest(block, k):
+    """Column indices and values of the k smallest entries of each row, in ascending order"""
+    nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+    nearest_d = np.take_along_axis(block, nearest, axis=1)
+    order = np.argsort(nearest_d, axis=1)
+    return np.take_along_axis(nearest, order, axis=1), np.take_along_axis(nearest_d, order, axis=1)
+
+
+class LazyNeighbours:
+    """Candidate lists computed the first time each book is looked up.
+
+    A warm-started update only searches around a handful of books, so it
+    needs their neighbours and not the whole graph.
+    """
+    def __init__(self, X, k=10):
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.k = min(k, len(X) - 1)
+        self.rows = {}
+
+    def __getitem__(self, a):
+        if a not in self.rows:
+            _, _, block = next(iter_distance_blocks(self.X[a:a + 1], self.X))
+            block[0, a] = np.inf
+            self.rows[a] = _smallest(block, self.k)[0][0]
+        return self.rows[a]
+
+
+def path_distances(X, a, b):
+    """Distances between rows a[i] and b[i], 0 where b[i] is -1 meaning the end of the path"""
+    a, b = np.atleast_1d(a), np.atleast_1d(b)
+    out = np.linalg.norm(X[a] - X[np.maximum(b, 0)], axis=1)
+    out[b < 0] = 0
+    return out
+
+
+class SparseTour:
+    """Open path over the rows of X starting at permutation[0], searched on a kNN graph.
+
+    Only the candidate graph is precomputed, any other distance is
+    computed from the vectors when it is needed.
+    """
+    def __init__(self, X, neighbours, permutation):
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.neighbours = neighbours
+        self.p = np.asarray(permutation, dtype=np.int64)
+        self.pos = np.empty(len(self.p), dtype=np.int64)
+        self.pos[self.p] = np.arange(len(self.p))
+
+    def length(self):
+        return float(path_distances(self.X, self.p[:-1], self.p[1:]).sum()) if len(self.p) > 1 else 0.0
+
+    def _reverse(self, i, j):
+        self.p[i:j + 1] = self.p[i:j + 1][::-1]
+        self.pos[self.p[i:j + 1]] = np.arange(i, j + 1)
+
+    def _try_node(self, a):
+        """Apply the best 2-opt move that adds an edge from a to one of its neighbours.
+
+        Returns the books whose tour edges changed, or [] if no move helps.
+        """
+        X, p, n = self.X, self.p, len(self.p)
+        cs = self.neighbours[a]
+        i, js = self.pos[a], self.pos[cs]
+        lo, hi = np.minimum(i, js), np.maximum(i, js)
+        x, y = p[lo], p[hi]
+        d_ac = path_distances(X, np.full(len(cs), a), cs)
+
+        # successor move: (x, x+) and (y, y+) become (x, y) and (x+, y+), reversing x+ .. y
+        sx = p[np.minimum(lo + 1, n - 1)]
+        sy = np.where(hi + 1 < n, p[np.minimum(hi + 1, n - 1)], -1)
+        gain_succ = path_distances(X, x, sx) + path_distances(X, y, sy) - d_ac - path_distances(X, sx, sy)
+        gain_succ[hi <= lo + 1] = -np.inf
+
+        # predecessor move: (x-, x) and (y-, y) become (x, y) and (x-, y-), reversing x .. y-
+        # the start of the path (position 0) is never moved
+        px, py = p[np.maximum(lo - 1, 0)], p[hi - 1]
+        gain_pred = path_distances(X, px, x) + path_distances(X, py, y) - d_ac - path_distances(X, px, py)
+        gain_pred[(lo == 0) | (hi <= lo + 1)] = -np.inf
+
+        best_succ, best_pred = np.argmax(gain_succ), np.argmax(gain_pred)
+        if max(gain_succ[best_succ], gain_pred[best_pred]) <= 1e-6:
+            return []
+        if gain_succ[best_succ] >= gain_pred[best_pred]:
+            touched = [x[best_succ], sx[best_succ], y[best_succ], sy[best_succ]]
+            self._reverse(lo[best_succ] + 1, hi[best_succ])
+        else:
+            touched = [x[best_pred], px[best_pred], y[best_pred], py[best_pred]]
+            self._reverse(lo[best_pred], hi[best_pred] - 1)
+        return [int(b) for b in touched if b >= 0]
+
+    def improve(self, nodes=None, deadline=None):
+        """2-opt with neighbour lists and don't-look bits, starting from nodes (default all)"""
+        queue = deque(self.p if nodes is None else nodes)
+        queued = np.zeros(len(self.p), dtype=bool)
+        queued[list(queue)] = True
+        while queue:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            a = queue.popleft()
+            queued[a] = False
+            for b in self._try_node(a):
+                if not queued[b]:
+                    queued[b] = True
+                    queue.append(b)
+        return self
+
+
+def nearest_neighbour_walk(X, neighbours, start=0, seed=0):
+    """Greedy walk over the candidate graph, sampling unvisited books when no neighbour is free"""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n = len(X)
+    rng = np.random.default_rng(seed)
+    visited = np.zeros(n, dtype=bool)
+    # unvisited books in a swap-remove list, so removal is O(1)
+    remaining = np.arange(n)
+    where = np.arange(n)
+    size = n
+
+    def visit(x):
+        nonlocal size
+        visited[x] = True
+        i, last = where[x], remaining[size - 1]
+        remaining[i], where[last] = last, i
+        size -= 1
+
+    permutation = np.empty(n, dtype=np.int64)
+    permutation[0] = start
+    visit(start)
+    for t in range(1, n):
+        current = permutation[t - 1]
+        free = neighbours[current][~visited[neighbours[current]]]
+        if len(free):
+            nxt = free[0]
+        else:
+            pool = remaining[:size]
+            if size > FALLBACK_SAMPLE:
+                pool = pool[rng.choice(size, FALLBACK_SAMPLE, replace=False)]
+            nxt = pool[np.argmin(np.linalg.norm(X[pool] - X[current], axis=1))]
+        permutation[t] = nxt
+        visit(nxt)
+    return permutation
+
+
+def solve_sparse(X, k=10, time_limit=60, seed=0, neighbours=None):
+    """Path over the rows of X starting at row 0, returning (permutation, length)"""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if len(X) <= 2:
+        permutation = list(range(len(X)))
+        return permutation, SparseTour(X, np.zeros((len(X), 0), np.int64), permutation).length()
+    deadline = time.monotonic() + time_limit if time_limit else None
+    if neighbours is None:
+        with span('tsp.knn_graph', books=len(X), k=k):
+            neighbours, _ = knn_graph(X, k)
+    with span('tsp.nearest_neighbour_walk'):
+        tour = SparseTour(X, neighbours, nearest_neighbour_walk(X, neighbours, seed=seed))
+    with span('tsp.improve'):
+        tour.improve(deadline=deadline)
+    return [int(i) for i in tour.p], tour.length()
+
+
+def plan_sparse_tour(conn, model, space, book_ids, X, k=10, time_limit=60, full=False, seed=0):
+    """Sparse counterpart of plan_tour: warm start from the saved tour or solve from scratch.
+
+    New books are placed by cheapest insertion with distances computed on
+    demand, then only the moves around them are searched.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    index = {book_id: i for i, book_id in enumerate(book_ids)}
+    previous = [] if full else [index[book_id] for book_id in load_tour(conn, model, space) if book_id in index]
+
+    if previous:
+        deadline = time.monotonic() + time_limit if time_limit else None
+        kept = set(previous)
+        new = [i for i in range(len(book_ids)) if i not in kept]
+        permutation = list(previous)
+        with span('tsp.insert_new', books=len(new)):
+            for x in new:
+                p = np.asarray(permutation)
+                q = np.append(p[1:], -1)
+                to_x = np.full(len(p), x)
+                cost = path_distances(X, to_x, p) + path_distances(X, to_x, q) - path_distances(X, p, q)
+                permutation.insert(int(np.argmin(cost)) + 1, x)
+        with span('tsp.polish'):
+            tour = SparseTour(X, LazyNeighbours(X, k), permutation).improve(new, deadline)
+        permutation, distance = [int(i) for i in tour.p], tour.length()
+    else:
+        permutation, distance = solve_sparse(X, k, time_limit, seed)
+
+    with span('tsp.save_tour'):
+        save_tour(conn, model, space, [book_ids[i] for i in permutation], distance)
+    return permutation, distance
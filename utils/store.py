@@ -0,0 +1,233 @@
+import ast
+import sqlite3
+import numpy as np
+
+from utils.quantize import QuantizedVectors, unpack_int8
+
+# int8 vectors are stored with a per-vector scale, see utils.quantize
+DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+# model used for embeddings written before the model was recorded
+LEGACY_MODEL = 'text-embedding-3-large'
+
+
+def pack_vector(vector, dtype='float32'):
+    if dtype == 'int8':
+        return QuantizedVectors.quantize(vector).pack(0)
+    return np.asarray(vector, dtype=DTYPES[dtype]).tobytes()
+
+
+def unpack_vector(blob, dtype):
+    """float32 vector of a stored blob"""
+    if dtype == 'int8':
+        return unpack_int8(blob)
+    return np.frombuffer(blob, dtype=DTYPES[dtype]).astype(np.float32)
+
+
+def ensure_embeddings_table(conn):
+    """Create the embeddings table and migrate any legacy TEXT embeddings into it"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+            book_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            dtype TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            content_hash TEXT,
+            PRIMARY KEY (book_id, model)
+        )
+    ''')
+
+    c.execute('PRAGMA table_info(embeddings)')
+    if 'content_hash' not in [header[1] for header in c.fetchall()]:
+        c.execute('ALTER TABLE embeddings ADD COLUMN content_hash TEXT')
+
+    # bumped on every row written, so books serve can tell when vectors change (re-packs update in place)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    c.execute('INSERT OR IGNORE INTO embedding_changes (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS embeddings_changes_{event.lower()} AFTER {event} ON embeddings
+            BEGIN
+                UPDATE embedding_changes SET version = version + 1;
+            END
+        ''')
+
+    c.execute('PRAGMA table_info(books)')
+    if 'embedding' in [header[1] for header in c.fetchall()]:
+        migrate_text_embeddings(conn)
+    conn.commit()
+
+
+def migrate_text_embeddings(conn):
+    """One-time move of str(list) embeddings in books.embedding to float32 blobs"""
+    c = conn.cursor()
+    c.execute('SELECT id, embedding FROM books WHERE embedding IS NOT NULL')
+    rows = []
+    for book_id, text in c.fetchall():
+        vector = np.asarray(ast.literal_eval(text), dtype=np.float32)
+        rows.append((book_id, LEGACY_MODEL, len(vector), 'float32', vector.tobytes()))
+
+    c.executemany('''
+        INSERT OR REPLACE INTO embeddings (book_id, model, dim, dtype, vector)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+
+    try:
+        c.execute('ALTER TABLE books DROP COLUMN embedding')
+    except sqlite3.OperationalError:
+        # DROP COLUMN needs SQLite 3.35+, blank the column instead
+        c.execute('UPDATE books SET embedding = NULL')
+    conn.commit()
+
+
+def save_embeddings(conn, book_ids, vectors, model, dtype='float32', hashes=None):
+    hashes = hashes or [None] * len(book_ids)
+    c = conn.cursor()
+    c.executemany('''
+        INSERT OR REPLACE INTO embeddings (book_id, model, dim, dtype, vector, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(book_id, model, len(vector), dtype, pack_vector(vector, dtype), content_hash)
+          for book_id, vector, content_hash in zip(book_ids, vectors, hashes)])
+
+
+def repack_embeddings(conn, model, dtype):
+    """Re-encode model's vectors stored in another dtype as dtype, returning the book ids changed.
+
+    Only the stored precision changes, the vectors are not recomputed, so
+    going back up from int8 or float16 keeps their rounding (embed --force
+    recomputes them).
+    """
+    c = conn.cursor()
+    c.execute('SELECT book_id, dtype, vector FROM embeddings WHERE model = ? AND dtype != ?', (model, dtype))
+    rows = [(dtype, pack_vector(unpack_vector(blob, stored), dtype), model, book_id)
+            for book_id, stored, blob in c.fetchall()]
+    c.executemany('UPDATE embeddings SET dtype = ?, vector = ? WHERE model = ? AND book_id = ?', rows)
+    return [book_id for *_, book_id in rows]
+
+
+def stored_dtypes(conn, model):
+    """Sorted dtypes model's vectors are stored in"""
+    c = conn.cursor()
+    c.execute('SELECT DISTINCT dtype FROM embeddings WHERE model = ? ORDER BY dtype', (model,))
+    return [row[0] for row in c.fetchall()]
+
+
+def get_content_hashes(conn, model):
+    """Map book_id -> content hash of the text its stored vector was computed from"""
+    c = conn.cursor()
+    c.execute('SELECT book_id, content_hash FROM embeddings WHERE model = ?', (model,))
+    return dict(c.fetchall())
+
+
+def remove_stale_embeddings(conn, model):
+    """Delete vectors whose book no longer exists, returning how many were removed"""
+    c = conn.cursor()
+    c.execute('''
+        DELETE FROM embeddings
+        WHERE model = ? AND book_id NOT IN (SELECT id FROM books)
+    ''', (model,))
+    return c.rowcount
+
+
+def load_embeddings(conn, model, compact=False):
+    """Return (book_ids, titles, matrix) for every book with a stored vector for model.
+
+    All blobs are joined into a single buffer and viewed as one contiguous
+    (n, dim) array with np.frombuffer, so no per-row parsing takes place.
+    int8 vectors are dequantized to float32 unless compact is set, in which
+    case they come back as QuantizedVectors (for utils.distance).
+    """
+    ensure_embeddings_table(conn)
+    c = conn.cursor()
+    c.execute('''
+        SELECT b.id, b.title, e.dim, e.dtype, e.vector
+        FROM embeddings e JOIN books b ON b.id = e.book_id
+        WHERE e.model = ?
+        ORDER BY b.id
+    ''', (model,))
+    rows = c.fetchall()
+    if not rows:
+        return [], [], np.zeros((0, 0), dtype=np.float32)
+
+    book_ids = [row[0] for row in rows]
+    titles = [row[1] for row in rows]
+    dims = {row[2] for row in rows}
+    dtypes = {row[3] for row in rows}
+    if len(dims) > 1:
+        raise ValueError(f"Stored {model} embeddings have mixed dimensions {sorted(dims)}, re-run embed with --force")
+
+    dim = dims.pop()
+    if dtypes == {'int8'}:
+        matrix = QuantizedVectors.from_blobs([row[4] for row in rows], dim)
+        if not compact:
+            matrix = matrix.dequantize()
+    elif len(dtypes) == 1:
+        buffer = b''.join(row[4] for row in rows)
+        matrix = np.frombuffer(buffer, dtype=DTYPES[dtypes.pop()]).reshape(len(rows), dim)
+    else:
+        matrix = np.empty((len(rows), dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = unpack_vector(row[4], row[3])
+    return book_ids, titles, matrix
+
+
+def ensure_active_models_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_models (
+            backend TEXT PRIMARY KEY,
+            model TEXT NOT NULL
+        )
+    ''')
+
+
+def set_active_model(conn, backend, model):
+    """Record model as the vectors the other commands use for backend, see active_model"""
+    ensure_active_models_table(conn)
+    conn.execute('INSERT OR REPLACE INTO active_models (backend, model) VALUES (?, ?)', (backend, model))
+    conn.commit()
+
+
+def active_model(conn, backend, default):
+    """Model name of the vectors the last embed run for backend wrote (reduced or truncated), else default"""
+    ensure_active_models_table(conn)
+    row = conn.execute('SELECT model FROM active_models WHERE backend = ?', (backend,)).fetchone()
+    return row[0] if row else default
+
+
+def ensure_tours_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tours (
+            model TEXT NOT NULL,
+            space TEXT NOT NULL,
+            book_ids BLOB NOT NULL,
+            length REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (model, space)
+        )
+    ''')
+    conn.commit()
+
+
+def load_tour(conn, model, space):
+    """Book ids of the last saved tour for model in space ('full' or 'visual-<projection>'), in visiting order"""
+    ensure_tours_table(conn)
+    c = conn.cursor()
+    c.execute('SELECT book_ids FROM tours WHERE model = ? AND space = ?', (model, space))
+    row = c.fetchone()
+    return np.frombuffer(row[0], dtype=np.int64).tolist() if row else []
+
+
+def save_tour(conn, model, space, book_ids, length):
+    ensure_tours_table(conn)
+    conn.execute('''
+        INSERT OR REPLACE INTO tours (model, space, book_ids, length, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (model, space, np.asarray(book_ids, dtype=np.int64).tobytes(), length))
+    conn.commit()
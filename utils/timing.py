@@ -0,0 +1,173 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# write every span as a JSON trace event to this file (chrome://tracing / Perfetto format)
+TRACE_ENV = 'BOOKSHELF_TRACE'
+
+
+class Recorder:
+    """Collects the spans of one run.
+
+    Spans are aggregated by their path (the names of the enclosing spans)
+    into calls, total wall time and the process' peak resident memory when
+    the span ended, which shows the stage that raised the high-water mark.
+    With memory on, each span also gets the peak of Python allocations
+    (numpy arrays included) above what was allocated when it started.
+    That uses tracemalloc, which can make allocation-heavy stages like
+    t-SNE several times slower, so it is off unless asked for.
+    """
+    def __init__(self, memory=False, trace_path=None):
+        self.memory = memory
+        self.trace_path = trace_path
+        self.stats = {}
+        self.events = []
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def enter(self, name):
+        stack = self.stack()
+        frame = {'name': name, 'path': (stack[-1]['path'] if stack else ()) + (name,), 'peak': 0, 'base': 0,
+                 'tracked': False}
+        # peaks are only tracked on the main thread, tracemalloc has one global peak counter
+        if self.memory and threading.current_thread() is threading.main_thread():
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame.update(base=current, peak=current, tracked=True)
+        stack.append(frame)
+        frame['start'] = time.perf_counter()
+        return frame
+
+    def exit(self, frame, attrs):
+        end = time.perf_counter()
+        stack = self.stack()
+        stack.pop()
+        if frame['tracked']:
+            import tracemalloc
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], frame['peak'])
+
+        stats = self.stats.setdefault(frame['path'], {'calls': 0, 'seconds': 0.0, 'peak': 0, 'rss': 0})
+        stats['calls'] += 1
+        stats['seconds'] += end - frame['start']
+        stats['peak'] = max(stats['peak'], frame['peak'] - frame['base'])
+        stats['rss'] = max(stats['rss'], peak_rss() or 0)
+        if self.trace_path:
+            self.events.append({
+                'name': frame['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                'ts': (frame['start'] - self.origin) * 1e6, 'dur': (end - frame['start']) * 1e6,
+                'args': attrs,
+            })
+
+    def report(self):
+        """The stage breakdown as text, children indented under their parent in call order"""
+        lines = [f"{'stage':<40} {'calls':>6} {'wall s':>9} {'rss MB':>9}" + (f" {'alloc MB':>9}" if self.memory else '')]
+        for path, stats in self.stats_in_order():
+            name = '  ' * (len(path) - 1) + path[-1]
+            line = f"{name:<40} {stats['calls']:>6} {stats['seconds']:>9.3f} {stats['rss'] / 2 ** 20:>9.1f}"
+            if self.memory:
+                line += f" {stats['peak'] / 2 ** 20:>9.1f}"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def stats_in_order(self):
+        # spans finish children first, order parents before their children by first appearance
+        order = {}
+        for path in self.stats:
+            for depth in range(1, len(path) + 1):
+                order.setdefault(path[:depth], len(order))
+        return sorted(((path, self.stats[path]) for path in self.stats),
+                      key=lambda item: [order[item[0][:depth]] for depth in range(1, len(item[0]) + 1)])
+
+    def write_trace(self):
+        if not self.trace_path:
+            return
+        with open(self.trace_path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+_recorder = None
+
+
+def start(memory=False, trace_path=None):
+    """Start recording spans, returning the Recorder"""
+    global _recorder
+    _recorder = Recorder(memory, trace_path)
+    return _recorder
+
+
+def stop():
+    """Stop recording, write the trace file if there is one, and return the Recorder (or None)"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.write_trace()
+        if recorder.memory:
+            import tracemalloc
+            tracemalloc.stop()
+    return recorder
+
+
+class span:
+    """Time a stage, as a context manager or a decorator.
+
+        with span('tsp.solve', books=n):
+            ...
+
+    Does nothing unless recording was started with start(), so it can stay
+    in hot code. Keyword arguments are stored with the trace event.
+    """
+    __slots__ = ('name', 'attrs', 'frame')
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.frame = None
+
+    def __enter__(self):
+        if _recorder is not None:
+            self.frame = _recorder.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.frame is not None and _recorder is not None:
+            _recorder.exit(self.frame, self.attrs)
+        self.frame = None
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where resource is unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
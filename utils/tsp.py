@@ -1,129 +1,362 @@
-from python_tsp.heuristics import solve_tsp_simulated_annealing
-from python_tsp.exact import solve_tsp_dynamic_programming
-import matplotlib.pyplot as plt
 import sqlite3
-from sklearn.manifold import TSNE
-import matplotlib.pyplot as plt
-import pickle
-import numpy as np
-import sqlite3
-import pandas as pd
-from adjustText import adjust_text
-import ast
 import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-def no_return_dm(X):
-    distance_matrix = np.zeros((len(X), len(X)))
-    for i in range(len(X)):
-        for j in range(i,len(X)):
-            distance_matrix[i][j] = np.linalg.norm(X[i] - X[j])
-            distance_matrix[j][i] = distance_matrix[i][j]
+from utils.distance import PairDistances, distance_matrix
+from utils.backends import OpenAIBackend
+from utils.projection import project_library
+from utils.quantize import as_float32
+from utils.render import MAX_LABELS, render_tour
+from utils.sparse_tsp import plan_sparse_tour
+from utils.store import load_embeddings, load_tour, save_tour
+from utils.timing import span
 
-    distance_matrix[:, 0] = 0 # no return 
-    return distance_matrix
+def no_return_dm(X, metric='euclidean', block_size=None):
+    return distance_matrix(X, metric=metric, no_return=True, block_size=block_size)
 
-def get_titles_and_embeddings(bookshelf_loc='bookshelf.db'):
+def get_titles_and_embeddings(bookshelf_loc='bookshelf.db', model=OpenAIBackend.model):
     conn = sqlite3.connect(bookshelf_loc)
-    c = conn.cursor()
-    c.execute('SELECT * FROM books')
-    books = c.fetchall()
+    with span('tsp.load_embeddings'):
+        _, titles, embeddings = load_embeddings(conn, model)
     conn.close()
-    # get headers
-    conn = sqlite3.connect('bookshelf.db')
-    c = conn.cursor()
-    c.execute('PRAGMA table_info(books)')
-    headers = c.fetchall()
-    conn.close()
-
-    # only get title and embedding
-    headers = [header[1] for header in headers]
-    book_list = []
-    for book in books:
-        book = dict(zip(headers, book))
-        book_list.append(book)
-
-    embeddings = []
-    titles = []
-    for book in book_list:
-        embeddings.append(ast.literal_eval(book['embedding']))
-        titles.append(book['title'])
+    if not titles:
+        raise ValueError(f"No {model} embeddings found, run embed first")
     return embeddings, titles
 
 
-def visual_tsp(bookshelf_loc='bookshelf.db'):
-    
-    embeddings, titles = get_titles_and_embeddings(bookshelf_loc)
-
-    # dimensionality reduction 
-    tsne = TSNE(n_components=2, perplexity=15, random_state=10, n_iter=10000)
-    X = tsne.fit_transform(np.array(embeddings))
-
-    x,y = X[:,0], X[:,1]
-    fig, ax = plt.subplots(figsize=(11,8))
-    scatter = ax.scatter(x,y, c='k', s=10,lw=0,alpha=0.5)
-
-    texts = []
-    for x, y, title in zip(x, y, titles):
-        x_center = np.mean(x)
-        y_center = np.mean(y)
-
-        texts.append(plt.text(x , y , title,
-                            fontsize=6,
-                            horizontalalignment='center'))
-
-    # Adjust text positions with more balanced forces
-    adjust_text(texts,
-                x=x,
-                y=y,
-                arrowprops=dict(arrowstyle='->', color='gray', alpha=0.5,
-                                connectionstyle='arc3'),
-                force_text=0.3,
-                pull_threshold=0.1,
-                expand_points=(1.2, 1.2),
-                force_explode=(1.4, 1.4))
-
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.set_xticks([])
-    ax.set_yticks([])
-    plt.tight_layout()
-    
-    distance_matrix = no_return_dm(X)
-    permutation, distance = solve_tsp_simulated_annealing(distance_matrix, max_processing_time=60)
-
-    # plot tsp solution 
-    for i in range(len(permutation)-1):
-        first = i 
-        second = i + 1
-
-        plt.plot(
-            [X[:,0][permutation[first]], X[:,0][permutation[second]]],
-            [X[:,1][permutation[first]], X[:,1][permutation[second]]],
-            'tab:red',
-            ls='dashed',
-            alpha=0.75,
-        )
-        
+# largest library solved exactly, dynamic programming is O(n^2 2^n)
+EXACT_MAX = 12
+SOLVERS = ('auto', 'exact', 'greedy', 'local', 'anneal')
+
+def tour_length(distance_matrix, permutation):
+    """Length of a tour that starts at permutation[0] and returns to it at the end"""
+    permutation = np.asarray(permutation)
+    return float(distance_matrix[permutation, np.roll(permutation, -1)].sum())
+
+def nearest_neighbour_tour(distance_matrix, start=0, rng=None, candidates=3):
+    """Greedy construction: always walk to the closest unvisited book.
+
+    Given rng, each step instead picks at random among the closest
+    candidates unvisited books, giving a different tour per seed.
+    """
+    n = len(distance_matrix)
+    visited = np.zeros(n, dtype=bool)
+    permutation = np.empty(n, dtype=np.int64)
+    permutation[0] = start
+    visited[start] = True
+    for i in range(1, n):
+        row = np.where(visited, np.inf, distance_matrix[permutation[i - 1]])
+        if rng is None or n - i == 1:
+            permutation[i] = np.argmin(row)
+        else:
+            closest = np.argpartition(row, min(candidates, n - i) - 1)[:min(candidates, n - i)]
+            permutation[i] = rng.choice(closest)
+        visited[permutation[i]] = True
+    return permutation
+
+def _best_reversal(distance_matrix, p, i):
+    """End of the segment starting at i whose reversal shortens the tour most, or None"""
+    D = distance_matrix
+    a, b = p[i - 1], p[i]
+    c = p[i + 1:]
+    d = np.roll(p, -1)[i + 1:]
+    delta = D[a, c] + D[b, d] - D[a, b] - D[c, d]
+    j = np.argmin(delta)
+    return int(j) + i + 1 if delta[j] < -1e-9 else None
+
+def two_opt(distance_matrix, permutation, deadline=None):
+    """Reverse segments while that shortens the tour, keeping permutation[0] in place.
+
+    For each segment start the gain of every possible segment end is
+    computed at once with NumPy, and the best reversal is applied.
+    """
+    p = np.array(permutation)
+    n = len(p)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            if deadline is not None and time.monotonic() > deadline:
+                return p
+            j = _best_reversal(distance_matrix, p, i)
+            if j is not None:
+                p[i:j + 1] = p[i:j + 1][::-1]
+                improved = True
+    return p
+
+def or_opt(distance_matrix, permutation, deadline=None, max_segment=3):
+    """Move runs of up to max_segment books (optionally reversed) to a cheaper position"""
+    D = distance_matrix
+    p = np.array(permutation)
+    n = len(p)
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_segment + 1):
+            i = 1
+            while i + length <= n:
+                if deadline is not None and time.monotonic() > deadline:
+                    return p
+                first, last = p[i], p[i + length - 1]
+                prev, after = p[i - 1], p[(i + length) % n]
+                removal = D[prev, first] + D[last, after] - D[prev, after]
+
+                rest = np.concatenate([p[:i], p[i + length:]])
+                u, v = rest, np.roll(rest, -1)
+                forward = D[u, first] + D[last, v] - D[u, v]
+                backward = D[u, last] + D[first, v] - D[u, v]
+                k_fwd, k_bwd = np.argmin(forward), np.argmin(backward)
+                reverse = backward[k_bwd] < forward[k_fwd]
+                k = k_bwd if reverse else k_fwd
+                if min(forward[k_fwd], backward[k_bwd]) - removal < -1e-9:
+                    segment = p[i:i + length][::-1] if reverse else p[i:i + length]
+                    p = np.concatenate([rest[:k + 1], segment, rest[k + 1:]])
+                    improved = True
+                i += 1
+    return p
+
+def local_search(distance_matrix, permutation, deadline=None):
+    """Alternate 2-opt and Or-opt until neither improves the tour"""
+    best = tour_length(distance_matrix, permutation)
+    while True:
+        permutation = two_opt(distance_matrix, permutation, deadline)
+        permutation = or_opt(distance_matrix, permutation, deadline)
+        length = tour_length(distance_matrix, permutation)
+        if length >= best - 1e-9 or (deadline is not None and time.monotonic() > deadline):
+            return permutation
+        best = length
+
+def double_bridge(permutation, rng):
+    """Random 4-opt kick that local search cannot undo in one move"""
+    n = len(permutation)
+    a, b, c = np.sort(rng.choice(np.arange(1, n), 3, replace=False))
+    return np.concatenate([permutation[:a], permutation[c:], permutation[b:c], permutation[a:b]])
+
+def solve_tour(distance_matrix, solver='auto', time_limit=60, patience=50, seed=0, randomize=False):
+    """Find a short tour starting at book 0, returning (permutation, distance).
+
+    auto solves up to EXACT_MAX books exactly. Beyond that it builds a
+    nearest-neighbour tour, polishes it with 2-opt/Or-opt and keeps kicking
+    it with double-bridge moves until time_limit seconds have passed or
+    patience kicks in a row failed to improve it. With randomize the
+    construction itself is randomised by seed, for independent restarts.
+    """
+    D = np.asarray(distance_matrix)
+    n = len(D)
+    if n <= 2:
+        permutation = list(range(n))
+        return permutation, tour_length(D, permutation)
+
+    if solver == 'auto':
+        solver = 'exact' if n <= EXACT_MAX else 'local'
+    if solver == 'exact':
+        from python_tsp.exact import solve_tsp_dynamic_programming
+        return solve_tsp_dynamic_programming(D)
+    if solver == 'anneal':
+        from python_tsp.heuristics import solve_tsp_simulated_annealing
+        return solve_tsp_simulated_annealing(D, max_processing_time=time_limit)
+
+    deadline = time.monotonic() + time_limit if time_limit else None
+    rng = np.random.default_rng(seed)
+    best = nearest_neighbour_tour(D, rng=rng if randomize else None)
+    if solver == 'local' and n > 3:
+        best = local_search(D, best, deadline)
+        best_length = tour_length(D, best)
+        stale = 0
+        while stale < patience and (deadline is None or time.monotonic() < deadline):
+            candidate = local_search(D, double_bridge(best, rng), deadline)
+            length = tour_length(D, candidate)
+            if length < best_length - 1e-9:
+                best, best_length, stale = candidate, length, 0
+            else:
+                stale += 1
+
+    return [int(i) for i in best], tour_length(D, best)
+
+def _solve_worker(shm_name, shape, dtype, solver, time_limit, seed, randomize):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    D = None
+    try:
+        D = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        D.flags.writeable = False
+        permutation, distance = solve_tour(D, solver=solver, time_limit=time_limit, seed=seed,
+                                           randomize=randomize)
+        return seed, permutation, float(distance)
+    finally:
+        del D
+        shm.close()
+
+def parallel_solve(distance_matrix, workers, seed=0, solver='auto', time_limit=60):
+    """Run solve_tour with seeds seed..seed+workers-1 in a process pool and keep the shortest tour.
+
+    The matrix is placed in shared memory once and mapped read-only by every
+    worker instead of being pickled per process. The first worker starts
+    from the plain nearest-neighbour tour, the others from randomised
+    constructions. Returns the best
+    (permutation, distance) and a list of (seed, distance) for every worker.
+    The same seed repeats the same tour only when every worker stops on
+    patience before time_limit, a solve cut off by the clock ends wherever
+    it got to.
+    anneal is rejected: python_tsp takes no seed, so its restarts could not
+    be reproduced.
+    """
+    if solver == 'anneal':
+        raise ValueError("The anneal solver cannot be seeded, use it with a single worker")
+    D = np.ascontiguousarray(distance_matrix)
+    shm = shared_memory.SharedMemory(create=True, size=max(D.nbytes, 1))
+    try:
+        np.ndarray(D.shape, dtype=D.dtype, buffer=shm.buf)[:] = D
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_solve_worker, shm.name, D.shape, D.dtype, solver, time_limit, seed + k, k > 0)
+                       for k in range(workers)]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    _, permutation, distance = min(results, key=lambda result: (result[2], result[0]))
+    return (permutation, distance), [(worker_seed, length) for worker_seed, _, length in results]
+
+def insert_cheapest(distance_matrix, permutation, new):
+    """Insert each index in new where it lengthens the tour the least"""
+    D = distance_matrix
+    permutation = list(permutation)
+    for x in new:
+        p = np.asarray(permutation)
+        q = np.roll(p, -1)
+        cost = D[p, x] + D[x, q] - D[p, q]
+        permutation.insert(int(np.argmin(cost)) + 1, x)
+    return np.asarray(permutation)
+
+def polish(distance_matrix, permutation, nodes):
+    """Try 2-opt moves that remove one of the two tour edges touching each of nodes.
+
+    Costs O(n) per node rather than the O(n^2) of a full 2-opt pass, which
+    is all a tour with a few freshly inserted books needs.
+    """
+    p = np.array(permutation)
+    n = len(p)
+    for x in nodes:
+        for offset in (0, 1):
+            i = int(np.flatnonzero(p == x)[0]) + offset
+            if 1 <= i < n - 1:
+                j = _best_reversal(distance_matrix, p, i)
+                if j is not None:
+                    p[i:j + 1] = p[i:j + 1][::-1]
+    return p
+
+def plan_tour(conn, model, space, book_ids, X, solver='auto', time_limit=60, full=False,
+              workers=1, seed=0, report=None, sparse=False, neighbours=10):
+    """Tour over the rows of X, warm-started from the tour saved for (model, space).
+
+    Books that were deleted are dropped from the saved tour, new books are
+    added by cheapest insertion and then polished with 2-opt moves around
+    them, reading distances row by row without building the n x n matrix.
+    Without a saved tour, with full, or with workers > 1, the tour is
+    solved from scratch, in parallel over workers processes when there are
+    several, calling report(seed, distance) for each worker. Either way the
+    result is saved for next time.
+
+    With sparse no distance matrix is built, see plan_sparse_tour.
+    """
+    if sparse:
+        return plan_sparse_tour(conn, model, space, book_ids, X, neighbours, time_limit, full, seed)
+
+    # parallel restarts are a from-scratch search, asking for them implies full
+    full = full or workers > 1
+    index = {book_id: i for i, book_id in enumerate(book_ids)}
+    previous = [] if full else [index[book_id] for book_id in load_tour(conn, model, space) if book_id in index]
+
+    # the tour starts at the same book as before and never returns to it
+    start = previous[0] if previous else 0
+    if previous:
+        # insertion and polish read only a few rows, computed on demand instead of the full matrix
+        D = PairDistances(X, zero_column=start)
+    else:
+        with span('tsp.distance_matrix', books=len(X)):
+            D = distance_matrix(X)
+            D[:, start] = 0
+
+    if previous:
+        kept = set(previous)
+        new = [i for i in range(len(book_ids)) if i not in kept]
+        with span('tsp.insert_new', books=len(new)):
+            permutation = insert_cheapest(D, previous, new)
+        with span('tsp.polish'):
+            permutation = [int(i) for i in polish(D, permutation, new)]
+        distance = tour_length(D, permutation)
+    elif workers > 1 and len(book_ids) > EXACT_MAX and solver != 'exact':
+        with span('tsp.parallel_solve', solver=solver, workers=workers):
+            (permutation, distance), results = parallel_solve(D, workers, seed, solver, time_limit)
+        if report is not None:
+            for worker_seed, length in results:
+                report(worker_seed, length)
+    else:
+        with span('tsp.solve', solver=solver):
+            permutation, distance = solve_tour(D, solver=solver, time_limit=time_limit, seed=seed)
+
+    with span('tsp.save_tour'):
+        save_tour(conn, model, space, [book_ids[i] for i in permutation], distance)
+    return permutation, distance
+
+def visual_tsp(bookshelf_loc='bookshelf.db', model=OpenAIBackend.model, solver='auto', time_limit=60, full=False,
+               workers=1, seed=0, report=None, sparse=False, neighbours=10, projection='pca-tsne', refit=False,
+               fmt='png', dpi=200, max_labels=MAX_LABELS, loaded=None):
+    """Tour in a 2D projection of the library, drawn to a dated image file.
+
+    loaded is an optional (book_ids, titles, vectors) already in memory,
+    as returned by load_embeddings, so a long-running process (books serve)
+    does not read the vectors back on every call.
+    """
+    conn = sqlite3.connect(bookshelf_loc)
+    with span('tsp.load_embeddings'):
+        book_ids, titles, embeddings = loaded or load_embeddings(conn, model)
+        embeddings = as_float32(embeddings)
+    if not titles:
+        raise ValueError(f"No {model} embeddings found, run embed first")
+
+    # dimensionality reduction, reusing stored coordinates for unchanged books
+    with span('tsp.projection', method=projection):
+        X, refitted = project_library(conn, model, book_ids, embeddings, projection, refit)
+
+    # each projection has its own layout and so its own saved tour, and a refit starts the layout over
+    with span('tsp.plan', books=len(book_ids), sparse=sparse):
+        permutation, distance = plan_tour(conn, model, f'visual-{projection}', book_ids, X, solver, time_limit,
+                                          full or refitted, workers, seed, report, sparse, neighbours)
+    conn.close()
+
     date = time.strftime('%Y-%m-%d %H:%M:%S')
-    path = f'{date}_tsp.png'
-    plt.savefig(path,dpi=600)
+    with span('tsp.render', format=fmt):
+        path = render_tour(X, titles, permutation, f'{date}_tsp.{fmt}', fmt, dpi, max_labels)
 
     tour = [titles[i] for i in permutation]
     tour = [f'{i+1}. {book}' for i,book in enumerate(tour)]
 
     return tour,path
 
-def fullspace_tsp(bookshelf_loc='bookshelf.db'):
-    embeddings, titles = get_titles_and_embeddings(bookshelf_loc)
-    distance_matrix = no_return_dm(np.array(embeddings))
-    permutation, distance = solve_tsp_simulated_annealing(distance_matrix, max_processing_time=60)
+def fullspace_tsp(bookshelf_loc='bookshelf.db', model=OpenAIBackend.model, solver='auto', time_limit=60, full=False,
+                  workers=1, seed=0, report=None, sparse=False, neighbours=10, loaded=None):
+    """Tour in the full embedding space, written to a dated text file. loaded is as for visual_tsp."""
+    conn = sqlite3.connect(bookshelf_loc)
+    # the dense distance matrix is computed straight from int8 vectors, the sparse search needs floats
+    with span('tsp.load_embeddings'):
+        book_ids, titles, embeddings = loaded or load_embeddings(conn, model, compact=True)
+        if sparse:
+            embeddings = as_float32(embeddings)
+    if not titles:
+        raise ValueError(f"No {model} embeddings found, run embed first")
+    with span('tsp.plan', books=len(book_ids), sparse=sparse):
+        permutation, distance = plan_tour(conn, model, 'full', book_ids, embeddings, solver, time_limit, full,
+                                          workers, seed, report, sparse, neighbours)
+    conn.close()
     tour = [titles[i] for i in permutation]
     date = time.strftime('%Y-%m-%d %H:%M:%S')
     path = f'{date}_tour.txt'
-    with open(path,'w') as f:
-        for i in range(len(tour)):
-            f.write(f'{i+1}. {tour[i]}\n')
+    with span('tsp.write'):
+        with open(path,'w') as f:
+            for i in range(len(tour)):
+                f.write(f'{i+1}. {tour[i]}\n')
 
     return tour, path